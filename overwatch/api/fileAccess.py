@@ -3,15 +3,20 @@
 # For python 3 support
 from __future__ import print_function
 from future.utils import iteritems
-from future.utils import itervalues
 
 import os
+import re
 # Python logging system
 import logging
 
 # Configuration
 from overwatch.base import config
+from overwatch.base import chunkedUpload
 from overwatch.base import storageWrapper
+from overwatch.base import utilities
+from overwatch.processing import processingClasses
+from overwatch.processing import runArchive
+from overwatch.processing import histogramExtraction
 (apiParameters, filesRead) = config.readConfig(config.configurationType.api)
 
 # Setup logger
@@ -20,22 +25,46 @@ logger = logging.getLogger(__name__)
 # Alternatively, we could set "overwatch.receiver" to get everything derived from that
 #logger = logging.getLogger("overwatch.receiver")
 
-from flask import Flask, request, send_file, make_response
+from flask import Flask, request, send_file, make_response, Response, stream_with_context
 import flask_restful
 import flask_zodb
-from io import StringIO
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 api = flask_restful.Api(app)
 
-app.config["ZODB_STORAGE"] = apiParameters["databaseLocation"]
+# The API only reads from the database, so the storage is opened read-only when possible. Changes from other
+# processes are only visible to read-only storages which are served via ZEO.
+readOnlyDatabase = apiParameters["apiReadOnlyDatabase"]
+if readOnlyDatabase is None:
+    readOnlyDatabase = apiParameters["databaseLocation"].startswith("zeo://")
+app.config["ZODB_STORAGE"] = utilities.resolveDatabaseLocation(apiParameters["databaseLocation"],
+                                                               readOnly = readOnlyDatabase,
+                                                               cacheSize = apiParameters["databaseCacheSize"],
+                                                               poolSize = apiParameters["databasePoolSize"])
 #app.config["ZODB_STORAGE"] = "file://../../data/overwatch.fs"
 db = flask_zodb.ZODB(app)
 #dirPrefix = "dirPrefixPlaceholder"
 
 # Handle storage
-openFile = storageWrapper.defineFileAccess("data")
+storageLocation = apiParameters["dataFolder"]
+openFile = storageWrapper.defineFileAccess(storageLocation)
+
+# Cache of histograms extracted from files
+histogramCache = histogramExtraction.histogramCache(cacheSize = apiParameters["apiHistogramCacheSize"])
+
+def listingLimit(default):
+    """ Determine the maximum number of entries to list, as requested via the ``limit`` GET parameter.
+
+    The requested limit is restricted to between 1 and ``apiMaxListingSize``.
+
+    Args:
+        default (int): Limit to use if it isn't requested.
+    Returns:
+        int: Maximum number of entries to list.
+    """
+    limit = request.args.get("limit", default = default, type = int)
+    return max(1, min(limit, apiParameters["apiMaxListingSize"]))
 
 class Runs(flask_restful.Resource):
     def get(self, run = None):
@@ -45,9 +74,23 @@ class Runs(flask_restful.Resource):
         runs = db["runs"]
         response = {}
         if not run:
-            # List runs
-            response["runs"] = list(runs.keys())
-            print("response: {0}".format(response))
+            # List runs, most recent first, via the run index so that only the listed runs are checked.
+            # The list can be continued from ``nextRun``.
+            runIndex = db.get("runIndex")
+            if runIndex is None:
+                runIndex = processingClasses.runListIndex.fromRuns(runs)
+            hasCombinedFile = request.args.get("hasCombinedFile", default = None)
+            (summaries, nextRun) = runIndex.selectRuns(runs,
+                                                       runNumber = request.args.get("firstRun", default = None, type = int),
+                                                       numberOfRuns = listingLimit(default = 100),
+                                                       maxRunsToCheck = apiParameters["apiMaxRunsToCheck"],
+                                                       minTime = request.args.get("minTime", default = None, type = int),
+                                                       maxTime = request.args.get("maxTime", default = None, type = int),
+                                                       hltMode = request.args.get("hltMode", default = None),
+                                                       subsystem = request.args.get("subsystem", default = None),
+                                                       hasCombinedFile = hasCombinedFile.lower() == "true" if hasCombinedFile is not None else None)
+            response["runs"] = [summary.runDir for summary in summaries]
+            response["nextRun"] = nextRun
             return response
 
         # Return information on a particular run
@@ -59,18 +102,76 @@ class Runs(flask_restful.Resource):
         # NOT IMPLEMENTED
         pass
 
+def attachmentHeader(filename):
+    """ Create the ``Content-Disposition`` header value for downloading a file. """
+    return "attachment; filename={filename}".format(filename = os.path.basename(filename))
+
+def fileResponse(filename):
+    """ Create a response which streams a file from the storage, without reading it into memory.
+
+    Local files are served via ``send_file(...)`` using the path, so the WSGI server can send it directly from the
+    file (for example, via ``sendfile``). If ``apiAccelRedirectPrefix`` is set, the file is instead served by
+    nginx via ``X-Accel-Redirect``, and the API only returns the headers. Files stored via XRootD are streamed in
+    chunks of ``apiStreamChunkSize``. In all cases, HTTP Range requests are supported, such that a client can
+    read only part of a file.
+
+    Args:
+        filename (str): Path to the file, relative to the storage location.
+    Returns:
+        Response: Response which streams the file.
+    """
+    if storageWrapper.isXRDPath(storageLocation):
+        return xrdFileResponse(filename)
+
+    if apiParameters["apiAccelRedirectPrefix"]:
+        # nginx serves the file (including handling range requests) from an internal location.
+        response = make_response("")
+        response.headers["X-Accel-Redirect"] = "{prefix}/{filename}".format(prefix = apiParameters["apiAccelRedirectPrefix"].rstrip("/"),
+                                                                            filename = filename)
+        response.headers["Content-Type"] = "application/octet-stream"
+    else:
+        # ``conditional`` enables handling range requests.
+        response = send_file(os.path.join(os.path.realpath(storageLocation), filename),
+                             mimetype = "application/octet-stream", conditional = True)
+    response.headers["Content-Disposition"] = attachmentHeader(filename)
+    return response
+
+def xrdFileResponse(filename):
+    """ Create a response which streams a file stored via XRootD in chunks.
+
+    Args:
+        filename (str): Path to the file, relative to the storage location.
+    Returns:
+        Response: Response which streams the file (or the requested range of it).
+    """
+    fullPath = os.path.join(storageLocation, filename)
+    size = storageWrapper.XRDFileSize(fullPath)
+    headers = {"Content-Disposition": attachmentHeader(filename), "Accept-Ranges": "bytes"}
+    status = 200
+    (start, stop) = (0, size)
+    if request.range is not None:
+        requestedRange = request.range.range_for_length(size)
+        if requestedRange is None:
+            headers["Content-Range"] = "bytes */{size}".format(size = size)
+            return Response(status = 416, headers = headers)
+        (start, stop) = requestedRange
+        headers["Content-Range"] = request.range.to_content_range_header(size)
+        status = 206
+    headers["Content-Length"] = str(stop - start)
+
+    return Response(stream_with_context(storageWrapper.streamXRDFile(fullPath, start = start, length = stop - start,
+                                                                     chunkSize = apiParameters["apiStreamChunkSize"])),
+                    status = status, mimetype = "application/octet-stream", headers = headers)
+
 def responseForSendingFile(filename = None, response = None, additionalHeaders = {}):
     if not filename and not response:
         response = make_response()
 
     # Open file and make response if requested
     if filename and not response:
-        # TODO: Handle various file sources
         # TODO: Use safe_join
         #response = make_response(send_from_directory(os.path.realpath(apiParameters["dirPrefix"]), filename))
-        print("About to open file with new function")
-        with openFile(filename, "r") as f:
-            response = make_response(send_file(f, attachment_filename = filename, as_attachment = True))
+        response = fileResponse(filename)
 
     # Add requested filenames
     if "filenames" in additionalHeaders:
@@ -93,12 +194,25 @@ class FilesAccess(flask_restful.Resource):
         responseHeaders["filenames"] = []
 
         # Return the filename for the particular run
-        subsystemContainer = db["runs"]["Run{0}".format(run)].subsystems[subsystem]
+        try:
+            subsystemContainer = runArchive.retrieveRun(db["runs"], "Run{0}".format(run), cacheSize = apiParameters["runArchiveCacheSize"]).subsystems[subsystem]
+        except runArchive.RunDataUnavailable as e:
+            response = responseForSendingFile(additionalHeaders = responseHeaders)
+            response.headers["error"] = str(e)
+            response.status_code = 404
+            return response
 
         # Handle special cases
         if not filename:
-            # Return the available files
-            responseHeaders["filenames"] = [tempFile.filename.split("/")[-1] for tempFile in subsystemContainer.files.values()]
+            # Return the available files, optionally restricted to a range of unix times.
+            # The files are listed from oldest to newest, and the list can be continued from ``nextMinTime``.
+            maxFiles = listingLimit(default = apiParameters["apiMaxListingSize"])
+            files = subsystemContainer.filesInTimeRange(minTime = request.args.get("minTime", default = None, type = int),
+                                                        maxTime = request.args.get("maxTime", default = None, type = int),
+                                                        maxFiles = maxFiles + 1)
+            responseHeaders["filenames"] = [os.path.basename(tempFile.filename) for tempFile in files[:maxFiles]]
+            if len(files) > maxFiles:
+                responseHeaders["nextMinTime"] = files[-1].fileTime
             return responseForSendingFile(additionalHeaders = responseHeaders)
         elif filename == "combined":
             # Return the combined file
@@ -110,11 +224,8 @@ class FilesAccess(flask_restful.Resource):
         #filename = secure_filename(filename)
 
         # Look for the file
-        print(next(itervalues(subsystemContainer.files)).filename)
-        try:
-            requestedFile = next(fileContainer for fileContainer in subsystemContainer.files.values() if fileContainer.filename.split("/")[-1] == filename)
-        except StopIteration:
-            print("Stop iteration error!")
+        requestedFile = subsystemContainer.fileByFilename(filename)
+        if requestedFile is None:
             response = responseForSendingFile(additionalHeaders = responseHeaders)
             response.headers["error"] = "Could not find requested file {0}".format(filename)
             response.status_code = 404
@@ -122,27 +233,8 @@ class FilesAccess(flask_restful.Resource):
 
         print("filename for requested file: {}".format(os.path.join(apiParameters["dirPrefix"], requestedFile.filename)))
         responseHeaders["filenames"].append(os.path.join(apiParameters["dirPrefix"], requestedFile.filename))
-        #f = open(os.path.join(apiParameters["dirPrefix"], requestedFile.filename))
-        #return make_response(send_file(f, as_attachment = True, attachment_filename = filename))
-        #with open(os.path.join(apiParameters["dirPrefix"], requestedFile.filename)) as f:
-        with openFile(requestedFile.filename, "rb") as f:
-            # If StringIO is not used here then the file will go out of scope and be closed before the
-            # response is completed, which leads to "ValueError: I/O operation on closed file".
-            # I cannot seem to find a way around this. However, the file cannot just be opened, as otherwise
-            # it will leak memory.
-            # For more, see: https://stackoverflow.com/q/13344538 (no definitive solution)
-            #                https://stackoverflow.com/a/25150805 (gave me the idea to just create a new StringIO)
-            # StringIO was selected based on https://stackoverflow.com/a/37463095
-            return make_response(send_file(StringIO.StringIO(f.read()), as_attachment = True, attachment_filename = filename))
-
-        #with openFile(requestedFile.filename, "rb") as f:
-        #    f.seek(0)
-        #    def readFile(*args, **kwargs):
-        #        for chunk in iter(lambda: f.read(4096), b''):
-        #            yield chunk
-        #    return Response(stream_with_context(readFile()))
-            #return make_response(send_file(f, attachment_filename = filename, as_attachment = True))
-        #return responseForSendingFile(filename = requestedFile.filename, additionalHeaders = responseHeaders)
+        # The file is streamed rather than read into memory, so large files don't need to fit in memory.
+        return responseForSendingFile(filename = requestedFile.filename, additionalHeaders = responseHeaders)
 
     def put(self, run, subsystem, filename):
         # Decided on put based on https://stackoverflow.com/a/630475
@@ -151,9 +243,30 @@ class FilesAccess(flask_restful.Resource):
         # Just to be safe!
         filename = secure_filename(filename)
 
+        outputPath = os.path.join("Run{0}".format(run), subsystem, filename)
+        if storageWrapper.isXRDPath(storageLocation):
+            # The files are streamed to a partial file and then moved into place, which is only possible locally.
+            return {"error": "Uploads are only available for local storage."}, 501
+
         # Store passed file
+        # The file is streamed to a partial file and moved into place once it is complete, so incomplete files
+        # are never visible, and the upload is never held in memory.
         savedFile = False
-        if "file" in request.files:
+        try:
+            uploadParameters = chunkedUpload.chunkParameters(request.headers)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        if uploadParameters is not None:
+            # Handle a chunk of a file which is sent in multiple requests. The chunk is the body of the request.
+            # See ``overwatch.base.chunkedUpload``.
+            try:
+                (offset, savedFile) = chunkedUpload.writeChunk(request.stream, os.path.join(storageLocation, outputPath), **uploadParameters)
+            except chunkedUpload.OffsetMismatch as e:
+                return {"error": str(e), "uploadOffset": e.offset}, 409
+            except chunkedUpload.ChecksumMismatch as e:
+                return {"error": str(e), "uploadOffset": e.offset}, 400
+            return {"uploadOffset": offset, "complete": savedFile}
+        elif "file" in request.files:
             # Handle multi-part file request
             # This is the preferred method!
 
@@ -167,24 +280,114 @@ class FilesAccess(flask_restful.Resource):
             #payloadFile.seek(0)
 
             # Save it out
-            # TODO: Handle writing to the proper source
-            outputPath = os.path.join("Run{0}".format(run), subsystem, filename)
-            #payloadFile.save(outputPath)
-
-            with openFile(outputPath, "w+") as f:
-                f.write(payloadFile.read().encode())
-
-            savedFile = True
+            savedFile = chunkedUpload.saveStream(payloadFile.stream, os.path.join(storageLocation, outputPath)) > 0
         else:
             savedFile = False
             raise ValueError("No valid file passed.")
 
         return savedFile
 
+class Histograms(flask_restful.Resource):
+    """ Selected histograms extracted from the files of a subsystem, for one or more runs.
+
+    Only the requested histograms are returned, so it is much cheaper than retrieving the entire files.
+
+    Note:
+        Function args are provided through the flask request object.
+
+    Args:
+        subsystem (str): Name of the subsystem.
+        runs (str): Comma separated run numbers.
+        filename (str): Name of the file from which the histograms are extracted. Default: ``combined``,
+            which selects the combined file of each run.
+        hist (str): Name of a requested histogram. It may be given multiple times.
+        pattern (str): Regular expression to select histograms by name.
+        format (str): ``npz`` for a ``numpy`` archive of the bin contents, errors, and edges (stored as
+            ``Run{runNumber}/{histName}/{arrayName}``), or ``json`` for ``TBufferJSON``. Default: ``npz``.
+    Returns:
+        Response: The extracted histograms in the requested format. Runs which are not available (including
+            those whose file is missing) are listed in the ``missingRuns`` header. If none of the runs are
+            available, a 404 is returned. Invalid arguments, or requests for more runs or histograms than
+            allowed (``apiMaxHistogramRuns`` and ``apiMaxHistograms``), return a 400.
+    """
+    def get(self, subsystem):
+        try:
+            runNumbers = [int(run) for run in request.args.get("runs", default = "").split(",") if run.strip()]
+        except ValueError:
+            return {"error": "Run numbers {} are invalid.".format(request.args.get("runs"))}, 400
+        if not runNumbers:
+            return {"error": "No runs were requested."}, 400
+        if len(runNumbers) > apiParameters["apiMaxHistogramRuns"]:
+            return {"error": "{} runs were requested, but at most {} are allowed.".format(len(runNumbers), apiParameters["apiMaxHistogramRuns"])}, 400
+        requestedFilename = request.args.get("filename", default = "combined")
+        names = request.args.getlist("hist")
+        if len(names) > apiParameters["apiMaxHistograms"]:
+            return {"error": "{} histograms were requested, but at most {} are allowed.".format(len(names), apiParameters["apiMaxHistograms"])}, 400
+        pattern = request.args.get("pattern", default = None)
+        if pattern:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                return {"error": "Pattern {} is invalid: {}".format(pattern, e)}, 400
+        outputFormat = request.args.get("format", default = "npz")
+        if outputFormat not in histogramExtraction.outputFormats:
+            return {"error": "Format {} is not supported. Options: {}".format(outputFormat, histogramExtraction.outputFormats)}, 400
+        if storageWrapper.isXRDPath(storageLocation):
+            return {"error": "Histogram extraction is only available for local storage."}, 501
+
+        histograms = {}
+        missingRuns = []
+        nHistograms = 0
+        runs = db["runs"]
+        for runNumber in runNumbers:
+            runDir = "Run{0}".format(runNumber)
+            if runDir not in runs:
+                missingRuns.append(runNumber)
+                continue
+            try:
+                run = runArchive.retrieveRun(runs, runDir, cacheSize = apiParameters["runArchiveCacheSize"])
+            except runArchive.RunDataUnavailable as e:
+                logger.warning(e)
+                missingRuns.append(runNumber)
+                continue
+            subsystemContainer = run.subsystems.get(subsystem)
+            if subsystemContainer is None:
+                missingRuns.append(runNumber)
+                continue
+            fileContainer = subsystemContainer.combinedFile if requestedFilename == "combined" else subsystemContainer.fileByFilename(requestedFilename)
+            if fileContainer is None:
+                missingRuns.append(runNumber)
+                continue
+            # The number of histograms is limited across all of the runs.
+            try:
+                histograms[runDir] = histogramExtraction.extractHistograms(os.path.join(storageLocation, fileContainer.filename),
+                                                                           names = names, pattern = pattern,
+                                                                           outputFormat = outputFormat, cache = histogramCache,
+                                                                           maxHistograms = apiParameters["apiMaxHistograms"] - nHistograms)
+            except IOError as e:
+                logger.warning(e)
+                missingRuns.append(runNumber)
+                continue
+            except ValueError as e:
+                return {"error": "Too many histograms were selected. {}".format(e)}, 400
+            nHistograms += len(histograms[runDir])
+
+        headers = {"missingRuns": ";".join(str(runNumber) for runNumber in missingRuns)}
+        if not histograms:
+            return {"error": "None of the requested runs are available."}, 404, headers
+        if outputFormat == "json":
+            return histograms, 200, headers
+
+        response = send_file(histogramExtraction.writeNpz(histograms), mimetype = "application/octet-stream")
+        response.headers["Content-Disposition"] = attachmentHeader("{subsystem}Histograms.npz".format(subsystem = subsystem))
+        response.headers.extend(headers)
+        return response
+
 api.add_resource(FilesAccess, "/rest/api/v1/files/<int:run>/<string:subsystem>",
                               "/rest/api/v1/files/<int:run>/<string:subsystem>/<string:filename>")
 # Redundant view
 #api.add_resource(FilesAccess, "/rest/api/v1/files/<int:run>")
+api.add_resource(Histograms, "/rest/api/v1/histograms/<string:subsystem>")
 api.add_resource(Runs, "/rest/api/v1/runs",
                        "/rest/api/v1/runs/<int:run>")
 #api.add_resource(Run, "/rest/api/v1/runs/<int:run>")
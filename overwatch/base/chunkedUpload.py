@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+""" Receive uploaded files in chunks, such that interrupted uploads can be resumed.
+
+Files are always written from the request stream to a partial file in the ``.partialUploads`` directory next
+to the destination, and are moved into place (atomically, via ``os.rename``) once they are complete. Consequently,
+uploads are never held in memory, and incomplete files are never picked up by the processing. The data is synced
+to disk before it is acknowledged.
+
+A chunked upload is sent as a series of requests, each containing the ``uploadOffset`` of the chunk within the
+file and the total ``uploadLength`` of the file. Each chunk may be verified via the sha256 hash of its content
+(``chunkChecksum``), and the full file via the sha256 hash of its content (``fileChecksum``), which is checked
+when the final chunk is received. If a chunk doesn't start at the end of the data which has already been
+received, it is rejected, and the client should resume from the returned offset. A chunk at offset 0 restarts
+the upload. If the final chunk is sent again after the upload was completed (for example, because the response
+was lost), the completed file is reported instead. Chunks of the same file are written one at a time, even if they are received by different processes
+(for example, by different uwsgi workers), via an exclusive lock on a lock file next to the partial file.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+from __future__ import absolute_import
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+#: Name of the directory where partial uploads are stored, relative to the destination directory.
+partialUploadsDirectory = ".partialUploads"
+
+class OffsetMismatch(Exception):
+    """ Raised if a chunk doesn't start at the end of the data which has already been received.
+
+    Args:
+        offset (int): Offset from where the upload should continue.
+
+    Attributes:
+        offset (int): Offset from where the upload should continue.
+    """
+    def __init__(self, offset):
+        super(OffsetMismatch, self).__init__("Upload should continue from offset {offset}".format(offset = offset))
+        self.offset = offset
+
+class ChecksumMismatch(Exception):
+    """ Raised if the received data doesn't match the provided checksum.
+
+    Args:
+        message (str): Description of the mismatch.
+        offset (int): Offset from where the upload should continue.
+
+    Attributes:
+        offset (int): Offset from where the upload should continue.
+    """
+    def __init__(self, message, offset):
+        super(ChecksumMismatch, self).__init__(message)
+        self.offset = offset
+
+def chunkParameters(headers):
+    """ Extract the parameters of a chunked upload from the request headers.
+
+    Args:
+        headers (dict): Request headers.
+    Returns:
+        dict: Keyword arguments for ``writeChunk(...)`` (``offset``, ``length``, ``chunkChecksum``, and
+            ``fileChecksum``), or ``None`` if the request isn't part of a chunked upload.
+    Raises:
+        ValueError: If the offset or length are not valid.
+    """
+    if "uploadOffset" not in headers:
+        return None
+    parameters = {
+        "offset": int(headers["uploadOffset"]),
+        "length": int(headers.get("uploadLength", -1)),
+        "chunkChecksum": headers.get("chunkChecksum", None),
+        "fileChecksum": headers.get("fileChecksum", None),
+    }
+    if parameters["offset"] < 0 or parameters["length"] < parameters["offset"]:
+        raise ValueError("Invalid upload offset {offset} and length {length}".format(**parameters))
+    return parameters
+
+def partialFilename(outputPath):
+    """ Determine where a partially received file is stored.
+
+    Args:
+        outputPath (str): Destination of the file.
+    Returns:
+        str: Path to the partial file.
+    """
+    return os.path.join(os.path.dirname(outputPath), partialUploadsDirectory, os.path.basename(outputPath))
+
+def receivedOffset(outputPath):
+    """ Determine how much of a file has already been received.
+
+    Args:
+        outputPath (str): Destination of the file.
+    Returns:
+        int: Number of bytes which have been received. 0 if no upload is in progress.
+    """
+    try:
+        return os.path.getsize(partialFilename(outputPath))
+    except OSError:
+        return 0
+
+@contextlib.contextmanager
+def _uploadLock(partialPath):
+    """ Hold an exclusive lock on the upload of a file, waiting until it is available.
+
+    The lock is held on a separate lock file (``{partialPath}.lock``), since the partial file is replaced and moved.
+    If there is no partial file when the lock is released (ie. the upload is complete or was discarded), the lock file
+    is no longer needed, so it is removed by the process holding the lock. It is only removed after the partial file,
+    such that a new request can't observe the partial file without holding the lock. Any process which was waiting
+    for the lock then holds a lock on a removed file, so it must lock the new lock file instead.
+
+    Args:
+        partialPath (str): Path to the partial file.
+    Yields:
+        str: Path to the lock file.
+    """
+    lockPath = partialPath + ".lock"
+    while True:
+        fd = os.open(lockPath, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_ino == os.stat(lockPath).st_ino:
+                break
+        except OSError:
+            # The lock file was removed while we were waiting.
+            pass
+        os.close(fd)
+    try:
+        yield lockPath
+    finally:
+        try:
+            if not os.path.exists(partialPath):
+                os.remove(lockPath)
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
+
+def _copyStream(stream, fOut, bufferSize, maxLength = None):
+    """ Copy the stream into a file, hashing the data as it is copied.
+
+    Args:
+        stream (file): Stream to read from.
+        fOut (file): File to write to.
+        bufferSize (int): Maximum number of bytes to read at once.
+        maxLength (int): Maximum number of bytes to copy. Default: ``None``, which copies the entire stream.
+    Returns:
+        tuple: (length, hash) where length (int) is the number of bytes copied, and hash is the sha256 hash object.
+    """
+    length = 0
+    dataHash = hashlib.sha256()
+    while True:
+        data = stream.read(bufferSize)
+        if not data:
+            break
+        length += len(data)
+        if maxLength is not None and length > maxLength:
+            raise ValueError("Received more data than the length of the upload")
+        dataHash.update(data)
+        fOut.write(data)
+    return (length, dataHash)
+
+def _sync(fOut):
+    """ Flush a file to disk, such that the data is stored durably. """
+    fOut.flush()
+    os.fsync(fOut.fileno())
+
+def _fileChecksum(filename, bufferSize):
+    """ Calculate the sha256 hash of a file, reading it in blocks. """
+    fileHash = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for data in iter(lambda: f.read(bufferSize), b""):
+            fileHash.update(data)
+    return fileHash.hexdigest()
+
+def _isCompleted(outputPath, length, fileChecksum, bufferSize):
+    """ Check whether an upload was already completed and moved into place.
+
+    Args:
+        outputPath (str): Destination of the file.
+        length (int): Total length of the file.
+        fileChecksum (str): sha256 hash (hex digest) of the content of the full file. It is only checked if provided.
+        bufferSize (int): Maximum number of bytes to hold in memory at once.
+    Returns:
+        bool: True if the file at ``outputPath`` matches the upload.
+    """
+    try:
+        if os.path.getsize(outputPath) != length:
+            return False
+    except OSError:
+        return False
+    return fileChecksum is None or _fileChecksum(outputPath, bufferSize) == fileChecksum.lower()
+
+def writeChunk(stream, outputPath, offset, length, chunkChecksum = None, fileChecksum = None, bufferSize = 1048576):
+    """ Write a chunk of an upload, moving the file into place once it is complete.
+
+    Args:
+        stream (file): Stream containing the data of the chunk (for example, ``request.stream``).
+        outputPath (str): Destination of the file.
+        offset (int): Offset of the chunk within the file.
+        length (int): Total length of the file.
+        chunkChecksum (str): sha256 hash (hex digest) of the content of the chunk. Default: ``None``.
+        fileChecksum (str): sha256 hash (hex digest) of the content of the full file. It is checked once the
+            upload is complete. Default: ``None``.
+        bufferSize (int): Maximum number of bytes to hold in memory at once. Default: 1 MB.
+    Returns:
+        tuple: (offset, complete) where offset (int) is the offset from where the upload should continue, and
+            complete (bool) is True if the file is complete and has been moved to ``outputPath``.
+    Raises:
+        OffsetMismatch: If the chunk doesn't start at the end of the data which has already been received.
+        ChecksumMismatch: If the chunk or the file doesn't match its checksum.
+        ValueError: If more data than the length of the file is received.
+    """
+    partialPath = partialFilename(outputPath)
+    if not os.path.exists(os.path.dirname(partialPath)):
+        try:
+            os.makedirs(os.path.dirname(partialPath))
+        except OSError:
+            # It may have been created concurrently by another process.
+            if not os.path.isdir(os.path.dirname(partialPath)):
+                raise
+
+    # The offset must be checked and the chunk written while holding the lock, such that concurrent requests for
+    # the same file can't both write at the same offset.
+    with _uploadLock(partialPath):
+        currentOffset = receivedOffset(outputPath)
+        if offset != 0 and offset != currentOffset:
+            # The final chunk may be sent again if the response was lost, after the file was already moved into place.
+            if not os.path.exists(partialPath) and _isCompleted(outputPath, length, fileChecksum, bufferSize):
+                logger.info("Upload of {outputPath} was already completed".format(outputPath = outputPath))
+                return (length, True)
+            raise OffsetMismatch(currentOffset)
+
+        with open(partialPath, "r+b" if offset != 0 else "wb") as fOut:
+            fOut.seek(offset)
+            try:
+                (chunkLength, chunkHash) = _copyStream(stream, fOut, bufferSize = bufferSize, maxLength = length - offset)
+                if chunkChecksum is not None and chunkHash.hexdigest() != chunkChecksum.lower():
+                    raise ChecksumMismatch("Chunk at offset {offset} doesn't match the checksum".format(offset = offset), offset)
+            except Exception:
+                # Discard the partially written chunk so that it can be sent again.
+                fOut.truncate(offset)
+                raise
+            fOut.truncate(offset + chunkLength)
+            # Ensure that the chunk is stored durably before the offset is reported to the client.
+            _sync(fOut)
+
+        newOffset = offset + chunkLength
+        if newOffset < length:
+            return (newOffset, False)
+
+        if fileChecksum is not None and _fileChecksum(partialPath, bufferSize) != fileChecksum.lower():
+            # We can't tell which chunk was corrupted, so the upload must be restarted.
+            os.remove(partialPath)
+            raise ChecksumMismatch("Received file doesn't match the checksum", 0)
+
+        os.rename(partialPath, outputPath)
+    logger.info("Completed upload of {outputPath}".format(outputPath = outputPath))
+    return (newOffset, True)
+
+def saveStream(stream, outputPath, bufferSize = 1048576):
+    """ Save an upload which is sent in a single request.
+
+    The data is copied in blocks to a partial file, which is moved into place once it is complete.
+
+    Args:
+        stream (file): Stream containing the data (for example, ``request.stream``).
+        outputPath (str): Destination of the file.
+        bufferSize (int): Maximum number of bytes to hold in memory at once. Default: 1 MB.
+    Returns:
+        int: Number of bytes which were received. If no data was received, the file isn't created.
+    """
+    partialPath = partialFilename(outputPath)
+    if not os.path.exists(os.path.dirname(partialPath)):
+        os.makedirs(os.path.dirname(partialPath))
+
+    try:
+        with open(partialPath, "wb") as fOut:
+            (length, _) = _copyStream(stream, fOut, bufferSize = bufferSize)
+            _sync(fOut)
+        if length:
+            os.rename(partialPath, outputPath)
+    finally:
+        if os.path.exists(partialPath):
+            os.remove(partialPath)
+    return length
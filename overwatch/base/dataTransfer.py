@@ -3,7 +3,10 @@
 """ Handle and move files from the receiver(s) to Overwatch sites and EOS.
 
 This simple module is responsible for moving data which is provided by the receiver to other
-sites. It will retry a few times if sites are unavailable.
+sites. It will retry a few times if sites are unavailable. The transfers to each site are performed
+concurrently, such that a slow site doesn't delay the others, and each file is removed locally as soon as
+it has been handled by every site. Files which fail are stored and recorded in the transfer ledger
+(see ``overwatch.base.transferLedger``), and are retried automatically with an exponential backoff.
 
 We take a simple approach of determine which files to transfer, and then moving them to the
 appropriate locations. We could try to use something like ``watchdog`` to do something more
@@ -27,9 +30,14 @@ import time
 import shutil
 import subprocess
 import tempfile
+import threading
 import functools
+import multiprocessing.pool
 
 import ROOT
+# Files are copied to EOS concurrently.
+if hasattr(ROOT, "EnableThreadSafety"):
+    ROOT.EnableThreadSafety()
 
 # Logging
 import logging
@@ -38,6 +46,12 @@ logger = logging.getLogger(__name__)
 # Config
 from . import config
 (parameters, filesRead) = config.readConfig(config.configurationType.processing)
+from . import transferLedger
+
+#: Record of the files which failed to transfer, so that they can be retried.
+ledger = transferLedger.transferLedger(filename = parameters["dataTransferLedger"],
+                                       retryDelay = parameters["dataTransferRetryDelay"],
+                                       maxRetryDelay = parameters["dataTransferMaxRetryDelay"])
 
 def retry(tries, delay = 3, backoff = 2):
     """ Retries a function or method until it returns ``True`` or runs out of retries.
@@ -140,6 +154,36 @@ def determineFilesToMove(directory):
     # NOTE: See the information above about why we explicitly select on ``endswith("root")``.
     return [f for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f)) and f.endswith(".root")]
 
+def rsyncTuningOptions():
+    """ Determine the rsync options for compression, partial transfers, and the ssh connection.
+
+    The options are set via the configuration:
+
+    - ``dataTransferRsyncCompressLevel``: Compress the data in transit at the given level. ROOT files are already
+      compressed, so this is only worthwhile for slow links. ``null`` disables compression.
+    - ``dataTransferRsyncPartialDir``: Keep partially transferred files in this directory (relative to the
+      destination), so an interrupted transfer resumes from where it stopped when it is retried. The
+      directory is hidden so that the partial files aren't picked up by the processing. ``null`` disables it.
+    - ``dataTransferSSHControlPath``: Reuse a persistent, multiplexed ssh connection (via ``ControlMaster``)
+      stored at this path, so that each transfer doesn't need to establish a new connection. It is kept open
+      for ``dataTransferSSHControlPersist`` seconds after the last transfer. ``null`` disables it.
+
+    Args:
+        None.
+    Returns:
+        list: Options to pass to rsync.
+    """
+    options = []
+    if parameters["dataTransferRsyncCompressLevel"] is not None:
+        options.extend(["--compress", "--compress-level={level}".format(level = parameters["dataTransferRsyncCompressLevel"])])
+    if parameters["dataTransferRsyncPartialDir"]:
+        options.append("--partial-dir={partialDir}".format(partialDir = parameters["dataTransferRsyncPartialDir"]))
+    if parameters["dataTransferSSHControlPath"]:
+        options.append("--rsh=ssh -o ControlMaster=auto -o ControlPath={controlPath} -o ControlPersist={persist}".format(
+            controlPath = parameters["dataTransferSSHControlPath"],
+            persist = parameters["dataTransferSSHControlPersist"]))
+    return options
+
 @retry(tries = parameters["dataTransferRetries"])
 def rsyncFilesFromFilelist(directory, destination, filelistFilename, transferredFilenames):
     """ Transfer files via rsync based on a list of filenames in a given file.
@@ -180,11 +224,14 @@ def rsyncFilesFromFilelist(directory, destination, filelistFilename, transferred
         r"--out-format=%n",
         # Files from is relative to the remote path.
         "--files-from={name}".format(name = filelistFilename),
+    ]
+    rsync.extend(rsyncTuningOptions())
+    rsync.extend([
         # Source
         directory,
         # Destination
         destination,
-    ]
+    ])
 
     logger.debug("Args: {rsync}".format(rsync = rsync))
     try:
@@ -205,42 +252,117 @@ def rsyncFilesFromFilelist(directory, destination, filelistFilename, transferred
 
     return True
 
-def copyFilesToOverwatchSites(directory, destination, filenames):
+#: Throughput in bytes per second of the most recent batch transferred to each destination. It is used
+#: to limit the size of the following batches according to ``dataTransferBatchMaxTime``.
+transferThroughput = {}
+
+def fileSize(directory, filename):
+    """ Determine the size of a file, returning 0 if it isn't available. """
+    try:
+        return os.path.getsize(os.path.join(directory, filename))
+    except OSError:
+        return 0
+
+def createBatches(directory, filenames, maxSize, maxTime = None, throughput = None):
+    """ Split the files into batches which are transferred together.
+
+    Each batch is limited by the total size of the files, as well as by the time that it is expected to take
+    to transfer it (based on the throughput of previous batches), such that the files of the batch can be handled
+    (and removed locally) without waiting for all of the files. Each batch contains at least one file.
+
+    Args:
+        directory (str): Path to the directory where the files are stored locally.
+        filenames (list): Files to split into batches.
+        maxSize (int): Maximum total size of the files in a batch in bytes.
+        maxTime (float): Maximum expected time to transfer a batch in seconds. Default: ``None``, which
+            doesn't limit the time.
+        throughput (float): Expected throughput in bytes per second. Default: ``None``, which doesn't limit the time.
+    Returns:
+        list: Batches of files, where each batch is a list of filenames.
+    """
+    budget = maxSize
+    if maxTime is not None and throughput:
+        budget = min(budget, maxTime * throughput)
+
+    batches = []
+    batch = []
+    batchSize = 0
+    for f in filenames:
+        size = fileSize(directory, f)
+        if batch and batchSize + size > budget:
+            batches.append(batch)
+            batch = []
+            batchSize = 0
+        batch.append(f)
+        batchSize += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+def copyFilesToOverwatchSites(directory, destination, filenames, onTransferred = None):
     """ Copy the given files to the Overwatch deployment sites.
 
     The Overwatch sites and where the files should be stored at those sites is determined
     in the configuration. Retries should usually not be necessary here, but are included
     as an additional assurance.
 
+    The files are transferred in batches (see ``createBatches(...)``), which are limited by
+    ``dataTransferBatchMaxSize`` and ``dataTransferBatchMaxTime``, and the throughput of each batch is logged.
+
     Args:
         directory (str): Path to the directory where the files are stored locally.
         destination (str): Path to the remote directory where the files are stored. Since the
             files are being transferred with rsync via ssh, this path should be of the form
             ``user@host:/dir/path``.
         filenames (list): Paths to files to copy to each Overwatch site.
+        onTransferred (function): Called with the filename of each file once it has been transferred.
+            Default: ``None``.
     Returns:
         list: Filenames for all of the files which **failed**.
     """
-    # First write the filenames out to a temp file so we can pass them to rsync.
-    with tempfile.NamedTemporaryFile() as f:
-        # Need encode because the file is written as bytes.
-        f.write("\n".join(filenames).encode())
-        # Move back to the front so it can be read.
-        f.seek(0)
-
-        # Perform the actual files transfer.
-        transferredFilenames = []
-        success = rsyncFilesFromFilelist(directory = directory,
-                                         destination = destination,
-                                         filelistFilename = f.name,
-                                         transferredFilenames = transferredFilenames)
+    failedFilenames = []
+    batches = createBatches(directory = directory, filenames = filenames,
+                            maxSize = parameters["dataTransferBatchMaxSize"],
+                            maxTime = parameters["dataTransferBatchMaxTime"],
+                            throughput = transferThroughput.get(destination))
+    for batch in batches:
+        start = time.time()
+        # First write the filenames out to a temp file so we can pass them to rsync.
+        with tempfile.NamedTemporaryFile() as f:
+            # Need encode because the file is written as bytes.
+            f.write("\n".join(batch).encode())
+            # Move back to the front so it can be read.
+            f.seek(0)
+
+            # Perform the actual files transfer.
+            transferredFilenames = []
+            success = rsyncFilesFromFilelist(directory = directory,
+                                             destination = destination,
+                                             filelistFilename = f.name,
+                                             transferredFilenames = transferredFilenames)
+        duration = time.time() - start
 
         logger.debug("transferredFilenames: {}".format(transferredFilenames))
 
         # We want to return the files that _failed_, so if the files were transferred,
-        # we return an empty list. Otherwise, we return the files that were not transferred.
-        failedFilenames = list(set(filenames) - set(transferredFilenames))
-        return [] if success else failedFilenames
+        # we don't add any. Otherwise, we add the files that were not transferred.
+        batchFailedFilenames = [] if success else list(set(batch) - set(transferredFilenames))
+        failedFilenames.extend(batchFailedFilenames)
+        batchTransferred = [f for f in batch if f not in batchFailedFilenames]
+
+        # Report the throughput, which is also used to size the following batches.
+        batchSize = sum(fileSize(directory, f) for f in batchTransferred)
+        if success and duration > 0:
+            transferThroughput[destination] = batchSize / duration
+        logger.info("Transferred batch of {nFiles} files ({size:.1f} MB) to {destination} in {duration:.1f} s ({throughput:.2f} MB/s)".format(
+            nFiles = len(batchTransferred), size = batchSize / 1e6, destination = destination, duration = duration,
+            throughput = batchSize / 1e6 / duration if duration > 0 else 0))
+
+        if onTransferred is not None:
+            for f in batchTransferred:
+                onTransferred(f)
+
+    return failedFilenames
 
 @retry(tries = parameters["dataTransferRetries"])
 def copyFileToEOSWithRoot(directory, destination, filename):
@@ -263,34 +385,49 @@ def copyFileToEOSWithRoot(directory, destination, filename):
     logger.debug("Copying file from {source} to {destination}".format(source = source, destination = destination))
     return ROOT.TFile.Cp(source, destination, showProgressBar)
 
-def copyFilesToEOS(directory, destination, filenames):
+def copyFilesToEOS(directory, destination, filenames, onTransferred = None):
     """ Copy the given filenames to EOS.
 
-    Files which failed are returned so that these files can be saved and the admin can be alerted to take
-    additional actions.
+    The files are copied concurrently by a pool of workers (the number is set by ``dataTransferEOSWorkers``),
+    each of which retries its file independently. Files which failed are returned so that these files can be
+    saved and the admin can be alerted to take additional actions.
 
     Args:
         directory (str): Path to the directory where the files are stored locally.
         destination (str): Directory on EOS to which the file should be copied.
         filenames (list): Files to copy to EOS.
+        onTransferred (function): Called with the filename of each file once it has been transferred.
+            Default: ``None``.
     Returns:
         list: Filenames for all of the files which **failed**.
     """
-    failedFilenames = []
-    for f in filenames:
+    def copyFile(filename):
         # This function will automatically retry.
-        res = copyFileToEOSWithRoot(directory = directory, destination = destination, filename = f)
-        # Store the failed files so we can notify the admin that something went wrong.
-        if res is False:
-            failedFilenames.append(f)
+        res = copyFileToEOSWithRoot(directory = directory, destination = destination, filename = filename)
+        if res is not False and onTransferred is not None:
+            onTransferred(filename)
+        return (filename, res)
+
+    failed = set()
+    if filenames:
+        pool = multiprocessing.pool.ThreadPool(max(min(parameters["dataTransferEOSWorkers"], len(filenames)), 1))
+        try:
+            for (filename, res) in pool.imap_unordered(copyFile, filenames):
+                # Store the failed files so we can notify the admin that something went wrong.
+                if res is False:
+                    failed.add(filename)
+        finally:
+            pool.close()
+            pool.join()
 
-    return failedFilenames
+    # Keep the order of the given filenames.
+    return [f for f in filenames if f in failed]
 
 def storeFailedFiles(siteName, filenames):
     """ Store failed files in a safe place for later transfer.
 
     This function should be called for each site. Each site maintains a different directory as different
-    files could fail for different sites.
+    files could fail for different sites. The files are retried via ``retryFailedFiles()``.
 
     Args:
         siteName (str): Name of the site for which the files failed to transfer.
@@ -325,6 +462,77 @@ def storeFailedFiles(siteName, filenames):
     logger.info("Files failed to copy for site {siteName}. Filenames: {filenames}".format(siteName = siteName, filenames = filenames))
     logger.error("Files failed to copy for site {siteName}".format(siteName = siteName))
 
+class transferProgress(object):
+    """ Track which sites have handled each file, removing each file once it has been handled by every site.
+
+    A file is handled by a site once it has been transferred to the site, or once it failed and has been stored
+    for later transfer (see ``storeFailedFiles(...)``).
+
+    Args:
+        filenames (list): Filenames of the files which are being transferred.
+        siteNames (list): Names of the sites to which the files are being transferred.
+        removeFile (function): Called with the filename of each file once it has been handled by every site.
+
+    Attributes:
+        remainingSites (dict): Sites which still need to handle each file. Keys are the filenames, while values
+            are sets of the site names. Files are removed once they have been handled by every site.
+        removeFile (function): Called with the filename of each file once it has been handled by every site.
+    """
+    def __init__(self, filenames, siteNames, removeFile):
+        self.remainingSites = {f: set(siteNames) for f in filenames}
+        self.removeFile = removeFile
+        self._lock = threading.Lock()
+
+    def complete(self, siteName, filenames):
+        """ Record that a site has handled the given files.
+
+        Args:
+            siteName (str): Name of the site.
+            filenames (list): Filenames of the files which have been handled by the site.
+        Returns:
+            list: Filenames of the files which have now been handled by every site.
+        """
+        finished = []
+        with self._lock:
+            for f in filenames:
+                remaining = self.remainingSites.get(f)
+                if remaining is None:
+                    continue
+                remaining.discard(siteName)
+                if not remaining:
+                    del self.remainingSites[f]
+                    finished.append(f)
+        for f in finished:
+            self.removeFile(f)
+        return finished
+
+def transferFunctionForSite(siteName):
+    """ Determine the function used to transfer files to a site.
+
+    Args:
+        siteName (str): Name of the site. If "EOS" is in the name, the files are transferred to EOS.
+    Returns:
+        function: ``copyFilesToEOS`` or ``copyFilesToOverwatchSites``.
+    """
+    if "EOS" in siteName.upper():
+        return copyFilesToEOS
+    return copyFilesToOverwatchSites
+
+def removeTransferredFile(filename):
+    """ Remove a received file once it has been handled by every site.
+
+    The file is only removed if we are not debugging to protect from data loss.
+
+    Args:
+        filename (str): Filename of the file in the receiver data directory.
+    Returns:
+        None.
+    """
+    if parameters["debug"] is False:
+        os.remove(os.path.join(parameters["receiverData"], filename))
+    else:
+        logger.debug("File to remove: {filename}".format(filename = filename))
+
 def processReceivedFiles():
     """ Main driver function for receiver file processing and moving.
 
@@ -349,46 +557,127 @@ def processReceivedFiles():
         logger.info("No new files found. Returning.")
         return None, None
 
-    logger.info("Transfering data to sites: {sites}".format(sites = ", ".join(parameters["dataTransferLocations"])))
+    sites = list(iteritems(parameters["dataTransferLocations"]))
+    logger.info("Transfering data to sites: {sites}".format(sites = ", ".join(siteName for siteName, _ in sites)))
 
-    failedFilenames = {}
-    for siteName, destination in iteritems(parameters["dataTransferLocations"]):
-        transferFunc = copyFilesToOverwatchSites
-        if "EOS" in siteName.upper():
-            transferFunc = copyFilesToEOS
-        # Perform the actual transfer for each configured location.
+    # Each file is removed as soon as every site has handled it, rather than waiting for the slowest site.
+    progress = transferProgress(filenames = filenamesToTransfer,
+                                siteNames = [siteName for siteName, _ in sites],
+                                removeFile = removeTransferredFile)
+
+    def transferToSite(siteAndDestination):
+        """ Transfer the files to a single site, storing the files which failed. """
+        siteName, destination = siteAndDestination
+        transferred = []
+
+        def onTransferred(filename):
+            transferred.append(filename)
+            progress.complete(siteName, [filename])
+
+        # Perform the actual transfer for the configured location.
         # We need to keep track of which files failed to transfer to which sites.
-        failedFilenames[siteName] = transferFunc(directory = parameters["receiverData"],
-                                                 destination = destination,
-                                                 filenames = filenamesToTransfer)
+        filenames = transferFunctionForSite(siteName)(directory = parameters["receiverData"],
+                                                      destination = destination,
+                                                      filenames = filenamesToTransfer,
+                                                      onTransferred = onTransferred)
+        ledger.recordTransferred(siteName = siteName, filenames = transferred)
 
-    # Handle filenames which haven't been deleted.
-    # We only need to do this if there are some which failed.
-    # We also keep track of which failed for logging.
-    totalFailedFilenames = set()
-    if any(itervalues(failedFilenames)):
+        # Handle filenames which haven't been transferred.
         # Copy to a safe temporary location for storage until they can be dealt with.
         # We make a copy and store them separately because the same file could have failed for multiple
         # transfers. However, we shouldn't lose much in storage because these aren't intended to stay a
         # long time.
-        for siteName, filenames in iteritems(failedFilenames):
-            totalFailedFilenames.update(filenames)
-            # Only attempt to store the failed files if some files actually failed.
-            if filenames:
-                storeFailedFiles(siteName = siteName, filenames = filenames)
+        if filenames:
+            storeFailedFiles(siteName = siteName, filenames = filenames)
+            ledger.recordFailed(siteName = siteName, filenames = filenames)
+        # Any that have failed have now been copied, so they are handled for this site.
+        progress.complete(siteName, filenames)
+        return filenames
+
+    failedFilenames = {}
+    if sites:
+        # Transfer to each site concurrently.
+        pool = multiprocessing.pool.ThreadPool(len(sites))
+        try:
+            results = pool.map(transferToSite, sites)
+        finally:
+            pool.close()
+            pool.join()
+        for (siteName, _), filenames in zip(sites, results):
+            failedFilenames[siteName] = filenames
 
     # Log which filenames were transferred successfully.
-    # We will eventually want to return a list instead of a set, so we just convert it here.
-    successfullyTransferred = list(set(filenamesToTransfer) - totalFailedFilenames)
+    # We also keep track of which failed for logging.
+    totalFailedFilenames = set()
+    for filenames in itervalues(failedFilenames):
+        totalFailedFilenames.update(filenames)
+    successfullyTransferred = [f for f in filenamesToTransfer if f not in totalFailedFilenames]
     logger.info("Fully successfully transferred: {successfullyTransferred}".format(successfullyTransferred = successfullyTransferred))
 
-    # Now we can safely remove all files, because any that have failed have already been copied.
-    # Protect from data loss when debugging.
-    if parameters["debug"] is False:
-        for f in filenamesToTransfer:
-            os.remove(os.path.join(parameters["receiverData"], f))
-    else:
-        logger.debug("Files to remove: {filenamesToTransfer}".format(filenamesToTransfer = filenamesToTransfer))
-
     return (successfullyTransferred, failedFilenames)
 
+
+def retryFailedFiles(now = None):
+    """ Retry transferring the files which previously failed and are due according to the ledger.
+
+    Files in the temporary storage of a site which aren't in the ledger (for example, those stored before the
+    ledger existed) are added to it, so the temporary storage is drained automatically. Files which are
+    successfully transferred are removed from the temporary storage, while those which fail again are retried
+    after a longer delay.
+
+    Args:
+        now (float): Current unix time. Default: ``None``, which uses the current time.
+    Returns:
+        tuple: (transferred, failed) where each is a dict with the site names as keys and the filenames as values.
+    """
+    for siteName in parameters["dataTransferLocations"]:
+        storagePath = os.path.join(parameters["receiverDataTempStorage"], siteName)
+        if not os.path.exists(storagePath):
+            continue
+        untracked = list(set(determineFilesToMove(directory = storagePath)) - set(ledger.failedFiles(siteName)))
+        if untracked:
+            logger.info("Adding stored files for site {siteName} to the ledger: {untracked}".format(siteName = siteName, untracked = untracked))
+            ledger.recordFailed(siteName = siteName, filenames = untracked, now = now)
+
+    transferred = {}
+    failed = {}
+    for siteName, filenames in iteritems(ledger.filesToRetry(now = now)):
+        if siteName not in parameters["dataTransferLocations"]:
+            # We can't transfer to a site which is no longer configured, so the files are left for the admin.
+            continue
+        storagePath = os.path.join(parameters["receiverDataTempStorage"], siteName)
+        missing = [f for f in filenames if not os.path.exists(os.path.join(storagePath, f))]
+        if missing:
+            # Most likely moved by hand, so there's nothing left to retry.
+            logger.warning("Stored files for site {siteName} are missing, so they will not be retried: {missing}".format(siteName = siteName, missing = missing))
+            ledger.remove(siteName = siteName, filenames = missing)
+        filenames = [f for f in filenames if f not in missing]
+        if not filenames:
+            continue
+
+        logger.info("Retrying transfer of {nFiles} files to site {siteName}".format(nFiles = len(filenames), siteName = siteName))
+        failed[siteName] = transferFunctionForSite(siteName)(directory = storagePath,
+                                                             destination = parameters["dataTransferLocations"][siteName],
+                                                             filenames = filenames)
+        transferred[siteName] = [f for f in filenames if f not in failed[siteName]]
+        ledger.recordTransferred(siteName = siteName, filenames = transferred[siteName], now = now)
+        ledger.recordFailed(siteName = siteName, filenames = failed[siteName], now = now)
+        # The stored copy is no longer needed once the file has been transferred.
+        for f in transferred[siteName]:
+            os.remove(os.path.join(storagePath, f))
+        if failed[siteName]:
+            logger.info("Files failed to copy again for site {siteName}. Filenames: {filenames}".format(siteName = siteName, filenames = failed[siteName]))
+
+    return (transferred, failed)
+
+def transferBacklog(now = None):
+    """ Summarize the files which are waiting to be transferred again, pruning old entries from the ledger.
+
+    Args:
+        now (float): Current unix time. Default: ``None``, which uses the current time.
+    Returns:
+        dict: Summary for each site with failed files. See ``transferLedger.backlogSummary(...)``.
+    """
+    now = time.time() if now is None else now
+    ledger.prune(olderThan = now - parameters["dataTransferLedgerRetentionDays"] * 24 * 60 * 60)
+    return ledger.backlogSummary(now = now)
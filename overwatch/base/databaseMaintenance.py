@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+""" Database maintenance, including packing the database on a schedule.
+
+ZODB storages only append to the database, so every processing cycle, which rewrites the subsystem,
+histogram, and trending objects, grows the database. Packing removes the old revisions of the objects,
+reclaiming the space. Packing is performed in a background thread, so it can proceed alongside the
+processing, and can be triggered periodically and/or when the database exceeds a size threshold. The time
+and size of the last pack are stored in the database, so the schedule is kept when Overwatch is restarted.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+# Python 2/3 support
+from __future__ import print_function
+
+# General
+import os
+import shutil
+import threading
+import pendulum
+
+# ZODB
+import ZODB.FileStorage
+import persistent.mapping
+
+import logging
+logger = logging.getLogger(__name__)
+
+#: Key in the database root under which the state of the last pack is stored.
+packStateKey = "databasePackState"
+
+def databaseSize(db):
+    """ Determine the size of the database storage.
+
+    Args:
+        db (ZODB.DB): The database.
+    Returns:
+        int: Size of the database in bytes.
+    """
+    return db.getSize()
+
+def archiveOldTransactions(db, archiveDirectory):
+    """ Move the transactions removed by the last pack into an archive directory.
+
+    When a ``FileStorage`` is packed, the previous database file (which contains all of the transactions)
+    is kept as ``{databaseFilename}.old``. It is moved to the archive directory with a timestamp so that it
+    will not be overwritten (or removed) by the next pack. For other storages (such as ZEO), the previous
+    database file is only available on the server, so it cannot be archived here.
+
+    Args:
+        db (ZODB.DB): The database which was packed.
+        archiveDirectory (str): Directory where the old transactions should be stored.
+    Returns:
+        str: Path to the archived file, or None if there was nothing to archive.
+    """
+    if not isinstance(db.storage, ZODB.FileStorage.FileStorage):
+        logger.warning("Cannot archive old transactions for storage {name}, as it is not a local file storage.".format(name = db.storage.getName()))
+        return None
+
+    oldFilename = db.storage.getName() + ".old"
+    if not os.path.exists(oldFilename):
+        logger.info("No old transactions available to archive.")
+        return None
+
+    if not os.path.exists(archiveDirectory):
+        os.makedirs(archiveDirectory)
+    archiveFilename = os.path.join(archiveDirectory, "{filename}.{time}".format(filename = os.path.basename(oldFilename),
+                                                                                time = pendulum.now().format("YYYY_MM_DD_HH_mm_ss")))
+    logger.info("Archiving old transactions from {oldFilename} to {archiveFilename}".format(oldFilename = oldFilename, archiveFilename = archiveFilename))
+    shutil.move(oldFilename, archiveFilename)
+
+    return archiveFilename
+
+def packDatabase(db, days = 0, archiveDirectory = None):
+    """ Pack the database, removing old revisions of the objects.
+
+    Packing only requires the commit lock for a brief period at the end, so the database can still be
+    used (including committing new transactions) while it is being packed.
+
+    Args:
+        db (ZODB.DB): The database to pack.
+        days (float): Keep revisions which are newer than this many days. Default: 0, which only keeps
+            the current revision of each object.
+        archiveDirectory (str): Directory where the transactions removed by the pack should be archived.
+            Default: None, which means that they will not be archived.
+    Returns:
+        tuple: (size before packing, size after packing, archived filename). The sizes are in bytes. The
+            archived filename is None if the transactions were not archived.
+    """
+    sizeBefore = databaseSize(db)
+    logger.info("Packing database {name}, keeping {days} days of history. Current size: {size:.1f} MB".format(name = db.storage.getName(), days = days, size = sizeBefore / 1e6))
+    start = pendulum.now()
+    db.pack(days = days)
+    sizeAfter = databaseSize(db)
+    logger.info("Finished packing database in {duration} s. Reclaimed {reclaimed:.1f} MB. Current size: {size:.1f} MB".format(
+        duration = (pendulum.now() - start).in_seconds(),
+        reclaimed = (sizeBefore - sizeAfter) / 1e6,
+        size = sizeAfter / 1e6))
+
+    archivedFilename = None
+    if archiveDirectory:
+        archivedFilename = archiveOldTransactions(db = db, archiveDirectory = archiveDirectory)
+
+    return (sizeBefore, sizeAfter, archivedFilename)
+
+class packScheduler(object):
+    """ Pack the database in the background when it is due.
+
+    The pack is due if it has been at least ``packInterval`` seconds since the last pack (or since
+    the scheduler was created), or if the database has grown by more than ``sizeThreshold`` since the
+    last pack (or exceeds it if it hasn't been packed yet). Basing the size condition on the growth
+    avoids packing repeatedly when the current objects alone exceed the threshold. Either condition
+    can be disabled by setting it to None. The time and size of the last pack are stored in the database
+    root (under ``packStateKey``), and are restored when the scheduler is created.
+
+    Args:
+        db (ZODB.DB): The database to pack.
+        packInterval (int): Time between packs in seconds. Default: None.
+        sizeThreshold (float): Growth of the database in MB above which it will be packed. Default: None.
+        days (float): Keep revisions which are newer than this many days. Default: 0.
+        archiveDirectory (str): Directory where the transactions removed by the pack should be archived.
+            Default: None, which means that they will not be archived.
+    Attributes:
+        db (ZODB.DB): The database to pack.
+        packInterval (int): Time between packs in seconds.
+        sizeThreshold (float): Growth of the database in MB above which it will be packed.
+        sizeAfterLastPack (int): Size of the database in bytes after the last pack.
+        days (float): Keep revisions which are newer than this many days.
+        archiveDirectory (str): Directory where the transactions removed by the pack should be archived.
+        lastPackTime (pendulum.DateTime): Time when the last pack was started.
+        lastResult (tuple): Result of the last successful pack, as returned by ``packDatabase()``.
+        thread (threading.Thread): Thread in which the pack is performed.
+    """
+    def __init__(self, db, packInterval = None, sizeThreshold = None, days = 0, archiveDirectory = None):
+        self.db = db
+        self.packInterval = packInterval
+        self.sizeThreshold = sizeThreshold
+        self.days = days
+        self.archiveDirectory = archiveDirectory
+        self.lastPackTime = pendulum.now()
+        self.lastResult = None
+        self.sizeAfterLastPack = 0
+        self.thread = None
+        self._loadPackState()
+
+    def _loadPackState(self):
+        """ Restore the time and size of the last pack from the database, if they were stored. """
+        # A separate connection (and transaction manager) is used, so we don't interfere with the caller's transaction.
+        with self.db.transaction() as connection:
+            state = connection.root().get(packStateKey)
+            if state is not None:
+                self.lastPackTime = pendulum.from_timestamp(state["lastPackTime"])
+                self.sizeAfterLastPack = state["sizeAfterLastPack"]
+                logger.debug("Last database pack was at {lastPackTime}".format(lastPackTime = self.lastPackTime))
+
+    def _storePackState(self):
+        """ Store the time and size of the last pack in the database. """
+        with self.db.transaction() as connection:
+            dbRoot = connection.root()
+            # The state is stored in a separate object so that updating it doesn't modify the root.
+            if packStateKey not in dbRoot:
+                dbRoot[packStateKey] = persistent.mapping.PersistentMapping()
+            dbRoot[packStateKey]["lastPackTime"] = self.lastPackTime.timestamp()
+            dbRoot[packStateKey]["sizeAfterLastPack"] = self.sizeAfterLastPack
+
+    @property
+    def isPacking(self):
+        """ True if the database is currently being packed. """
+        return self.thread is not None and self.thread.is_alive()
+
+    def isPackDue(self):
+        """ Determine whether the database should be packed.
+
+        Args:
+            None.
+        Returns:
+            bool: True if the database should be packed.
+        """
+        if self.packInterval and (pendulum.now() - self.lastPackTime).in_seconds() >= self.packInterval:
+            logger.debug("Database pack is due based on the time since the last pack.")
+            return True
+        if self.sizeThreshold and databaseSize(self.db) - self.sizeAfterLastPack >= self.sizeThreshold * 1e6:
+            logger.debug("Database pack is due based on the database size.")
+            return True
+        return False
+
+    def packIfDue(self):
+        """ Start packing the database in the background if it is due.
+
+        Args:
+            None.
+        Returns:
+            bool: True if a pack was started.
+        """
+        if self.isPacking or not self.isPackDue():
+            return False
+
+        self.lastPackTime = pendulum.now()
+        self.thread = threading.Thread(target = self._pack, name = "databasePack")
+        # Don't hold the process open just for the pack. The storage will discard an incomplete pack.
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def _pack(self):
+        """ Pack the database, logging any errors. Executed in the background thread. """
+        try:
+            self.lastResult = packDatabase(db = self.db, days = self.days, archiveDirectory = self.archiveDirectory)
+            self.sizeAfterLastPack = self.lastResult[1]
+            self._storePackState()
+        except Exception as e:
+            logger.warning("Packing the database failed with: {e}".format(e = e))
+
+    def wait(self, timeout = None):
+        """ Wait for a pack in progress to complete.
+
+        Args:
+            timeout (float): Maximum time to wait in seconds. Default: None, which will wait until the pack completes.
+        Returns:
+            None.
+        """
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+def createPackScheduler(db, parameters):
+    """ Create a pack scheduler based on the Overwatch configuration.
+
+    Args:
+        db (ZODB.DB): The database to pack.
+        parameters (dict): Overwatch configuration containing the ``databasePack*`` options.
+    Returns:
+        packScheduler: Scheduler configured according to the parameters.
+    """
+    return packScheduler(db = db,
+                         packInterval = parameters["databasePackInterval"],
+                         sizeThreshold = parameters["databasePackSizeThreshold"],
+                         days = parameters["databasePackDays"],
+                         archiveDirectory = parameters["databasePackArchiveDirectory"])
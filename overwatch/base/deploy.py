@@ -1035,6 +1035,8 @@ class zodb(executable):
         address (str): IP address for the database.
         port (int): Port for the database.
         databasePath (str): Path to where the database file should be stored.
+        invalidationQueueSize (int): Number of invalidations retained by the server. A larger queue allows
+            clients (processing, web app, etc) to reconnect without discarding their caches. Optional.
     """
     def __init__(self, config):
         name = "zodb"
@@ -1060,15 +1062,19 @@ class zodb(executable):
         # another module such as ``configparser`` to generate the config. Consequently, we just use a string.
         zeoConfig = """
         <zeo>
-            address {address}:{port}
+            address {address}:{port}{additionalZEOOptions}
         </zeo>
 
         <filestorage>
             path {databasePath}
         </filestorage>
         """
+        # Add optional server options.
+        additionalZEOOptions = ""
+        if self.config.get("invalidationQueueSize", None):
+            additionalZEOOptions += "\n            invalidation-queue-size {invalidationQueueSize}".format(**self.config)
         # Fill in the values.
-        zeoConfig = zeoConfig.format(**self.config)
+        zeoConfig = zeoConfig.format(additionalZEOOptions = additionalZEOOptions, **self.config)
 
         # Complete the process by cleaning up the config and writing it.
         # To cleanup the shared indentation of the above string, we use ``inspect.cleandoc()``.
@@ -1528,6 +1534,8 @@ class overwatchFlaskExecutable(overwatchExecutable):
         additionalConfig (dict): Additional options to added to the YAML configuration.
         uwsgi (dict): Additional options for ``uwsgi``. See the ``uwsgi`` executable class for more details.
         nginx (dict): Additional options for ``nginx``. See the ``nginx`` executable class for more details.
+        buildAssets (bool): If True, build the web app static assets (via ``overwatchBuildAssets``) before
+            starting the executable. Default: False.
 
     Attributes:
         nginx (executable): Contains the nginx executable if it was requested. This way, we don't lose
@@ -1555,6 +1563,12 @@ class overwatchFlaskExecutable(overwatchExecutable):
         # We call this last here because we are going to update variables if we use ``uwsgi`` for execution.
         super().setup()
 
+        # Build the static assets after the custom configuration has been written so that the workers
+        # don't need to build them.
+        if self.config.get("buildAssets", False):
+            logger.info("Building static assets for {name}".format(name = self.name))
+            subprocess.check_call(["overwatchBuildAssets"])
+
 _available_executables = {
     "supervisor": supervisor,
     "zodb": zodb,
@@ -1573,6 +1587,12 @@ _available_executables = {
                                     args = [
                                         "overwatchReplay",
                                     ]),
+    "databaseMaintenance": functools.partial(overwatchExecutable,
+                                             name = "databaseMaintenance",
+                                             description = "Overwatch database maintenance",
+                                             args = [
+                                                 "overwatchDatabaseMaintenance",
+                                             ]),
     "receiverMonitor": functools.partial(overwatchExecutable,
                                          name = "overwatchReceiverMonitor",
                                          description = "Overwatch ZMQ receiver monitor",
@@ -1614,6 +1634,7 @@ def retrieveExecutable(name, config):
     - dataTransfer
     - dataReplayDataTransfer
     - dataReplay
+    - databaseMaintenance
     - receiverMonitor
     - processing
     - webApp
@@ -6,16 +6,23 @@ The underlying functions also allow moving data to arbitrary locations, which we
 transition existing data in various stages of processing to other Overwatch sites and EOS
 (the final transferring is done by the data transfer module).
 
+Data can either be replayed in fixed steps of files (see ``runReplay(...)``), or by the ``replayEngine``, which
+indexes the source once and replays the files at a target rate, either a fixed number of files per second, or
+as a multiple of the rate at which the files were originally received (based on their time stamps). Several
+runs can be replayed concurrently to test the processing under realistic and peak loads.
+
 .. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
 """
 
 # Python 2/3 support
 from __future__ import print_function
+from builtins import range
 
 # General
 import os
 import logging
 import shutil
+import time
 logger = logging.getLogger(__name__)
 
 # Config
@@ -162,3 +169,133 @@ def runReplay(baseDir, destinationDir, nMaxFiles):
 
     # Inform about completion.
     logger.info("Completed replay.")
+
+def indexFiles(baseDir):
+    """ Index the files available to replay, sorted by the time when they were originally received.
+
+    Unlike ``availableFiles(...)``, the files in all subdirectories are sorted together, and combined and time
+    slice files are excluded, since they shouldn't be replayed.
+
+    Args:
+        baseDir (str): Directory where the ROOT files to be moved are stored.
+    Returns:
+        list: (timestamp, source, name) for each file, where timestamp (int) is the unix time when the file was
+            received, source (str) is the path to the source file, and name (str) is the appropriate name for the
+            destination file according to the Overwatch scheme. Sorted by timestamp.
+    """
+    files = []
+    for source, name in availableFiles(baseDir = baseDir):
+        if "combined" in source or "timeSlice" in source:
+            continue
+        files.append((utilities.extractTimeStampFromFilename(name), source, name))
+    files.sort()
+    return files
+
+class replayEngine(object):
+    """ Replay the files of a run at a target rate.
+
+    The source is indexed once when the engine is created. Each file is then scheduled relative to when the replay
+    started, either at a fixed rate, or based on the time stamps of the files (such that the time between files
+    is the original time divided by the speedup). Exactly one of ``rate`` or ``speedup`` must be given.
+
+    Args:
+        baseDir (str): Directory where the ROOT files to be moved are stored.
+        destinationDir (str): Directory where the files should be moved.
+        rate (float): Number of files to replay per second. Default: ``None``.
+        speedup (float): Multiple of the original rate at which the files are replayed. 1 replays in real time.
+            Default: ``None``.
+
+    Attributes:
+        baseDir (str): Directory where the ROOT files to be moved are stored.
+        destinationDir (str): Directory where the files should be moved.
+        files (list): Files to replay, as returned by ``indexFiles(...)``.
+        schedule (list): Time in seconds after the start of the replay at which each file should be replayed.
+        nReplayed (int): Number of files which have been replayed.
+        startTime (float): Unix time when the replay started. ``None`` until it has started.
+    """
+    def __init__(self, baseDir, destinationDir, rate = None, speedup = None):
+        if (rate is None) == (speedup is None):
+            raise ValueError("Must specify exactly one of the rate ({rate}) or speedup ({speedup}).".format(rate = rate, speedup = speedup))
+        if (rate if rate is not None else speedup) <= 0:
+            raise ValueError("The rate and speedup must be greater than 0.")
+        self.baseDir = baseDir
+        self.destinationDir = destinationDir
+        self.files = indexFiles(baseDir)
+        if rate is not None:
+            self.schedule = [i / float(rate) for i in range(len(self.files))]
+        else:
+            firstTimestamp = self.files[0][0] if self.files else 0
+            self.schedule = [(timestamp - firstTimestamp) / float(speedup) for timestamp, _, _ in self.files]
+        self.nReplayed = 0
+        self.startTime = None
+        logger.info("Indexed {nFiles} files to replay from {baseDir}, spanning {duration:.0f} s of replay.".format(
+            nFiles = len(self.files), baseDir = baseDir, duration = self.schedule[-1] if self.schedule else 0))
+
+    @property
+    def finished(self):
+        """ True if all files have been replayed. """
+        return self.nReplayed >= len(self.files)
+
+    def nextTime(self):
+        """ Determine when the next file should be replayed.
+
+        Args:
+            None.
+        Returns:
+            float: Unix time when the next file should be replayed, or ``None`` if all files have been replayed.
+        """
+        if self.finished:
+            return None
+        startTime = self.startTime if self.startTime is not None else time.time()
+        return startTime + self.schedule[self.nReplayed]
+
+    def replayDue(self, now = None):
+        """ Replay all of the files which are due.
+
+        The replay starts when this is first called.
+
+        Args:
+            now (float): Current unix time. Default: ``None``, which uses the current time.
+        Returns:
+            int: Number of files that were moved.
+        """
+        now = time.time() if now is None else now
+        if self.startTime is None:
+            self.startTime = now
+        fileCount = 0
+        while not self.finished and self.startTime + self.schedule[self.nReplayed] <= now:
+            _, source, destinationName = self.files[self.nReplayed]
+            self.nReplayed += 1
+            if not os.path.exists(source):
+                logger.warning("File {source} is no longer available and won't be replayed!".format(source = source))
+                continue
+            destination = os.path.join(self.destinationDir, destinationName)
+            logger.info("Moving {source} to {destination}".format(source = source, destination = destination))
+            shutil.move(source, destination)
+            fileCount += 1
+        return fileCount
+
+def runReplayEngines(engines, exitEvent):
+    """ Replay several runs concurrently until all files have been replayed, or until asked to exit.
+
+    Args:
+        engines (list): ``replayEngine`` objects for the runs to replay.
+        exitEvent (threading.Event): Event which is set to stop the replay.
+    Returns:
+        int: Number of files that were moved.
+    """
+    fileCount = 0
+    startTime = time.time()
+    while not exitEvent.is_set():
+        now = time.time()
+        for engine in engines:
+            fileCount += engine.replayDue(now = now)
+        nextTimes = [t for t in (engine.nextTime() for engine in engines) if t is not None]
+        if not nextTimes:
+            break
+        exitEvent.wait(max(min(nextTimes) - time.time(), 0))
+
+    duration = time.time() - startTime
+    logger.info("Replayed {fileCount} files in {duration:.1f} s ({rate:.2f} files/s).".format(
+        fileCount = fileCount, duration = duration, rate = fileCount / duration if duration > 0 else 0))
+    return fileCount
@@ -49,6 +49,7 @@ sentry_sdk.init(dsn = sentryDSN, integrations = [sentry_logging])
 # Imports are below here so that they can be logged
 from overwatch.base import dataTransfer
 from overwatch.base import replay
+from overwatch.base import databaseMaintenance
 
 def runReceiverDataTransfer():
     """ Run function for handling and transferring receiver data.
@@ -56,6 +57,9 @@ def runReceiverDataTransfer():
     We take advantage of the log of successfully transferred files to preform some rudimentary monitoring
     of the receivers. This function keep track of the time between when any file was transferred. If it's
     greater than 12 hours, then a warning is emitted, which will be picked up via sentry monitoring.
+
+    Files which previously failed to transfer are retried when they are due, and the size and age of the
+    backlog of such files is logged for monitoring.
     """
     handler = utilities.handleSignals()
     # Keep track of the time between transfers.
@@ -74,6 +78,13 @@ def runReceiverDataTransfer():
             # Update the last transfer time, or this will be emitted every loop (which could become annoying quickly).
             lastTransferTime = pendulum.now()
 
+        # Retry the files which failed to transfer previously.
+        dataTransfer.retryFailedFiles()
+        backlog = dataTransfer.transferBacklog()
+        for siteName, summary in backlog.items():
+            logger.info("Transfer backlog for site {siteName}: {files} files, oldest failed {oldestAge:.0f} s ago,"
+                        " max attempts: {maxAttempts}".format(siteName = siteName, **summary))
+
         handler.exit.wait(parameters["dataTransferTimeToSleep"])
 
 def runReplayData():
@@ -87,8 +98,11 @@ def runReplayData():
     so that it can be reprocessed file by file. If the run directory isn't moved, then even
     if we replay an early file, it could be ignored due to a later file being available to provide data.
 
-    This function will run on an interval determined by the value of ``dataReplayTimeToSleep``
-    (specified in seconds). If the value is 0 or less, the processing will only run once.
+    If ``dataReplayRate`` or ``dataReplaySpeedup`` are set, the files are replayed at that target rate
+    by the ``replay.replayEngine``, and multiple runs (specified as a list in ``dataReplaySourceDirectory``)
+    are replayed concurrently. Otherwise, this function will run on an interval determined by the value of
+    ``dataReplayTimeToSleep`` (specified in seconds), replaying the runs one after another. If the value is
+    0 or less, the processing will only run once.
 
     Note:
         The sleep time is defined as the time between when ``moveFiles()`` finishes and
@@ -100,41 +114,58 @@ def runReplayData():
         None.
     """
     # Basic validation to ensure that we only move data that we actually intend to move.
-    baseDir = parameters["dataReplaySourceDirectory"]
+    baseDirs = parameters["dataReplaySourceDirectory"]
+    if not isinstance(baseDirs, list):
+        baseDirs = [baseDirs]
     # Ensure that it is some sort of Run directory.
-    if not baseDir or "Run" not in baseDir:
-        raise ValueError("Source directory doesn't specify a run to replay. Please set it in your configuration. Current value: {baseDir}".format(baseDir = baseDir))
-
-    # Move files from the run directory to the temporary folder so that we can replay from there.
-    # If these files aren't moved, then even if we replay an early file, it could be ignored due
-    # to a later file being available to provide data.
-    temporaryDir = parameters["dataReplayTempStorageDirectory"]
-    # We need to explicitly add this additional directory - otherwise ``move(...)`` will dump the directory
-    # contents right into the dataReplayTempStorageDirectory directory.
-    _, runDir = os.path.split(baseDir)
-    temporaryRunDir = os.path.join(temporaryDir, runDir)
-    # Need to remove the temporary run directory before moving if it exists. Otherwise ``move(...)`` will move
-    # the directoy we are moving __inside__ of the existing directory...
-    if os.path.exists(temporaryRunDir):
-        shutil.rmtree(temporaryRunDir)
-    # Now actually move the file.
-    logger.debug("Moving existing runDir at {baseDir} to {temporaryRunDir}".format(baseDir = baseDir, temporaryRunDir = temporaryRunDir))
-    shutil.move(baseDir, temporaryRunDir)
-
-    # Attempt to remove the runDir from the database so that replay is successful (otherwise, it looks for entries
-    # and files that don't exist since replay moved the files).
-    logger.debug("Attempting to remove existing run directory {runDir} from the database.".format(runDir = runDir))
+    for baseDir in baseDirs:
+        if not baseDir or "Run" not in baseDir:
+            raise ValueError("Source directory doesn't specify a run to replay. Please set it in your configuration. Current value: {baseDir}".format(baseDir = baseDir))
+
     (db, connection) = utilities.getDB(parameters["databaseLocation"])
-    removedRun = db.get("runs", {}).pop(runDir, None)
-    if removedRun:
-        # Need to commit the change, as it hasn't been stored yet.
-        transaction.commit()
-        logger.debug("Successfully removed the existing run directory from the database.")
+    temporaryRunDirs = []
+    for baseDir in baseDirs:
+        # Move files from the run directory to the temporary folder so that we can replay from there.
+        # If these files aren't moved, then even if we replay an early file, it could be ignored due
+        # to a later file being available to provide data.
+        temporaryDir = parameters["dataReplayTempStorageDirectory"]
+        # We need to explicitly add this additional directory - otherwise ``move(...)`` will dump the directory
+        # contents right into the dataReplayTempStorageDirectory directory.
+        _, runDir = os.path.split(baseDir.rstrip(os.sep))
+        temporaryRunDir = os.path.join(temporaryDir, runDir)
+        # Need to remove the temporary run directory before moving if it exists. Otherwise ``move(...)`` will move
+        # the directoy we are moving __inside__ of the existing directory...
+        if os.path.exists(temporaryRunDir):
+            shutil.rmtree(temporaryRunDir)
+        # Now actually move the file.
+        logger.debug("Moving existing runDir at {baseDir} to {temporaryRunDir}".format(baseDir = baseDir, temporaryRunDir = temporaryRunDir))
+        shutil.move(baseDir, temporaryRunDir)
+        temporaryRunDirs.append(temporaryRunDir)
+
+        # Attempt to remove the runDir from the database so that replay is successful (otherwise, it looks for entries
+        # and files that don't exist since replay moved the files).
+        logger.debug("Attempting to remove existing run directory {runDir} from the database.".format(runDir = runDir))
+        removedRun = db.get("runs", {}).pop(runDir, None)
+        # The run must also be removed from the run list index, which would otherwise still list it.
+        if "runIndex" in db and db["runIndex"].removeRun(runDir):
+            removedRun = True
+        if removedRun:
+            # Need to commit the change, as it hasn't been stored yet.
+            transaction.commit()
+            logger.debug("Successfully removed the existing run directory from the database.")
 
     # Now begin the actual replay.
-    replay.runReplay(baseDir = temporaryRunDir,
-                     destinationDir = parameters["dataReplayDestinationDirectory"],
-                     nMaxFiles = parameters["dataReplayMaxFilesPerReplay"])
+    if parameters["dataReplayRate"] is not None or parameters["dataReplaySpeedup"] is not None:
+        engines = [replay.replayEngine(baseDir = temporaryRunDir,
+                                       destinationDir = parameters["dataReplayDestinationDirectory"],
+                                       rate = parameters["dataReplayRate"],
+                                       speedup = parameters["dataReplaySpeedup"]) for temporaryRunDir in temporaryRunDirs]
+        replay.runReplayEngines(engines = engines, exitEvent = utilities.handleSignals().exit)
+    else:
+        for temporaryRunDir in temporaryRunDirs:
+            replay.runReplay(baseDir = temporaryRunDir,
+                             destinationDir = parameters["dataReplayDestinationDirectory"],
+                             nMaxFiles = parameters["dataReplayMaxFilesPerReplay"])
 
     # Cleanup the database connection.
     connection.close()
@@ -153,5 +184,29 @@ def runReplayDataTransfer():
                      destinationDir = parameters["dataReplayDestinationDirectory"],
                      nMaxFiles = parameters["dataReplayMaxFilesPerReplay"])
 
+def runDatabaseMaintenance():
+    """ Run function for maintaining the database, which packs it when it is due.
+
+    This is intended for when the database is served via ZEO, such that the packing can be performed
+    separately from the processing. For a local file storage, the processing should perform the packing
+    instead (see ``databasePackDuringProcessing``), as only one process can open the database for writing.
+
+    Args:
+        None.
+    Returns:
+        None.
+    """
+    handler = utilities.handleSignals()
+    (db, connection) = utilities.getDB(parameters["databaseLocation"])
+    scheduler = databaseMaintenance.createPackScheduler(db = connection.db(), parameters = parameters)
+    logger.info("Starting database maintenance.")
+    while not handler.exit.is_set():
+        scheduler.packIfDue()
+        handler.exit.wait(parameters["databaseMaintenanceTimeToSleep"])
+
+    # Allow a pack in progress to finish before closing the database.
+    scheduler.wait()
+    connection.close()
+
 if __name__ == "__main__":
     runReceiverDataTransfer()
@@ -6,8 +6,12 @@ import contextlib
 
 import os
 
+def isXRDPath(basePath):
+    """ Determine whether files under the base path are accessed via XRootD. """
+    return "eos://" in basePath or "xrd://" in basePath
+
 def defineFileAccess(basePath):
-    if "eos://" in basePath or "xrd://" in basePath:
+    if isXRDPath(basePath):
         def xrdFileWrapper(filename, mode):
             # TODO: May need to select the path more carefully!
             return XRDFile(os.path.join(basePath, filename), mode)
@@ -70,6 +74,54 @@ def XRDFile(filename, mode):
         finally:
             print("Exiting XRD file")
 
+def XRDFileSize(filename):
+    """ Determine the size of a file accessed via XRootD.
+
+    Args:
+        filename (str): Full path to the file.
+    Returns:
+        int: Size of the file in bytes.
+    """
+    with XRDFile(filename, "r") as f:
+        if isinstance(f, IOError):
+            raise f
+        status, statInfo = f.stat()
+        if not status.ok:
+            raise IOError("Failed to stat XRD file. Message: {}".format(status.message))
+        return statInfo.size
+
+def streamXRDFile(filename, start = 0, length = None, chunkSize = 1048576):
+    """ Read a file (or part of it) via XRootD in chunks.
+
+    Only one chunk is in memory at a time, so it is suitable for streaming large files.
+
+    Args:
+        filename (str): Full path to the file.
+        start (int): Offset in bytes where the read should start. Default: 0.
+        length (int): Number of bytes to read. Default: ``None``, which reads until the end of the file.
+        chunkSize (int): Maximum size of each chunk in bytes. Default: 1 MB.
+    Yields:
+        bytes: The next chunk of the file.
+    """
+    with XRDFile(filename, "r") as f:
+        if isinstance(f, IOError):
+            raise f
+        if length is None:
+            status, statInfo = f.stat()
+            if not status.ok:
+                raise IOError("Failed to stat XRD file. Message: {}".format(status.message))
+            length = statInfo.size - start
+        offset = start
+        end = start + length
+        while offset < end:
+            status, data = f.read(offset = offset, size = min(chunkSize, end - offset))
+            if not status.ok:
+                raise IOError("Failed to read XRD file. Message: {}".format(status.message))
+            if not data:
+                break
+            yield data
+            offset += len(data)
+
 if __name__ == "__main__":
     # Local file example
     func1 = defineFileAccess("data")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+""" Durable record of the state of each received file at each transfer site.
+
+Files which fail to transfer to a site are stored in the temporary storage for that site (see
+``dataTransfer.storeFailedFiles(...)``). The ledger records these failures, along with when the transfer should
+be retried, which increases exponentially with each failed attempt. It is stored in a SQLite database so that
+it survives restarts of the data transfer, and each operation uses a separate connection, so it can be
+updated concurrently by the transfers to different sites.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+# Python 2/3 support
+from __future__ import print_function
+from __future__ import division
+
+import contextlib
+import os
+import sqlite3
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+class transferState(object):
+    """ States of a file at a transfer site. """
+    #: The file was transferred to the site.
+    transferred = "transferred"
+    #: The file failed to transfer, and is stored in the temporary storage to be retried.
+    failed = "failed"
+
+class transferLedger(object):
+    """ Record of the state of each received file at each transfer site.
+
+    Args:
+        filename (str): Path to the SQLite database. It is created if it doesn't exist.
+        retryDelay (float): Delay in seconds before the first retry of a failed file.
+        maxRetryDelay (float): Maximum delay in seconds between retries.
+        backoff (float): Amount to multiply the delay by after each failed attempt. Default: 2.
+
+    Attributes:
+        filename (str): Path to the SQLite database.
+        retryDelay (float): Delay in seconds before the first retry of a failed file.
+        maxRetryDelay (float): Maximum delay in seconds between retries.
+        backoff (float): Amount to multiply the delay by after each failed attempt.
+    """
+    def __init__(self, filename, retryDelay, maxRetryDelay, backoff = 2):
+        self.filename = filename
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        self.backoff = backoff
+
+    @contextlib.contextmanager
+    def _connection(self):
+        """ Open a connection to the ledger, committing any changes when it is closed.
+
+        Args:
+            None.
+        Yields:
+            sqlite3.Connection: Connection to the ledger.
+        """
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        connection = sqlite3.connect(self.filename, timeout = 30)
+        try:
+            connection.execute("CREATE TABLE IF NOT EXISTS transfers ("
+                               "filename TEXT NOT NULL, site TEXT NOT NULL, state TEXT NOT NULL, "
+                               "attempts INTEGER NOT NULL DEFAULT 0, firstFailure REAL, lastAttempt REAL, nextAttempt REAL, "
+                               "PRIMARY KEY (filename, site))")
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def retryDelayAfter(self, attempts):
+        """ Determine the delay before the next retry.
+
+        Args:
+            attempts (int): Number of failed attempts.
+        Returns:
+            float: Delay in seconds.
+        """
+        return min(self.retryDelay * self.backoff ** max(attempts - 1, 0), self.maxRetryDelay)
+
+    def recordTransferred(self, siteName, filenames, now = None):
+        """ Record that files were transferred to a site.
+
+        Args:
+            siteName (str): Name of the site.
+            filenames (list): Filenames of the transferred files.
+            now (float): Current unix time. Default: ``None``, which uses the current time.
+        Returns:
+            None.
+        """
+        if not filenames:
+            return
+        now = time.time() if now is None else now
+        with self._connection() as connection:
+            connection.executemany("INSERT OR REPLACE INTO transfers (filename, site, state, attempts, firstFailure, lastAttempt, nextAttempt) "
+                                   "VALUES (?, ?, ?, COALESCE((SELECT attempts FROM transfers WHERE filename = ? AND site = ?), 0) + 1, "
+                                   "NULL, ?, NULL)",
+                                   [(f, siteName, transferState.transferred, f, siteName, now) for f in filenames])
+
+    def recordFailed(self, siteName, filenames, now = None):
+        """ Record that files failed to transfer to a site, scheduling the next attempt.
+
+        Args:
+            siteName (str): Name of the site.
+            filenames (list): Filenames of the files which failed.
+            now (float): Current unix time. Default: ``None``, which uses the current time.
+        Returns:
+            None.
+        """
+        if not filenames:
+            return
+        now = time.time() if now is None else now
+        with self._connection() as connection:
+            for f in filenames:
+                row = connection.execute("SELECT state, attempts, firstFailure FROM transfers WHERE filename = ? AND site = ?",
+                                         (f, siteName)).fetchone()
+                attempts = 1
+                firstFailure = now
+                if row is not None and row[0] == transferState.failed:
+                    attempts = row[1] + 1
+                    firstFailure = row[2]
+                connection.execute("INSERT OR REPLACE INTO transfers (filename, site, state, attempts, firstFailure, lastAttempt, nextAttempt) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   (f, siteName, transferState.failed, attempts, firstFailure, now, now + self.retryDelayAfter(attempts)))
+
+    def remove(self, siteName, filenames):
+        """ Remove files from the ledger for a site.
+
+        Args:
+            siteName (str): Name of the site.
+            filenames (list): Filenames of the files to remove.
+        Returns:
+            None.
+        """
+        with self._connection() as connection:
+            connection.executemany("DELETE FROM transfers WHERE filename = ? AND site = ?", [(f, siteName) for f in filenames])
+
+    def failedFiles(self, siteName):
+        """ Retrieve all files which failed to transfer to a site.
+
+        Args:
+            siteName (str): Name of the site.
+        Returns:
+            list: Filenames of the files which failed to transfer.
+        """
+        with self._connection() as connection:
+            return [row[0] for row in connection.execute("SELECT filename FROM transfers WHERE site = ? AND state = ? ORDER BY filename",
+                                                         (siteName, transferState.failed))]
+
+    def filesToRetry(self, now = None):
+        """ Retrieve the failed files which are due to be retried.
+
+        Args:
+            now (float): Current unix time. Default: ``None``, which uses the current time.
+        Returns:
+            dict: Filenames to retry. Keys are the site names, while values are lists of the filenames.
+        """
+        now = time.time() if now is None else now
+        filesBySite = {}
+        with self._connection() as connection:
+            for (filename, siteName) in connection.execute("SELECT filename, site FROM transfers WHERE state = ? AND nextAttempt <= ? "
+                                                           "ORDER BY site, filename", (transferState.failed, now)):
+                filesBySite.setdefault(siteName, []).append(filename)
+        return filesBySite
+
+    def prune(self, olderThan):
+        """ Remove transferred files from the ledger once they are no longer needed.
+
+        Args:
+            olderThan (float): Unix time. Files transferred before this time are removed.
+        Returns:
+            int: Number of entries which were removed.
+        """
+        with self._connection() as connection:
+            return connection.execute("DELETE FROM transfers WHERE state = ? AND lastAttempt < ?",
+                                      (transferState.transferred, olderThan)).rowcount
+
+    def backlogSummary(self, now = None):
+        """ Summarize the files which are waiting to be retried for monitoring.
+
+        Args:
+            now (float): Current unix time. Default: ``None``, which uses the current time.
+        Returns:
+            dict: Summary for each site with failed files. Keys are the site names, while values are dicts
+                containing the number of failed files (``files``), the age in seconds of the oldest failure
+                (``oldestAge``), and the maximum number of attempts for any file (``maxAttempts``).
+        """
+        now = time.time() if now is None else now
+        summary = {}
+        with self._connection() as connection:
+            for (siteName, nFiles, firstFailure, maxAttempts) in connection.execute("SELECT site, COUNT(*), MIN(firstFailure), MAX(attempts) "
+                                                                                    "FROM transfers WHERE state = ? GROUP BY site",
+                                                                                    (transferState.failed,)):
+                summary[siteName] = {"files": nFiles, "oldestAge": now - firstFailure, "maxAttempts": maxAttempts}
+        return summary
@@ -11,6 +11,8 @@ from __future__ import print_function
 from future.utils import iteritems
 
 # General
+import contextlib
+import hashlib
 import os
 import sys
 import shutil
@@ -22,6 +24,7 @@ import threading
 
 # ZODB
 import ZODB
+import ZODB.POSException
 import transaction
 import persistent
 # For determining the storage type
@@ -150,6 +153,23 @@ def findCurrentRunDirs(dirPrefix = ""):
     runDirs.sort()
     return runDirs
 
+def hashFile(filename, blockSize = 65536):
+    """ Calculate a hash of the content of a file.
+
+    The hash identifies the content of the file, so it can be used, for example, as an ``ETag``.
+
+    Args:
+        filename (str): Path to the file.
+        blockSize (int): Number of bytes to read at once. Default: 65536.
+    Returns:
+        str: SHA1 hash of the file content in hex.
+    """
+    fileHash = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blockSize), b""):
+            fileHash.update(block)
+    return fileHash.hexdigest()
+
 def retrieveHLTModeFromStoredRunInfo(runDirectory):
     """ Retrieve the HLT mode from a stored ``runInfo.yaml`` file.
 
@@ -457,27 +477,179 @@ def moveRootFiles(dirPrefix, subsystemList):
 ###################################################
 # Handle database operations
 ###################################################
-def getDB(databaseLocation):
+#: Databases which have been opened in this process. Keys are ``(databaseLocation, readOnly)``, while
+#: values are the ``ZODB.DB`` objects. Each ``ZODB.DB`` manages its own pool of connections, so by
+#: storing them here, each process only opens the storage once and connections are reused.
+_databases = {}
+
+def resolveDatabaseLocation(databaseLocation, readOnly = False, cacheSize = None, poolSize = None):
+    """ Resolve a database location into a storage factory and the arguments to create the database.
+
+    This wraps ``zodburi.resolve_uri(...)``, additionally allowing the storage to be opened read-only
+    and the connection pool to be configured. Read-only access is requested by adding ``read_only=1``
+    to the URI query, so it is only available for ``file://`` and ``zeo://`` URIs. Any other options
+    in the URI (such as the ZEO client cache size, ``cache_size=200MB``) are preserved.
+
+    Note:
+        The returned tuple can also be passed directly to ``flask_zodb`` via the ``ZODB_STORAGE``
+        config option.
+
+    Args:
+        databaseLocation (str): Path to the database. Must be a valid zodburi URI, which could be a local
+            file (``file://``), a ZEO server (``zeo://host:port``), or another type.
+        readOnly (bool): If True, the storage will be opened read-only. Default: False.
+        cacheSize (int): Target number of objects in the object cache of each connection. Default: ``None``,
+            which will use the value in the URI (or the ``zodburi`` default).
+        poolSize (int): Number of connections to keep open in the connection pool. Default: ``None``,
+            which will use the value in the URI (or the ``zodburi`` default).
+    Returns:
+        tuple: (storage factory, dict of keyword arguments for ``ZODB.DB``).
+
+    Raises:
+        ValueError: If read-only access is requested for a storage which doesn't support it.
+    """
+    if readOnly:
+        scheme = databaseLocation[:databaseLocation.find(":")]
+        if scheme not in ["file", "zeo"]:
+            raise ValueError("Read-only access is not supported for database location {databaseLocation}".format(databaseLocation = databaseLocation))
+        separator = "&" if "?" in databaseLocation else "?"
+        databaseLocation = "{databaseLocation}{separator}read_only=1".format(databaseLocation = databaseLocation, separator = separator)
+
+    # See: http://docs.pylonsproject.org/projects/zodburi/en/latest/
+    storageFactory, dbArgs = zodburi.resolve_uri(databaseLocation)
+    if cacheSize is not None:
+        dbArgs["cache_size"] = cacheSize
+    if poolSize is not None:
+        dbArgs["pool_size"] = poolSize
+
+    return (storageFactory, dbArgs)
+
+def retrieveDatabase(databaseLocation, readOnly = False, cacheSize = None, poolSize = None):
+    """ Retrieve the (shared) database object for the given location, opening it if necessary.
+
+    The database is only opened once per process for each location and access mode. Subsequent calls
+    return the same ``ZODB.DB``, so connections are drawn from (and returned to) its pool. This avoids
+    opening the same storage multiple times within a process, which isn't possible for a ``FileStorage``
+    due to the lock, and is wasteful for a ZEO client.
+
+    Args:
+        databaseLocation (str): Path to the database. Must be a valid zodburi URI.
+        readOnly (bool): If True, the storage will be opened read-only. Default: False.
+        cacheSize (int): Target number of objects in the object cache of each connection. If the database
+            is already open, the cache size is updated. Default: ``None``.
+        poolSize (int): Number of connections to keep open in the connection pool. If the database is
+            already open, the pool size is updated. Default: ``None``.
+    Returns:
+        ZODB.DB: The database.
+    """
+    key = (databaseLocation, readOnly)
+    if key not in _databases:
+        storageFactory, dbArgs = resolveDatabaseLocation(databaseLocation = databaseLocation, readOnly = readOnly,
+                                                         cacheSize = cacheSize, poolSize = poolSize)
+        logger.debug("Opening database at {databaseLocation} (readOnly: {readOnly}) with args {dbArgs}".format(databaseLocation = databaseLocation, readOnly = readOnly, dbArgs = dbArgs))
+        _databases[key] = ZODB.DB(storageFactory(), **dbArgs)
+    else:
+        # Keep the settings up to date with the most recent request.
+        if cacheSize is not None:
+            _databases[key].setCacheSize(cacheSize)
+        if poolSize is not None:
+            _databases[key].setPoolSize(poolSize)
+
+    return _databases[key]
+
+def closeDatabases():
+    """ Close all databases which were opened via ``retrieveDatabase()``.
+
+    Args:
+        None.
+    Returns:
+        None.
+    """
+    for key in list(_databases):
+        _databases.pop(key).close()
+
+def getDB(databaseLocation, readOnly = False, cacheSize = None, poolSize = None):
     """ Setup and retrieve the database available at the given location.
 
+    The connection is retrieved from the pool of the shared database (see ``retrieveDatabase()``).
+
     Args:
         databaseLocation (str): Path to the database. Must be a valid zodburi URI, which could be a local
             file, a socket, a network path, or another type.
+        readOnly (bool): If True, the storage will be opened read-only. Default: False.
+        cacheSize (int): Target number of objects in the object cache of each connection. Default: ``None``.
+        poolSize (int): Number of connections to keep open in the connection pool. Default: ``None``.
     Returns:
         tuple: (ZODB db root PersistentMapping, ZODB.Connection.Connection object). The connection object
-            should be closed work with the database is completed.
+            should be closed work with the database is completed, which will return it to the pool.
     """
-    # Get the database
-    # See: http://docs.pylonsproject.org/projects/zodburi/en/latest/
-    #storage = ZODB.FileStorage.FileStorage(os.path.join(dirPrefix,"overwatch.fs"))
-    storage_factory, dbArgs = zodburi.resolve_uri(databaseLocation)
-    storage = storage_factory()
-    db = ZODB.DB(storage, **dbArgs)
+    db = retrieveDatabase(databaseLocation = databaseLocation, readOnly = readOnly,
+                          cacheSize = cacheSize, poolSize = poolSize)
     connection = db.open()
     dbRoot = connection.root()
 
     return (dbRoot, connection)
 
+@contextlib.contextmanager
+def writeConnection(databaseLocation, cacheSize = None, poolSize = None):
+    """ Provide an explicit connection for writing to the database.
+
+    The connection is retrieved from the pool of the shared read/write database (see ``retrieveDatabase()``),
+    and uses its own transaction manager. Consequently, it is independent of any other connections which
+    are open in the same thread (such as the read-only connection of a web app request). The changes are
+    committed when the context is exited, or aborted if an exception was raised.
+
+    Args:
+        databaseLocation (str): Path to the database. Must be a valid zodburi URI.
+        cacheSize (int): Target number of objects in the object cache of each connection. Default: ``None``.
+        poolSize (int): Number of connections to keep open in the connection pool. Default: ``None``.
+    Yields:
+        PersistentMapping: The database root.
+    """
+    db = retrieveDatabase(databaseLocation = databaseLocation, cacheSize = cacheSize, poolSize = poolSize)
+    transactionManager = transaction.TransactionManager()
+    connection = db.open(transaction_manager = transactionManager)
+    try:
+        yield connection.root()
+        transactionManager.commit()
+    except BaseException:
+        transactionManager.abort()
+        raise
+    finally:
+        connection.close()
+
+def retryOnConflict(func, retries, *args, **kwargs):
+    """ Execute a function and commit the transaction, retrying if the commit conflicts.
+
+    When multiple processes write to the same database (for example, via a ZEO server), a commit can
+    fail with a ``ConflictError`` if another process modified the same objects. In that case, the
+    transaction is aborted (which discards the changes and syncs with the latest database state), and
+    the function is executed again. Consequently, the function must be safe to execute repeatedly.
+
+    Args:
+        func (callable): Function which makes the changes to the database.
+        retries (int): Number of times to retry after a conflict.
+        args (list): Positional arguments to pass to the function.
+        kwargs (dict): Keyword arguments to pass to the function.
+    Returns:
+        Any: Return value of the function.
+
+    Raises:
+        ZODB.POSException.ConflictError: If the commit still conflicts after all of the retries.
+    """
+    attempt = 0
+    while True:
+        try:
+            returnValue = func(*args, **kwargs)
+            transaction.commit()
+            return returnValue
+        except ZODB.POSException.ConflictError as e:
+            transaction.abort()
+            if attempt >= retries:
+                raise
+            attempt += 1
+            logger.info("Database conflict while calling {func}: {e}. Retry {attempt} of {retries}.".format(func = getattr(func, "__name__", func), e = e, attempt = attempt, retries = retries))
+
 def updateDBSensitiveParameters(db, overwriteSecretKey = True):
     """ Update sensitive parameters which are stored in the database. Those parameters include the users
     dictionary, as well as the secret key used for cookie signing.
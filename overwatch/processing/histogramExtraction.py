@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+""" Extract selected histograms from ROOT files.
+
+Rather than transferring an entire ROOT file to retrieve a few histograms, the requested histograms are
+extracted and serialized either as ``numpy`` arrays of the bin contents, errors, and edges (stored in an
+``.npz`` file, which contains one ``.npy`` entry per array) or as ``TBufferJSON`` (which can be read by
+``jsRoot`` or ``ROOT``). Serialized histograms are cached by file and histogram, so repeated requests (for
+example, from analysis scripts iterating over the same runs) don't need to read the ROOT file again.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+from __future__ import absolute_import
+from builtins import range
+
+import collections
+import io
+import json
+import os
+import re
+import threading
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+import ROOT
+
+#: Supported output formats.
+outputFormats = ["npz", "json"]
+
+#: Type of the bin contents of a histogram by the ROOT array class from which the histogram inherits.
+#: For example, ``TH1F`` inherits from ``TArrayF``.
+_binContentTypes = [("TArrayD", np.float64), ("TArrayF", np.float32), ("TArrayL64", np.int64), ("TArrayL", np.int64),
+                    ("TArrayI", np.int32), ("TArrayS", np.int16), ("TArrayC", np.int8)]
+
+def selectHistogramNames(availableNames, names = None, pattern = None):
+    """ Select the requested histograms from those which are available.
+
+    Args:
+        availableNames (list): Names of the histograms which are available.
+        names (list): Names of the requested histograms. Default: ``None``.
+        pattern (str): Regular expression which is matched (via ``re.search``) against the histogram names.
+            Default: ``None``.
+    Returns:
+        list: Names of the selected histograms, in the order in which they are available. If neither names nor
+            a pattern are given, all histograms are selected.
+    """
+    if not names and not pattern:
+        return list(availableNames)
+    names = set(names) if names else set()
+    regex = re.compile(pattern) if pattern else None
+    return [name for name in availableNames if name in names or (regex is not None and regex.search(name))]
+
+def histogramToArrays(hist):
+    """ Convert a histogram into arrays of the bin contents, errors, and edges.
+
+    The contents and errors include the underflow and overflow bins, and are shaped according to the dimension
+    of the histogram (ie. ``(nBinsX + 2, nBinsY + 2)`` for a 2D histogram), such that they can be indexed with
+    the ``ROOT`` bin numbers.
+
+    Args:
+        hist (ROOT.TH1): Histogram to convert.
+    Returns:
+        collections.OrderedDict: Arrays describing the histogram. Keys are ``contents``, ``errors``, and the edges
+            of each axis (``edgesX``, ``edgesY``, ``edgesZ``).
+    """
+    axes = [hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis()][:hist.GetDimension()]
+    # ROOT stores the bins with the x axis varying fastest, so the shape is reversed relative to the axes.
+    shape = tuple(axis.GetNbins() + 2 for axis in reversed(axes))
+    nCells = hist.GetNcells()
+    dtype = next((dtype for (className, dtype) in _binContentTypes if hist.InheritsFrom(className)), None)
+    if dtype is None or hist.InheritsFrom("TProfile") or hist.InheritsFrom("TProfile2D") or hist.InheritsFrom("TProfile3D"):
+        # The stored array doesn't directly contain the bin contents (for example, for profiles, where it contains
+        # the sum of the values), so we need to retrieve them bin by bin.
+        contents = np.array([hist.GetBinContent(i) for i in range(nCells)], dtype = np.float64)
+        errors = np.array([hist.GetBinError(i) for i in range(nCells)], dtype = np.float64)
+    else:
+        # Read the bins directly from the histogram buffers, which is much faster than retrieving them bin by bin.
+        # The arrays are copied (via ``astype``), as the buffers are only valid as long as the histogram exists.
+        contents = np.frombuffer(hist.GetArray(), dtype = dtype, count = nCells).astype(np.float64)
+        if hist.GetSumw2N() > 0:
+            errors = np.sqrt(np.frombuffer(hist.GetSumw2().GetArray(), dtype = np.float64, count = nCells))
+        else:
+            # Without the sum of the squares of the weights, the errors are the square root of the contents.
+            errors = np.sqrt(np.abs(contents))
+    contents = contents.reshape(shape).T
+    errors = errors.reshape(shape).T
+
+    arrays = collections.OrderedDict()
+    arrays["contents"] = contents
+    arrays["errors"] = errors
+    for axisName, axis in zip(["X", "Y", "Z"], axes):
+        nBins = axis.GetNbins()
+        arrays["edges" + axisName] = np.array([axis.GetBinLowEdge(i) for i in range(1, nBins + 2)], dtype = np.float64)
+    return arrays
+
+def serializeHistogram(hist, outputFormat):
+    """ Serialize a histogram in the requested format.
+
+    Args:
+        hist (ROOT.TH1): Histogram to serialize.
+        outputFormat (str): Either ``npz`` or ``json``.
+    Returns:
+        dict or collections.OrderedDict: For ``npz``, the arrays describing the histogram (see
+            ``histogramToArrays(...)``). For ``json``, the histogram converted via ``TBufferJSON``.
+    """
+    if outputFormat == "npz":
+        return histogramToArrays(hist)
+    if outputFormat == "json":
+        return json.loads(ROOT.TBufferJSON.ConvertToJSON(hist).Data())
+    raise ValueError("Output format {outputFormat} is not supported. Options: {outputFormats}".format(outputFormat = outputFormat,
+                                                                                                      outputFormats = outputFormats))
+
+class histogramCache(object):
+    """ LRU cache of serialized histograms, organized by file and histogram.
+
+    The key includes the modification time and size of the file, so a histogram is extracted again when the file
+    changes (such as for the combined file of an ongoing run).
+
+    Args:
+        cacheSize (int): Maximum number of serialized histograms to keep in memory. 0 disables the cache.
+
+    Attributes:
+        cacheSize (int): Maximum number of serialized histograms to keep in memory.
+        histograms (collections.OrderedDict): Serialized histograms. Keys are ``(filename, modification time, size,
+            histogram name, output format)``, while values are the serialized histograms. Ordered from least to
+            most recently used.
+    """
+    def __init__(self, cacheSize):
+        self.cacheSize = cacheSize
+        self.histograms = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fileKey(filename):
+        """ Create the part of the key which identifies the state of a file.
+
+        Args:
+            filename (str): Path to the file.
+        Returns:
+            tuple: ``(filename, modification time, size)``.
+        """
+        fileInfo = os.stat(filename)
+        return (filename, fileInfo.st_mtime, fileInfo.st_size)
+
+    def get(self, key):
+        """ Retrieve a serialized histogram.
+
+        Args:
+            key (tuple): Key of the histogram.
+        Returns:
+            object: The serialized histogram, or ``None`` if it is not cached.
+        """
+        with self._lock:
+            value = self.histograms.get(key)
+            if value is not None:
+                # Mark as most recently used.
+                self.histograms[key] = self.histograms.pop(key)
+            return value
+
+    def store(self, key, value):
+        """ Store a serialized histogram.
+
+        Args:
+            key (tuple): Key of the histogram.
+            value (object): Serialized histogram.
+        Returns:
+            None.
+        """
+        if self.cacheSize <= 0:
+            return
+        with self._lock:
+            self.histograms.pop(key, None)
+            self.histograms[key] = value
+            while len(self.histograms) > self.cacheSize:
+                self.histograms.popitem(last = False)
+
+def extractHistograms(filename, names = None, pattern = None, outputFormat = "npz", cache = None, maxHistograms = None):
+    """ Extract the selected histograms from a ROOT file.
+
+    The ROOT file is only opened if at least one of the requested histograms is not already cached. However,
+    selecting histograms via a pattern requires the list of histograms in the file, so the file is always
+    opened in that case.
+
+    Args:
+        filename (str): Path to the ROOT file.
+        names (list): Names of the requested histograms. Default: ``None``.
+        pattern (str): Regular expression to select histograms by name. Default: ``None``.
+        outputFormat (str): Either ``npz`` or ``json``. Default: ``npz``.
+        cache (histogramCache): Cache of serialized histograms. Default: ``None``, which disables caching.
+        maxHistograms (int): Maximum number of histograms which may be selected. Default: ``None``, which doesn't
+            limit the number of histograms.
+    Returns:
+        collections.OrderedDict: Serialized histograms. Keys are the histogram names, while values are the
+            serialized histograms (see ``serializeHistogram(...)``). Requested histograms which are not available
+            are skipped.
+    Raises:
+        IOError: If the file is not available or can't be opened.
+        ValueError: If more than ``maxHistograms`` histograms are selected.
+    """
+    try:
+        fileKey = histogramCache.fileKey(filename)
+    except OSError as e:
+        raise IOError("ROOT file {filename} is not available: {e}".format(filename = filename, e = e))
+    histograms = collections.OrderedDict()
+    if cache is not None and names and not pattern:
+        for name in names:
+            value = cache.get(fileKey + (name, outputFormat))
+            if value is not None:
+                histograms[name] = value
+        if len(histograms) == len(names):
+            return histograms
+
+    fIn = ROOT.TFile.Open(filename, "READ")
+    if not fIn or fIn.IsZombie():
+        raise IOError("Unable to open ROOT file {filename}".format(filename = filename))
+    try:
+        availableNames = [key.GetName() for key in fIn.GetListOfKeys()
+                          if ROOT.TClass.GetClass(key.GetClassName()).InheritsFrom(ROOT.TH1.Class())]
+        selectedNames = selectHistogramNames(availableNames, names = names, pattern = pattern)
+        if maxHistograms is not None and len(selectedNames) > maxHistograms:
+            raise ValueError("{nHistograms} histograms were selected, but at most {maxHistograms} are allowed.".format(
+                nHistograms = len(selectedNames), maxHistograms = maxHistograms))
+        for name in selectedNames:
+            if name in histograms:
+                continue
+            key = fileKey + (name, outputFormat)
+            value = cache.get(key) if cache is not None else None
+            if value is None:
+                value = serializeHistogram(fIn.Get(name), outputFormat)
+                if cache is not None:
+                    cache.store(key, value)
+            histograms[name] = value
+    finally:
+        fIn.Close()
+
+    return histograms
+
+def writeNpz(histograms, fileObj = None):
+    """ Write extracted histograms into a ``numpy`` ``.npz`` archive.
+
+    Each array is stored as ``{prefix}/{histogram name}/{array name}``, where the prefix is the key of the
+    outer dict (for example, the run).
+
+    Args:
+        histograms (dict): Histograms to write. Keys are prefixes, while values are dicts of the histograms
+            (as returned by ``extractHistograms(...)`` with the ``npz`` format).
+        fileObj (file): File-like object where the archive is written. Default: ``None``, which writes to
+            an in-memory buffer.
+    Returns:
+        file: The file-like object, positioned at the start.
+    """
+    if fileObj is None:
+        fileObj = io.BytesIO()
+    arrays = collections.OrderedDict()
+    for prefix, hists in histograms.items():
+        for histName, histArrays in hists.items():
+            for arrayName, array in histArrays.items():
+                arrays["{prefix}/{histName}/{arrayName}".format(prefix = prefix, histName = histName, arrayName = arrayName)] = array
+    np.savez(fileObj, **arrays)
+    fileObj.seek(0)
+    return fileObj
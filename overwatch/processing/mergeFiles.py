@@ -25,6 +25,7 @@ logger = logging.getLogger(__name__)
 import ROOT
 
 from . import processingClasses
+from . import runArchive
 
 def merge(currentDir, run, subsystem, cumulativeMode = True, timeSlice = None):
     """ For a given run and subsystem, handles merging of files into a "combined file" which
@@ -73,17 +74,12 @@ def merge(currentDir, run, subsystem, cumulativeMode = True, timeSlice = None):
             file is inaccessible.
     """
     # Determines which files are needed to merge
+    # In both cases, the files are already sorted by time.
     if timeSlice:
         filesToMerge = timeSlice.filesToMerge
     else:
-        filesToMerge = []
-        for fileCont in subsystem.files.values():
-            # This is not necessary since combined files are not stored in files anymore
-            #if fileCont.combinedFile == False:
-            filesToMerge.append(fileCont)
-
-    # Sort files by time
-    filesToMerge.sort(key=lambda x: x.fileTime)
+        # Combined files are not stored in files anymore, so we don't need to filter them out.
+        filesToMerge = subsystem.filesInTimeRange()
 
     # If in cumulativeMode, we subtract the earliest file from the latest file, unless
     # the beginning of the time slice is the start of the run. In that case, case we don't
@@ -236,6 +232,9 @@ def mergeRootFiles(runs, dirPrefix, forceNewMerge = False, cumulativeMode = True
 
     # Process runs
     for runDir, run in iteritems(runs):
+        # Archived runs are finished, so they never need to be merged.
+        if runArchive.isArchived(run):
+            continue
         for subsystem in run.subsystems:
             # Only merge if we there are new files to merge
             if run.subsystems[subsystem].newFile is True or forceNewMerge:
@@ -53,11 +53,14 @@ from ..base import utilities
 from . import mergeFiles
 from . import pluginManager
 from . import processingClasses
+from . import runArchive
+from . import testingDataArchive
 from .trending.manager import TrendingManager
 
 
 def processRootFile(filename, outputFormatting, subsystem, processingOptions = None,
-                    forceRecreateSubsystem = False, trendingManager = None):
+                    forceRecreateSubsystem = False, trendingManager = None, histogramTemplates = None,
+                    recordOutputHashes = True):
     """ Given a root file, process all histograms for a given subsystem.
 
     Processing includes assigning the contained histograms to a subsystem, allowing for customization via
@@ -72,6 +75,7 @@ def processRootFile(filename, outputFormatting, subsystem, processingOptions = N
     - For each sorted histogram:
         - Determine which processing functions to apply to which histograms.
         - Determine which trending functions require which histograms.
+    - Share the resulting histogram configuration (templates) with other runs of the subsystem.
 
     Processing then proceeds to apply those functions to all sorted histograms. The final histograms are then
     stored as images and as ``json``. In the case that the subsystem already exists, we can skip all of those
@@ -92,6 +96,10 @@ def processRootFile(filename, outputFormatting, subsystem, processingOptions = N
             it will use the default subsystem processing options.
         forceRecreateSubsystem (bool): True if subsystems will be recreated, even if they already exist.
         trendingManager (TrendingManager): Manages the trending subsystem.
+        histogramTemplates (BTree): Histogram templates shared between runs. Keys are subsystem names, while
+            values are the templates for that subsystem. See ``processingClasses.shareHistogramTemplates(...)``.
+            Default: ``None``, in which case each histogram keeps it's own template.
+        recordOutputHashes (bool): If True, record the hashes of the output files in the subsystem. Default: True.
     Returns:
         None. However, the underlying subsystems, histograms, etc, are modified.
     """
@@ -187,6 +195,12 @@ def processRootFile(filename, outputFormatting, subsystem, processingOptions = N
                 # We don't want to process histograms which haven't been defined.
                 logger.debug("Skipping histogram {} since it is not classifiable for subsystem {}".format(hist.histName, subsystem.subsystem))
 
+        # Now that the histograms are fully configured, share their configuration with other runs.
+        if histogramTemplates is not None:
+            if subsystem.subsystem not in histogramTemplates:
+                histogramTemplates[subsystem.subsystem] = BTrees.OOBTree.BTree()
+            processingClasses.shareHistogramTemplates(subsystem, histogramTemplates[subsystem.subsystem])
+
     # Set the proper processing options
     # If it was passed in, it was probably from time slices
     if processingOptions is None:
@@ -214,7 +228,8 @@ def processRootFile(filename, outputFormatting, subsystem, processingOptions = N
                 #logger.warning("Could not retrieve histogram!")
                 continue
             processHist(subsystem = subsystem, hist = hist, canvas = canvas, outputFormatting = outputFormatting,
-                        processingOptions = processingOptions, trendingManager = trendingManager)
+                        processingOptions = processingOptions, trendingManager = trendingManager,
+                        recordOutputHashes = recordOutputHashes)
 
     # Delete the canvas. Although ROOT will mostly likely handle this eventually, the
     # garbage collection doesn't have to happen immediately. So we help it out by explictly
@@ -226,7 +241,7 @@ def processRootFile(filename, outputFormatting, subsystem, processingOptions = N
     fIn.Close()
 
 def processHist(subsystem, hist, canvas, outputFormatting, processingOptions,
-                subsystemName = None, trendingManager = None):
+                subsystemName = None, trendingManager = None, recordOutputHashes = True):
     """ Main histogram processing function.
 
     This function is responsible for taking a given ``histogramContainer``, process the underlying histogram
@@ -276,6 +291,8 @@ def processHist(subsystem, hist, canvas, outputFormatting, processingOptions,
             of the object being processed, so we have to pass it here.
         trendingManager (TrendingManager): Will be notified when as histogram is processed to allow the use of
             the histogram values in trending.
+        recordOutputHashes (bool): If True, record the hashes of the output files in the subsystem (see
+            ``subsystemContainer.recordOutputHash(...)``). Default: True.
     Returns:
         None. However, the subsystem, histogram, etc are modified and their representations in images
             and ``json`` are written to disk.
@@ -341,6 +358,12 @@ def processHist(subsystem, hist, canvas, outputFormatting, processingOptions,
     with open(jsonBufferFile, "wb") as f:
         f.write(ROOT.TBufferJSON.ConvertToJSON(canvas).Data().encode())
 
+    # Record the content of the output so that the web app can identify whether it has changed.
+    if recordOutputHashes:
+        for outputFile in [outputFilename, jsonBufferFile]:
+            subsystem.recordOutputHash(filename = os.path.relpath(outputFile, processingParameters["dirPrefix"]),
+                                       fileHash = utilities.hashFile(outputFile))
+
     # Clear hist and canvas so that we can successfully save
     hist.hist = None
     hist.canvas = None
@@ -442,9 +465,10 @@ def validateAndCreateNewTimeSlice(run, subsystem, minTimeMinutes, maxTimeMinutes
         return (None, None, {"Request Error": ["Max time of \"{maxTimeMinutes}\" must be greater than the min time of {minTimeMinutes}!".format(maxTimeMinutes = maxTimeMinutes, minTimeMinutes = minTimeMinutes)]})
 
     # Filter files by input time range. We will use the files which pass the filtering for the time slice.
+    # The files are stored by time stamp, so we only need to consider those which are close to the requested
+    # range. We select one additional minute on each side to account for the rounding below.
     filesToMerge = []
-    for fileCont in subsystem.files.values():
-        #logger.info("fileCont.fileTime: {fileTime}, minTimeCutUnix: {minTimeCutUnix}, maxTimeCutUnix: {maxTimeCutUnix}".format(fileTime = fileCont.fileTime, minTimeCutUnix = minTimeCutUnix, maxTimeCutUnix = maxTimeCutUnix))
+    for fileCont in subsystem.filesInTimeRange(minTime = minTimeCutUnix - 60, maxTime = maxTimeCutUnix + 60):
         #logger.info("fileCont.timeIntoRun (minutes): {timeIntoRun}, minTimeMinutes: {minTimeMinutes}, maxTimeMinutes: {maxTimeMinutes}".format(timeIntoRun = round(fileCont.timeIntoRun / 60), minTimeMinutes = minTimeMinutes, maxTimeMinutes = maxTimeMinutes))
         # It is important to make this check in such a way that we can round to the nearest minute.
         # This is because the exact second when the receiver records the file can vary from file to file.
@@ -456,8 +480,7 @@ def validateAndCreateNewTimeSlice(run, subsystem, minTimeMinutes, maxTimeMinutes
     if filesToMerge == []:
         return (None, None, {"Request Error": ["No files are available in requested range of {minTimeMinutes}-{maxTimeMinutes}! Please make another request with a different range".format(minTimeMinutes = minTimeMinutes, maxTimeMinutes = maxTimeMinutes)]})
 
-    # Sort files by time
-    filesToMerge.sort(key=lambda x: x.fileTime)
+    # NOTE: The files are already sorted by time, as they are retrieved in order of their time stamp.
     #logger.info("filesToMerge: {filesToMerge}, times: {times}".format(filesToMerge = filesToMerge, times = [x.fileTime for x in filesToMerge]))
 
     # Get min and max time stamp remaining
@@ -497,7 +520,7 @@ def validateAndCreateNewTimeSlice(run, subsystem, minTimeMinutes, maxTimeMinutes
 
     return (uuidDictKey, True, None)
 
-def processTimeSlices(runs, runDir, minTimeRequested, maxTimeRequested, subsystemName, inputProcessingOptions):
+def processTimeSlices(runs, runDir, minTimeRequested, maxTimeRequested, subsystemName, inputProcessingOptions, runIndex = None, histogramTemplates = None):
     """ Creates a time slice or performs user directed reprocessing.
 
     Time slices are created by processing a given run using only data in a given time range (and potentially modifying the
@@ -520,6 +543,9 @@ def processTimeSlices(runs, runDir, minTimeRequested, maxTimeRequested, subsyste
         subsystemName (str): The subsystem of the time slice request by three letter, all capital name (ex. ``EMC``).
         inputProcessingOptions (dict): Processing options requested for the time slice. Keys are the names of
         the options, while values are the actual values of the processing options.
+        runIndex (runListIndex): Index of the runs, to which new runs are added. Default: ``None``.
+        histogramTemplates (BTree): Histogram templates shared between runs, which are used by archived runs that
+            are restored into the database. Default: ``None``.
     Returns:
         str or dict: If successful, we return the time slice key (str) under which the requested time slice is stored
             in the ``subsystemContainer.timeSlices`` dictionary. If an error was encountered, we return an error
@@ -530,6 +556,12 @@ def processTimeSlices(runs, runDir, minTimeRequested, maxTimeRequested, subsyste
     # Load run information and subsystem
     if runDir in runs:
         run = runs[runDir]
+        # Archived runs are read-only, so the run must be restored into the database to store the time slice.
+        if runArchive.isArchived(run):
+            try:
+                run = runArchive.restoreRun(runs, runDir, histogramTemplates = histogramTemplates)
+            except runArchive.RunDataUnavailable as e:
+                return {"Request Error": [str(e)]}
     else:
         return {"Request Error": ["Requested {runDir}, but there is no run information on it! Please check that it is a valid run and retry in a few minutes!".format(runDir = runDir)]}
     subsystem = run.subsystems[subsystemName]
@@ -538,7 +570,7 @@ def processTimeSlices(runs, runDir, minTimeRequested, maxTimeRequested, subsyste
     # Along this may be a bit slow, we do it here so that the most up to date information is available for
     # the time slice - particularly in the case of an ongoing run.
     runDict = utilities.moveRootFiles(processingParameters["dirPrefix"], processingParameters["subsystemList"])
-    processMovedFilesIntoRuns(runs, runDict)
+    processMovedFilesIntoRuns(runs, runDict, runIndex = runIndex, histogramTemplates = histogramTemplates)
 
     # Validate and create (or retrieve) the ``timeSliceContainer``.
     (timeSliceKey, newlyCreated, errors) = validateAndCreateNewTimeSlice(run, subsystem, minTimeRequested, maxTimeRequested, inputProcessingOptions)
@@ -576,7 +608,10 @@ def processTimeSlices(runs, runDir, minTimeRequested, maxTimeRequested, subsyste
                                  subsystem.baseDir,
                                  timeSlice.filename.filename),
                     outputFormattingSave, subsystem,
-                    processingOptions = timeSlice.processingOptions)
+                    processingOptions = timeSlice.processingOptions,
+                    # Time slice outputs are only viewed by the requesting user, so they aren't tracked for run page
+                    # updates. The web app determines their hashes when they are served.
+                    recordOutputHashes = False)
 
     logger.info("Finished processing {prettyName}!".format(prettyName = run.prettyName))
 
@@ -657,7 +692,7 @@ def createNewSubsystemFromMovedFilesInformation(runs, subsystem, runDict, runDir
     # Flag that there are new files
     runs[runDir].subsystems[subsystem].newFile = True
 
-def processMovedFilesIntoRuns(runs, runDict):
+def processMovedFilesIntoRuns(runs, runDict, runIndex = None, histogramTemplates = None):
     """ Convert the list of moved files into run and subsystem containers stored in the database.
 
     In the case that the run has not been created, a new run container is created and an attempt is made
@@ -670,6 +705,10 @@ def processMovedFilesIntoRuns(runs, runDict):
             in the ``runDir`` format ("Run123456"), while the values are ``runContainer`` objects.
         runDict (dict): Nested dict which contains the new filenames and the HLT mode. For the precise
             structure, ``base.utilities.moveFiles()``.
+        runIndex (runListIndex): Index of the runs, to which new runs are added and where the run summaries
+            are updated. Default: ``None``.
+        histogramTemplates (BTree): Histogram templates shared between runs, which are used by archived runs that
+            are restored into the database. Default: ``None``.
     Returns:
         None. Subsystems are created inside of the ``runContainer`` objects for which there are entries in the
             ``runDict``.
@@ -691,6 +730,9 @@ def processMovedFilesIntoRuns(runs, runDict):
         # Update existing runs and subsystems or create new ones if necessary
         if runDir in runs:
             run = runs[runDir]
+            # The run must be in the database to be updated.
+            if runArchive.isArchived(run):
+                run = runArchive.restoreRun(runs, runDir, histogramTemplates = histogramTemplates)
 
             # Possible scenarios that have to be handled below:
             # - 1) runDir has new data, and the corresponding subsystem exists. -> Update the subsystem.
@@ -791,6 +833,8 @@ def processMovedFilesIntoRuns(runs, runDict):
             runs[runDir] = processingClasses.runContainer(runDir = runDir,
                                                           fileMode = processingParameters["cumulativeMode"],
                                                           hltMode = hltMode)
+            if runIndex is not None:
+                runIndex.addRun(runDir)
             # Add files and subsystems based on the moved file information. We want to consider all
             # possible subsystems here. Anything for which we don't have available data will either
             # not be shown (if there is not HLT receiver data) or will take advantage of relevant data
@@ -804,6 +848,10 @@ def processMovedFilesIntoRuns(runs, runDict):
                     # to such a case, see ``createNewSubsystemFromMovedFilesInformation(...)``.
                     logger.warning(e.args[0])
 
+        # Keep the run list summary up to date with the new files.
+        if runIndex is not None:
+            runIndex.updateSummary(runs[runDir])
+
 def processAllRuns(dbRoot = None, connection = None):
     """ Driver function for processing all available data, storing the results in a database and on disk.
 
@@ -844,10 +892,13 @@ def processAllRuns(dbRoot = None, connection = None):
     # Get the database. Create the connection if necessary.
     created_connection_in_this_function = False
     if dbRoot is None or connection is None:
-        (dbRoot, connection) = utilities.getDB(processingParameters["databaseLocation"])
+        (dbRoot, connection) = utilities.getDB(processingParameters["databaseLocation"],
+                                               cacheSize = processingParameters["databaseCacheSize"],
+                                               poolSize = processingParameters["databasePoolSize"])
         created_connection_in_this_function = True
 
     # Setup the runs dict by either retrieving it or recreating it.
+    runsWithClearedNewFile = set()
     if "runs" in dbRoot:
         # The objects already exist, so we use the existing information.
         logger.info("Utilizing existing database!")
@@ -858,9 +909,14 @@ def processAllRuns(dbRoot = None, connection = None):
         # which files were just processed. Since we are now starting a new processing run,
         # we now must be clear this flag so we don't reprocess those runs again.
         for run in itervalues(runs):
+            # Archived runs are finished, so they don't have any new files.
+            if runArchive.isArchived(run):
+                continue
             for subsystem in itervalues(run.subsystems):
                 if subsystem.newFile:
                     subsystem.newFile = False
+                    # The summary of the run needs to be updated.
+                    runsWithClearedNewFile.add(run.runDir)
     else:
         # Create the runs tree to store the information
         dbRoot["runs"] = BTrees.OOBTree.BTree()
@@ -936,6 +992,9 @@ def processAllRuns(dbRoot = None, connection = None):
                 else:
                     logger.info("No combined file in {runDir}".format(runDir = runDir))
 
+        # Index the runs (including their summaries) now that the subsystems have been created.
+        dbRoot["runIndex"] = processingClasses.runListIndex.fromRuns(runs)
+
         # Commit any changes made to the database so we can proceed onto the actual processing.
         transaction.commit()
 
@@ -948,6 +1007,31 @@ def processAllRuns(dbRoot = None, connection = None):
     if "config" not in dbRoot:
         dbRoot["config"] = persistent.mapping.PersistentMapping()
 
+    # Histogram configuration which is shared between runs.
+    if "histogramTemplates" not in dbRoot:
+        dbRoot["histogramTemplates"] = BTrees.OOBTree.BTree()
+
+    # Index of the runs for the run list. It is only created here if the database predates the index.
+    if "runIndex" not in dbRoot:
+        dbRoot["runIndex"] = processingClasses.runListIndex.fromRuns(runs)
+        transaction.commit()
+    elif dbRoot["runIndex"].summaries is None:
+        # The index predates the run summaries, so we need to create them.
+        for run in itervalues(runs):
+            dbRoot["runIndex"].updateSummary(run)
+        transaction.commit()
+    else:
+        # Some summaries predate fields which were later added to the summary, so we need to update them.
+        outdatedRunDirs = [runDir for runDir in dbRoot["runIndex"].outdatedSummaries() if runDir in runs]
+        for runDir in outdatedRunDirs:
+            dbRoot["runIndex"].updateSummary(runs[runDir])
+        if outdatedRunDirs:
+            transaction.commit()
+    # Update the summaries of runs which are no longer flagged as having new files.
+    for runDir in runsWithClearedNewFile:
+        dbRoot["runIndex"].updateSummary(runs[runDir])
+    transaction.commit()
+
     # Set up the trending.
     if processingParameters["trending"]:
         trendingManager = TrendingManager(dbRoot, processingParameters)
@@ -962,7 +1046,9 @@ def processAllRuns(dbRoot = None, connection = None):
     # add them to the database.
     runDict = utilities.moveRootFiles(processingParameters["dirPrefix"], processingParameters["subsystemList"])
     logger.info("Files moved: {runDict}".format(runDict = runDict))
-    processMovedFilesIntoRuns(runs, runDict)
+    # The files have already been moved on disk, so we must be sure that they are stored in the database.
+    # Adding them to the runs can be safely repeated, so we retry if another process modified the same objects.
+    utilities.retryOnConflict(processMovedFilesIntoRuns, processingParameters["databaseConflictRetries"], runs, runDict, runIndex = dbRoot["runIndex"], histogramTemplates = dbRoot["histogramTemplates"])
 
     # Potentially helpful debug information
     if processingParameters["debug"]:
@@ -976,13 +1062,24 @@ def processAllRuns(dbRoot = None, connection = None):
     # Regardless of the mode, this will result in a single "combined" file which contains all of the
     # most up to date files.
     # NOTE: We will only merge subsystems which contain new files.
+    # NOTE: The merge removes the previous combined files, so it cannot be repeated after an aborted transaction.
+    #       Instead, we commit immediately to minimize the chance of a conflict.
     mergeFiles.mergeRootFiles(runs, processingParameters["dirPrefix"],
                               processingParameters["forceNewMerge"],
                               processingParameters["cumulativeMode"])
+    transaction.commit()
 
     # Perform the actual histogram processing
     outputFormattingSave = os.path.join("{base}", "{name}.{ext}")
-    for runDir, run in iteritems(runs):
+
+    def processRun(runDir):
+        """ Process the subsystems of a single run. Repeating it only rewrites the same output files. """
+        run = runs[runDir]
+        if runArchive.isArchived(run):
+            # Archived runs are only reprocessed if they are explicitly requested.
+            if int(runDir.replace("Run", "")) not in processingParameters["forceReprocessRuns"]:
+                return
+            run = runArchive.restoreRun(runs, runDir, histogramTemplates = dbRoot["histogramTemplates"])
         for subsystem in run.subsystems.values():
             # Process the subsystem if there is a new file or we explicitly ask for
             # processing by forcing it.
@@ -991,12 +1088,16 @@ def processAllRuns(dbRoot = None, connection = None):
                 # Process combined root file: plot histograms and save the results of the processing
                 # in both image and `json` on the disk.
                 logger.info("About to process {prettyName}, {subsystem}".format(prettyName = run.prettyName, subsystem = subsystem.subsystem))
+                # Note that there is new output, such that the web app doesn't use outdated cached pages, and
+                # can notify clients which output has changed.
+                subsystem.newOutputVersion()
                 processRootFile(
                     filename = os.path.join(processingParameters["dirPrefix"], subsystem.combinedFile.filename),
                     outputFormatting = outputFormattingSave,
                     subsystem = subsystem,
                     forceRecreateSubsystem = processingParameters["forceRecreateSubsystem"],
                     trendingManager = trendingManager,
+                    histogramTemplates = dbRoot["histogramTemplates"],
                 )
                 # TODO need additional info
                 # As of August 2018, this is where the trending container should step in to
@@ -1008,18 +1109,39 @@ def processAllRuns(dbRoot = None, connection = None):
                 # We often want to skip processing since most runs won't have new files and will not need to be processed most times.
                 logger.debug("Don't need to process {prettyName} for subsystem {subsystem}. It has already been processed".format(prettyName = run.prettyName, subsystem = subsystem.subsystem))
 
+    # NOTE: We iterate over a copy of the keys because archived runs which are restored will modify ``runs``.
+    for runDir in list(runs.keys()):
         # Commit after we have successfully processed each run
-        transaction.commit()
+        utilities.retryOnConflict(processRun, processingParameters["databaseConflictRetries"], runDir)
 
     logger.info("Finished standard processing!")
 
     # Run trending now that we have gotten to the most recent run
     if trendingManager:
-        trendingManager.processTrending()
         # Commit after we have successfully processed the trending
-        transaction.commit()
+        utilities.retryOnConflict(trendingManager.processTrending, processingParameters["databaseConflictRetries"])
         logger.info("Finished trending processing!")
 
+    # Move runs which finished long ago into the archive to keep the database small.
+    if processingParameters["runArchiveAfterDays"] is not None:
+        archivedRuns = utilities.retryOnConflict(runArchive.archiveFinishedRuns, processingParameters["databaseConflictRetries"],
+                                                 runs = runs,
+                                                 archiveDirectory = processingParameters["runArchiveDirectory"],
+                                                 archiveAfterDays = processingParameters["runArchiveAfterDays"])
+        if archivedRuns:
+            logger.info("Archived runs: {archivedRuns}".format(archivedRuns = archivedRuns))
+
+    # Create the testing data archive here so that it doesn't need to be created when it is requested.
+    # It is only recreated if the selected files have changed (for example, when new runs have arrived), and
+    # it is written in the background so that it doesn't delay the processing.
+    if processingParameters["testingDataArchiveDuringProcessing"]:
+        testingDataArchive.createArchive(runs = runs,
+                                         runIndex = dbRoot["runIndex"],
+                                         dirPrefix = processingParameters["dirPrefix"],
+                                         subsystemList = processingParameters["subsystemList"],
+                                         numberOfRuns = processingParameters["testingDataArchiveNumberOfRuns"],
+                                         background = True)
+
     # Add users and secret key if debugging
     # This needs to be done manually if deploying, since this requires some care to ensure that everything is
     # configured properly. However, it's quite convenient for development.
@@ -21,9 +21,14 @@ from future.utils import iteritems
 from future.utils import itervalues
 
 # Database
+import BTrees.IOBTree
+import BTrees.Length
 import BTrees.OOBTree
 import persistent
 
+import collections
+import hashlib
+import itertools
 import os
 import pendulum
 import logging
@@ -202,6 +207,460 @@ class runContainer(persistent.Persistent):
 
         return returnValue
 
+class archivedSubsystemSummary(object):
+    """ Minimal description of a subsystem in an archived run.
+
+    It contains just enough information to list the subsystem in the run list. It is stored as part of
+    the ``archivedRunContainer`` (rather than as a separate persistent object) to keep it as small as possible.
+
+    Args:
+        subsystem (subsystemContainer): Subsystem which is being archived.
+
+    Attributes:
+        subsystem (str): The current subsystem in the form of a three letter, all capital name (ex. ``EMC``).
+        showRootFiles (bool): True if the ROOT files should be made accessible through the run list.
+        startOfRun (int): Start of the run in unix time.
+        endOfRun (int): End of the run in unix time.
+        hasCombinedFile (bool): True if the subsystem has a combined file.
+    """
+    # Default for summaries which were stored before it was recorded.
+    hasCombinedFile = False
+
+    def __init__(self, subsystem):
+        self.subsystem = subsystem.subsystem
+        self.showRootFiles = subsystem.showRootFiles
+        self.startOfRun = subsystem.startOfRun
+        self.endOfRun = subsystem.endOfRun
+        self.hasCombinedFile = subsystem.combinedFile is not None
+
+    def __repr__(self):
+        """ Representation of the object. """
+        return "{}(subsystem = {subsystem}, startOfRun = {startOfRun}, endOfRun = {endOfRun})".format(self.__class__.__name__, **self.__dict__)
+
+    @staticmethod
+    def prettyPrintUnixTime(unixTime):
+        """ Converts the given time stamp into an appropriate manner ("pretty") for display.
+
+        See ``subsystemContainer.prettyPrintUnixTime(...)``.
+        """
+        return subsystemContainer.prettyPrintUnixTime(unixTime)
+
+class archivedRunContainer(persistent.Persistent):
+    """ Placeholder in the database for a run which has been moved to the archive.
+
+    It provides the same run level information as the ``runContainer`` so the run can still be listed, but
+    the subsystems only contain a minimal summary. The full run is stored in ``archiveFilename``, and it can
+    be retrieved via ``runArchive.retrieveRun(...)``.
+
+    Args:
+        run (runContainer): Run which is being archived.
+        archiveFilename (str): Path to the file where the full run is stored.
+
+    Attributes:
+        runDir (str): String containing the run number. For an example run 123456, it should be
+            formatted as ``Run123456``
+        runNumber (int): Run number extracted from the ``runDir``.
+        prettyName (str): Reformatting of the ``runDir`` for improved readability.
+        mode (bool): If true, the run data was collected in cumulative mode.
+        hltMode (str): Mode the HLT operated in for this run.
+        subsystems (dict): Summaries of the subsystems in the run. The key is the subsystem three letter name,
+            while the value is an ``archivedSubsystemSummary``.
+        mostRecentFileTime (int): Unix time of the most recent file in the run.
+        archiveFilename (str): Path to the file where the full run is stored.
+    """
+    def __init__(self, run, archiveFilename):
+        self.runDir = run.runDir
+        self.runNumber = run.runNumber
+        self.prettyName = run.prettyName
+        self.mode = run.mode
+        self.hltMode = run.hltMode
+        self.subsystems = {name: archivedSubsystemSummary(subsystem) for name, subsystem in iteritems(run.subsystems)}
+        self.mostRecentFileTime = max([subsystem.files[subsystem.files.keys()[-1]].fileTime for subsystem in itervalues(run.subsystems) if len(subsystem.files)] or [-1])
+        self.archiveFilename = archiveFilename
+
+    def __repr__(self):
+        """ Representation of the object. """
+        # Dummy call. See note at the top of the module.
+        self.runDir
+        return "{}(runDir = {runDir}, archiveFilename = {archiveFilename})".format(self.__class__.__name__, **self.__dict__)
+
+    def isRunOngoing(self):
+        """ Checks if a run is ongoing. An archived run has finished by definition.
+
+        Args:
+            None
+        Returns:
+            bool: False.
+        """
+        return False
+
+    def minutesSinceLastTimestamp(self):
+        """ Determine the time since the last file timestamp in minutes.
+
+        Args:
+            None.
+        Returns:
+            float: Minutes since the timestamp of the most recent file. Default: -1.
+        """
+        if self.mostRecentFileTime < 0:
+            return -1
+        geneva = pendulum.from_timestamp(self.mostRecentFileTime, tz = "Europe/Zurich")
+        return pendulum.now().diff(geneva).in_minutes()
+
+    def startOfRunTimeStamp(self):
+        """ Provides the start of the run time stamp in a format suitable for display.
+
+        See ``runContainer.startOfRunTimeStamp()``.
+
+        Args:
+            None
+        Returns:
+            str: Start of run time stamp formatted in an appropriate manner for display.
+        """
+        if not self.subsystems:
+            return False
+        # We just take the last subsystem in a given run. Any will do
+        lastSubsystem = self.subsystems[sorted(self.subsystems)[-1]]
+        return lastSubsystem.prettyPrintUnixTime(lastSubsystem.startOfRun)
+
+class runSummary(collections.namedtuple("runSummary", ["runDir", "prettyName", "startOfRun", "mostRecentFileTime", "newFile", "subsystems",
+                                                       "hltMode", "combinedFileSubsystems"])):
+    """ Compact summary of a run, containing the information which is needed to display it in the run list.
+
+    The summaries are stored in the ``runListIndex`` as plain tuples, such that a page of the run list can be
+    displayed without loading the full runs (and all of their subsystems). The summary provides the same
+    interface as the ``runContainer`` for the run list.
+
+    Args:
+        runDir (str): String containing the run number. For an example run 123456, it should be
+            formatted as ``Run123456``.
+        prettyName (str): Reformatting of the ``runDir`` for improved readability.
+        startOfRun (int): Start of the run in unix time, as determined by the last subsystem (in alphabetical
+            order). -1 if there are no subsystems.
+        mostRecentFileTime (int): Unix time of the most recent file in the run. -1 if there are no files.
+        newFile (bool): True if any subsystem received a new file in the most recent processing.
+        subsystems (tuple): Names of the subsystems in the run.
+        hltMode (str): Mode the HLT operated in for this run. Default: ``None``.
+        combinedFileSubsystems (tuple): Names of the subsystems which have a combined file. Default: ``()``.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def fromRun(cls, run):
+        """ Create the summary of a run.
+
+        Args:
+            run (runContainer or archivedRunContainer): Run to summarize.
+        Returns:
+            runSummary: Summary of the run.
+        """
+        subsystemNames = tuple(sorted(run.subsystems.keys()))
+        startOfRun = run.subsystems[subsystemNames[-1]].startOfRun if subsystemNames else -1
+        mostRecentFileTime = getattr(run, "mostRecentFileTime", None)
+        if mostRecentFileTime is None:
+            # The files are stored by time stamp, so the most recent file is available via ``maxKey()``.
+            mostRecentFileTime = max([subsystem.files.maxKey() for subsystem in itervalues(run.subsystems) if len(subsystem.files)] or [-1])
+        newFile = any(getattr(subsystem, "newFile", False) for subsystem in itervalues(run.subsystems))
+        # Archived runs only store whether there is a combined file.
+        combinedFileSubsystems = tuple(name for name in subsystemNames
+                                       if getattr(run.subsystems[name], "combinedFile", None) or getattr(run.subsystems[name], "hasCombinedFile", False))
+        return cls(runDir = run.runDir, prettyName = run.prettyName, startOfRun = startOfRun,
+                   mostRecentFileTime = mostRecentFileTime, newFile = newFile, subsystems = subsystemNames,
+                   hltMode = run.hltMode, combinedFileSubsystems = combinedFileSubsystems)
+
+    def matches(self, minTime = None, maxTime = None, hltMode = None, subsystem = None, hasCombinedFile = None):
+        """ Check whether the run matches the given selections.
+
+        Args:
+            minTime (int): Minimum start of the run in unix time (inclusive). Default: ``None``.
+            maxTime (int): Maximum start of the run in unix time (inclusive). Default: ``None``.
+            hltMode (str): Required HLT mode. Default: ``None``.
+            subsystem (str): Subsystem which must be available in the run. Default: ``None``.
+            hasCombinedFile (bool): If True, require a combined file (for ``subsystem`` if given, or otherwise
+                for any subsystem). If False, require that there is no combined file. Default: ``None``.
+        Returns:
+            bool: True if the run matches all of the selections which are not ``None``.
+        """
+        if minTime is not None and self.startOfRun < minTime:
+            return False
+        if maxTime is not None and self.startOfRun > maxTime:
+            return False
+        if hltMode is not None and self.hltMode != hltMode:
+            return False
+        if subsystem is not None and subsystem not in self.subsystems:
+            return False
+        if hasCombinedFile is not None:
+            combinedFile = subsystem in self.combinedFileSubsystems if subsystem is not None else len(self.combinedFileSubsystems) > 0
+            if combinedFile != hasCombinedFile:
+                return False
+        return True
+
+    @property
+    def runNumber(self):
+        """ Run number extracted from the ``runDir``. """
+        return int(self.runDir.replace("Run", ""))
+
+    def isRunOngoing(self):
+        """ Checks if a run is ongoing.
+
+        See ``runContainer.isRunOngoing()``. A run without any files is not considered to be ongoing.
+
+        Args:
+            None
+        Returns:
+            bool: True if the run is ongoing.
+        """
+        if self.newFile:
+            return True
+        return self.mostRecentFileTime >= 0 and self.minutesSinceLastTimestamp() < 5
+
+    def minutesSinceLastTimestamp(self):
+        """ Determine the time since the last file timestamp in minutes.
+
+        Args:
+            None.
+        Returns:
+            float: Minutes since the timestamp of the most recent file. Default: -1.
+        """
+        if self.mostRecentFileTime < 0:
+            return -1
+        geneva = pendulum.from_timestamp(self.mostRecentFileTime, tz = "Europe/Zurich")
+        return pendulum.now().diff(geneva).in_minutes()
+
+    def startOfRunTimeStamp(self):
+        """ Provides the start of the run time stamp in a format suitable for display.
+
+        See ``runContainer.startOfRunTimeStamp()``.
+
+        Args:
+            None
+        Returns:
+            str: Start of run time stamp formatted in an appropriate manner for display.
+        """
+        if self.startOfRun < 0:
+            return False
+        return subsystemContainer.prettyPrintUnixTime(self.startOfRun)
+
+# Summaries which were stored before the HLT mode and combined files were recorded don't contain those fields.
+runSummary.__new__.__defaults__ = (None, ())
+
+class runListIndex(persistent.Persistent):
+    """ Index of the available runs, which is used to paginate the run list.
+
+    Determining the number of runs or selecting runs by position in the ``runs`` BTree requires loading
+    every bucket of the tree. Instead, the index stores the ``runDir`` by run number, such that a page of runs
+    can be selected by range queries relative to a given run number, and maintains the number of runs.
+    The cost of selecting a page therefore only depends on the number of runs in the page.
+
+    Args:
+        None.
+
+    The index also stores a summary of each run (see ``runSummary``), which contains all of the information
+    which is needed to display the run list. The summaries are updated by the processing when the runs change.
+
+    Args:
+        None.
+
+    Attributes:
+        runDirs (IOBTree): Map from the run number to the ``runDir``.
+        numberOfRuns (BTrees.Length.Length): Number of runs in the index. It resolves conflicting changes,
+            so runs can be added concurrently.
+        summaries (IOBTree): Map from the run number to the summary of the run, stored as a tuple.
+            ``None`` if the index was created before summaries were stored.
+    """
+    # Default for indices which were stored before summaries were introduced.
+    summaries = None
+
+    def __init__(self):
+        self.runDirs = BTrees.IOBTree.BTree()
+        self.numberOfRuns = BTrees.Length.Length()
+        self.summaries = BTrees.IOBTree.BTree()
+
+    @classmethod
+    def fromRuns(cls, runs):
+        """ Create the index from the existing runs.
+
+        Args:
+            runs (BTree): Dict-like object which stores all run, subsystem, and hist information. Keys are the
+                ``runDir``, while the values are ``runContainer`` objects.
+        Returns:
+            runListIndex: Index containing all of the runs.
+        """
+        index = cls()
+        for runDir, run in iteritems(runs):
+            index.addRun(runDir)
+            index.updateSummary(run)
+        return index
+
+    def __len__(self):
+        """ Number of runs in the index. """
+        return self.numberOfRuns()
+
+    def addRun(self, runDir):
+        """ Add a run to the index. Adding a run which is already in the index has no effect.
+
+        Args:
+            runDir (str): String containing the run number. For an example run 123456, it should be
+                formatted as ``Run123456``.
+        Returns:
+            None.
+        """
+        runNumber = int(runDir.replace("Run", ""))
+        if runNumber not in self.runDirs:
+            self.runDirs[runNumber] = runDir
+            self.numberOfRuns.change(1)
+
+    def removeRun(self, runDir):
+        """ Remove a run and its summary from the index. Removing a run which isn't in the index has no effect.
+
+        Args:
+            runDir (str): String containing the run number. For an example run 123456, it should be
+                formatted as ``Run123456``.
+        Returns:
+            bool: True if the run was removed from the index.
+        """
+        runNumber = int(runDir.replace("Run", ""))
+        if self.summaries is not None:
+            self.summaries.pop(runNumber, None)
+        if runNumber not in self.runDirs:
+            return False
+        del self.runDirs[runNumber]
+        self.numberOfRuns.change(-1)
+        return True
+
+    def updateSummary(self, run):
+        """ Update the stored summary of a run.
+
+        The summary is only stored if it has changed, such that unchanged runs don't lead to database writes.
+
+        Args:
+            run (runContainer or archivedRunContainer): Run whose summary should be updated.
+        Returns:
+            None.
+        """
+        if self.summaries is None:
+            self.summaries = BTrees.IOBTree.BTree()
+        summary = tuple(runSummary.fromRun(run))
+        if self.summaries.get(run.runNumber) != summary:
+            self.summaries[run.runNumber] = summary
+
+    def retrieveSummaries(self, runDirs, runs):
+        """ Retrieve the summaries of the given runs.
+
+        If a summary isn't available (for example, if it hasn't been stored by the processing yet), it is
+        created from the run.
+
+        Args:
+            runDirs (list): ``runDir`` of the runs.
+            runs (BTree): Dict-like object which stores all run, subsystem, and hist information. Keys are the
+                ``runDir``, while the values are ``runContainer`` objects.
+        Returns:
+            list: ``runSummary`` of each of the runs.
+        """
+        summaries = []
+        for runDir in runDirs:
+            summary = self.summaries.get(int(runDir.replace("Run", ""))) if self.summaries is not None else None
+            summaries.append(runSummary(*summary) if summary is not None else runSummary.fromRun(runs[runDir]))
+        return summaries
+
+    def outdatedSummaries(self):
+        """ Find the stored summaries which predate fields that were later added to ``runSummary``.
+
+        Such summaries can still be retrieved (the missing fields take their default values), but they
+        should be updated so that the missing fields are available.
+
+        Args:
+            None.
+        Returns:
+            list: ``runDir`` of the runs with outdated summaries.
+        """
+        if self.summaries is None:
+            return []
+        return [summary[0] for summary in self.summaries.values() if len(summary) < len(runSummary._fields)]
+
+    def olderRuns(self, runNumber = None, numberOfRuns = 50, inclusive = True):
+        """ Select runs starting from a given run and continuing to older runs.
+
+        Args:
+            runNumber (int): Run number from where to start. Default: ``None``, which corresponds to
+                the most recent run.
+            numberOfRuns (int): Maximum number of runs to select. Default: 50.
+            inclusive (bool): If True, include ``runNumber`` if it is available. Default: True.
+        Returns:
+            list: ``runDir`` of the selected runs, ordered from newest to oldest.
+        """
+        runDirs = []
+        maxRunNumber = runNumber
+        if maxRunNumber is not None and not inclusive:
+            maxRunNumber -= 1
+        while len(runDirs) < numberOfRuns:
+            try:
+                maxRunNumber = self.runDirs.maxKey(maxRunNumber)
+            except ValueError:
+                # There are no more older runs.
+                break
+            runDirs.append(self.runDirs[maxRunNumber])
+            maxRunNumber -= 1
+        return runDirs
+
+    def selectRuns(self, runs, runNumber = None, numberOfRuns = 50, maxRunsToCheck = 1000, **selections):
+        """ Select runs which match the given selections, starting from a given run and continuing to older runs.
+
+        The runs are checked via their summaries, so the runs themselves are not loaded. The number of runs which
+        are checked is limited, so the cost of a request doesn't grow with the number of runs. If the limit is
+        reached, the selection can be continued from the returned run number.
+
+        Since run numbers increase with time, the selection stops at the first run which started before
+        ``minTime``.
+
+        Args:
+            runs (BTree): Dict-like object which stores all run, subsystem, and hist information. Keys are the
+                ``runDir``, while the values are ``runContainer`` objects.
+            runNumber (int): Run number from where to start (inclusive). Default: ``None``, which corresponds
+                to the most recent run.
+            numberOfRuns (int): Maximum number of runs to select. Default: 50.
+            maxRunsToCheck (int): Maximum number of runs to check. Default: 1000.
+            selections (dict): Selections which the runs must match. See ``runSummary.matches(...)``.
+        Returns:
+            tuple: (summaries, nextRunNumber) where summaries (list) are the ``runSummary`` of the selected runs,
+                ordered from newest to oldest, and nextRunNumber (int) is the run number from where the selection
+                should continue, or ``None`` if there are no further runs.
+        """
+        selected = []
+        checked = 0
+        minTime = selections.get("minTime")
+        while len(selected) < numberOfRuns and checked < maxRunsToCheck:
+            runDirs = self.olderRuns(runNumber = runNumber, numberOfRuns = min(numberOfRuns, maxRunsToCheck - checked))
+            if not runDirs:
+                return (selected, None)
+            for summary in self.retrieveSummaries(runDirs, runs):
+                checked += 1
+                runNumber = summary.runNumber - 1
+                if minTime is not None and 0 <= summary.startOfRun < minTime:
+                    # All older runs started before the minimum time.
+                    return (selected, None)
+                if summary.matches(**selections):
+                    selected.append(summary)
+                    if len(selected) == numberOfRuns:
+                        break
+
+        # Only continue if there are older runs.
+        if not self.olderRuns(runNumber = runNumber, numberOfRuns = 1):
+            return (selected, None)
+        return (selected, runNumber)
+
+    def newerRuns(self, runNumber, numberOfRuns = 50):
+        """ Select runs which are newer than a given run.
+
+        Args:
+            runNumber (int): Run number from where to start. It is not included in the selected runs.
+            numberOfRuns (int): Maximum number of runs to select. Default: 50.
+        Returns:
+            list: ``runDir`` of the selected runs, ordered from newest to oldest.
+        """
+        runDirs = list(itertools.islice(self.runDirs.values(min = runNumber, excludemin = True), numberOfRuns))
+        return list(reversed(runDirs))
+
 class subsystemContainer(persistent.Persistent):
     """ Object to represent a particular subsystem (detector).
 
@@ -268,7 +727,23 @@ class subsystemContainer(persistent.Persistent):
             standard processing. The subsystem processing options can vary when processing a time slice,
             so storing the options allow us to return to the standard options when performing a full processing.
             Keys are the option names as string, while values are their corresponding values.
+        templateVersion (str): Version of the shared histogram templates used by the histograms in this subsystem.
+            Default: None, which means that the histograms use their own templates.
+        outputVersion (int): Version of the processing output (images and ``json``) of the subsystem. It is
+            incremented each time that the subsystem is processed, which allows cached information about the
+            output (such as rendered pages) to be invalidated. Default: 0.
+        outputHashes (BTree): Hashes of the content of the output files. Keys are the filenames relative
+            to the ``dirPrefix``, while values are the hashes. Default: ``None`` until the first hash is recorded.
+        latestOutputChanges (PersistentMapping): Output files which changed in the latest ``outputVersion``.
+            Keys are the filenames relative to the ``dirPrefix``, while values are the hashes. Default: ``None``
+            until the first new output version.
     """
+    # Defaults for attributes which were added after subsystems were first stored in the database.
+    templateVersion = None
+    outputVersion = 0
+    outputHashes = None
+    latestOutputChanges = None
+
     def __init__(self, subsystem, runDir, startOfRun, endOfRun, showRootFiles = False, fileLocationSubsystem = None):
         self.subsystem = subsystem
         self.showRootFiles = showRootFiles
@@ -325,6 +800,11 @@ class subsystemContainer(persistent.Persistent):
         # Processing options
         self.processingOptions = persistent.mapping.PersistentMapping()
 
+        # Version of the shared histogram templates. See ``shareHistogramTemplates(...)``.
+        self.templateVersion = None
+        # Version of the processing output.
+        self.outputVersion = 0
+
     def calculateRunLength(self, startOfRun = None, endOfRun = None):
         """ Helper function to update the run length.
 
@@ -426,6 +906,109 @@ class subsystemContainer(persistent.Persistent):
         self.histsInFile.clear()
         self.histsAvailable.clear()
         self.hists.clear()
+        self.templateVersion = None
+        # The output will be recreated, so the stored hashes are no longer valid.
+        self.outputHashes = None
+        self.latestOutputChanges = None
+
+    def recordOutputHash(self, filename, fileHash):
+        """ Record the hash of the content of an output file.
+
+        Args:
+            filename (str): Filename relative to the ``dirPrefix``.
+            fileHash (str): Hash of the content of the file.
+        Returns:
+            None.
+        """
+        if self.outputHashes is None:
+            self.outputHashes = BTrees.OOBTree.BTree()
+        # Avoid modifying the database if the output hasn't changed.
+        if self.outputHashes.get(filename) != fileHash:
+            self.outputHashes[filename] = fileHash
+            if self.latestOutputChanges is not None:
+                self.latestOutputChanges[filename] = fileHash
+
+    def newOutputVersion(self):
+        """ Start a new version of the processing output.
+
+        This should be called each time that the subsystem is processed. Files which are changed afterwards (as
+        recorded via ``recordOutputHash(...)``) are stored in ``latestOutputChanges``, such that clients which
+        have the previous version only need to update those files.
+
+        Args:
+            None.
+        Returns:
+            int: The new output version.
+        """
+        self.outputVersion += 1
+        self.latestOutputChanges = persistent.mapping.PersistentMapping()
+        return self.outputVersion
+
+    def outputChangesSince(self, outputVersion):
+        """ Determine the output files which have changed since a given output version.
+
+        Args:
+            outputVersion (int): Output version available to the client.
+        Returns:
+            dict: Files which have changed since the given version. Keys are the filenames relative to the
+                ``dirPrefix``, while values are the hashes. If the changes cannot be determined because the
+                version is too old, all output files are included.
+        """
+        if outputVersion == self.outputVersion:
+            return {}
+        if outputVersion == self.outputVersion - 1 and self.latestOutputChanges is not None:
+            return dict(self.latestOutputChanges)
+        return dict(self.outputHashes.items()) if self.outputHashes is not None else {}
+
+    def outputHash(self, filename):
+        """ Retrieve the hash of the content of an output file.
+
+        Args:
+            filename (str): Filename relative to the ``dirPrefix``.
+        Returns:
+            str: Hash of the content of the file, or ``None`` if it is not available.
+        """
+        if self.outputHashes is None:
+            return None
+        return self.outputHashes.get(filename)
+
+    def filesInTimeRange(self, minTime = None, maxTime = None, maxFiles = None):
+        """ Retrieve the files within a given time range.
+
+        The files are stored by their unix time stamp, so the range is determined by a BTree range query,
+        which only needs to load the files within the range.
+
+        Args:
+            minTime (int): Minimum unix time of the files (inclusive). Default: ``None``, which corresponds
+                to the start of the run.
+            maxTime (int): Maximum unix time of the files (inclusive). Default: ``None``, which corresponds
+                to the end of the run.
+            maxFiles (int): Maximum number of files to retrieve, starting from the oldest file in the range.
+                Default: ``None``, which retrieves all of the files in the range.
+        Returns:
+            list: ``fileContainer`` objects within the time range, sorted by time.
+        """
+        return list(itertools.islice(self.files.values(minTime, maxTime), maxFiles))
+
+    def fileByFilename(self, filename):
+        """ Retrieve a file by its filename.
+
+        The time stamp is extracted from the filename, so the file can be looked up directly.
+
+        Args:
+            filename (str): Name of the file. It may include the path, but only the name itself is compared.
+        Returns:
+            fileContainer: The requested file, or ``None`` if it is not available.
+        """
+        filename = os.path.basename(filename)
+        try:
+            fileCont = self.files.get(utilities.extractTimeStampFromFilename(filename))
+        except (IndexError, ValueError):
+            # The filename doesn't contain a valid time stamp, so it cannot be one of our files.
+            return None
+        if fileCont is None or os.path.basename(fileCont.filename) != filename:
+            return None
+        return fileCont
 
 class timeSliceContainer(persistent.Persistent):
     """ Time slice information container.
@@ -651,6 +1234,87 @@ class histogramGroupContainer(persistent.Persistent):
                " plotInGridSelectionPattern = {plotInGridSelectionPattern}, histList: {histList}," \
                " plotInGrid: {plotInGrid}".format(self.__class__.__name__, **self.__dict__)
 
+class histogramTemplate(persistent.Persistent):
+    """ Histogram configuration which is shared between runs.
+
+    The configuration of a histogram (how it is named, drawn, and processed) is determined by the subsystem
+    plugins, so it is identical for every run of a subsystem. Rather than storing a copy in each run, the
+    configuration is stored in a template, which can be shared by the ``histogramContainer`` objects of
+    many runs. See ``shareHistogramTemplates(...)``.
+
+    Args:
+        histName (str): Name of the histogram. Doesn't necessarily need to be the same as ``TH1.GetName()``.
+        histList (list): List of histogram names that should contribute to this container. Default: None
+        prettyName (str): Name of the histogram that is appropriate for display. Default: ``None``, which
+            will lead to be it being set to ``histName``.
+
+    Attributes:
+        prettyName (str): Name of the histogram that is appropriate for display.
+        histList (list): List of histogram names that should contribute to this container.
+        histType (ROOT.TClass): Class of the histogram. For example, ``ROOT.TH1F``.
+        drawOptions (str): Draw options to be passed to ``TH1.Draw()`` when drawing the histogram.
+        projectionFunctionsToApply (PersistentList): List-like object of functions that perform projections
+            to the histogram.
+        functionsToApply (PersistentList): List-like object of functions that are applied to the histogram
+            during the processing step.
+        trendingObjects (PersistentList): List-like object of trending objects which operate on this histogram.
+    """
+    def __init__(self, histName, histList = None, prettyName = None):
+        self.prettyName = prettyName if prettyName is not None else histName
+        self.histList = histList
+        self.histType = None
+        self.drawOptions = ""
+        # Functions which will be applied to project an available histogram to a new derived histogram
+        self.projectionFunctionsToApply = persistent.list.PersistentList()
+        # Functions which will be applied to the histogram each time it is processed
+        self.functionsToApply = persistent.list.PersistentList()
+        # Trending objects which use this histogram
+        self.trendingObjects = persistent.list.PersistentList()
+
+    def __repr__(self):
+        """ Representation of the object. """
+        # Dummy call. See note at the top of the module.
+        self.prettyName
+        return "{}(histList = {histList}, prettyName = {prettyName})".format(self.__class__.__name__, **self.__dict__)
+
+    def signature(self, histName):
+        """ Describe the configuration in a way which can be compared between runs.
+
+        Functions are identified by their module and name, and the hist type by its name, so the signature
+        doesn't depend on the particular objects which were created for a given run.
+
+        Args:
+            histName (str): Name of the histogram which uses this template.
+        Returns:
+            str: Description of the template configuration.
+        """
+        def functionNames(functions):
+            return [getattr(func, "__module__", "") + "." + getattr(func, "__name__", str(func)) for func in functions]
+        histType = self.histType.GetName() if hasattr(self.histType, "GetName") else str(self.histType)
+        return repr((histName, self.prettyName, list(self.histList) if self.histList is not None else None,
+                     histType, self.drawOptions,
+                     functionNames(self.projectionFunctionsToApply), functionNames(self.functionsToApply),
+                     len(self.trendingObjects)))
+
+def _templateProperty(name):
+    """ Create a property which accesses the given attribute of the histogram template.
+
+    Args:
+        name (str): Name of the attribute in the ``histogramTemplate``.
+    Returns:
+        property: Property which gets and sets the attribute in the ``histogramContainer.template``.
+    """
+    def getter(self):
+        return getattr(self.template, name)
+
+    def setter(self, value):
+        # Plugins often set the same value each time that a histogram is processed. We avoid modifying the
+        # (shared) template in that case, as it would otherwise be written to the database each time.
+        if getattr(self.template, name) != value:
+            setattr(self.template, name, value)
+
+    return property(getter, setter, doc = "Shared via the histogram template. See ``histogramTemplate.{name}``.".format(name = name))
+
 class histogramContainer(persistent.Persistent):
     """ Histogram information container.
 
@@ -658,6 +1322,11 @@ class histogramContainer(persistent.Persistent):
     process and otherwise modify the histogram, which are specified through the plugin system. The
     container also manages plotting details.
 
+    Only the per-run state (the name, the extracted information, and the underlying histogram and canvas
+    while processing) is stored in the container itself. The configuration which is the same for every run
+    is stored in a ``histogramTemplate``, which is available through the same attributes as before, such
+    that the plugins can continue to set, for example, ``hist.prettyName`` or ``hist.functionsToApply``.
+
     Note:
         The histogram container doesn't always have access to the underlying histogram. When constructing
         the container, it is useful to have the histogram available to provide some information, but then
@@ -698,36 +1367,58 @@ class histogramContainer(persistent.Persistent):
         trendingObjects (PersistentList): List-like object of trending objects which operate on this
             histogram. See the :doc:`detector subsystem and trending README </detectorPluginsReadme>`
             for more information.
+        template (histogramTemplate): Configuration of the histogram, which may be shared between runs.
+            ``prettyName``, ``histList``, ``histType``, ``drawOptions``, ``projectionFunctionsToApply``,
+            ``functionsToApply``, and ``trendingObjects`` are stored here.
     """
+    # Configuration stored in the (shared) template.
+    _templateAttributes = ["prettyName", "histList", "histType", "drawOptions",
+                           "projectionFunctionsToApply", "functionsToApply", "trendingObjects"]
+    prettyName = _templateProperty("prettyName")
+    histList = _templateProperty("histList")
+    histType = _templateProperty("histType")
+    drawOptions = _templateProperty("drawOptions")
+    projectionFunctionsToApply = _templateProperty("projectionFunctionsToApply")
+    functionsToApply = _templateProperty("functionsToApply")
+    trendingObjects = _templateProperty("trendingObjects")
+
     def __init__(self, histName, histList = None, prettyName = None):
         # Replace any slashes with underscores to ensure that it can be used safely as a filename
         #histName = histName.replace("/", "_")
         self.histName = histName
-        # Only assign if meaningful
-        if prettyName is not None:
-            self.prettyName = prettyName
-        else:
-            self.prettyName = self.histName
+        # Each container starts with it's own template. It may later be replaced by a shared template.
+        self.template = histogramTemplate(histName = histName, histList = histList, prettyName = prettyName)
 
-        self.histList = histList
         self.information = persistent.mapping.PersistentMapping()
         self.hist = None
-        self.histType = None
-        self.drawOptions = ""
         # Contains the canvas where the hist may be plotted, along with additional content
         self.canvas = None
-        # Functions which will be applied to project an available histogram to a new derived histogram
-        self.projectionFunctionsToApply = persistent.list.PersistentList()
-        # Functions which will be applied to the histogram each time it is processed
-        self.functionsToApply = persistent.list.PersistentList()
-        # Trending objects which use this histogram
-        self.trendingObjects = persistent.list.PersistentList()
+
+    def __setstate__(self, state):
+        """ Load the stored state, moving the configuration of containers stored before templates into a template.
+
+        Args:
+            state (dict): Stored state of the object.
+        Returns:
+            None.
+        """
+        if "template" not in state:
+            state = dict(state)
+            template = histogramTemplate(histName = state["histName"])
+            for name in self._templateAttributes:
+                if name in state:
+                    setattr(template, name, state.pop(name))
+            state["template"] = template
+        super(histogramContainer, self).__setstate__(state)
 
     def __repr__(self):
         """ Representation of the object. """
         # Dummy call. See note at the top of the module.
         self.histName
-        return "{}(histName = {histName}, histList = {histList}, prettyName = {prettyName})".format(self.__class__.__name__, **self.__dict__)
+        return "{}(histName = {histName}, histList = {histList}, prettyName = {prettyName})".format(self.__class__.__name__,
+                                                                                                    histName = self.histName,
+                                                                                                    histList = self.histList,
+                                                                                                    prettyName = self.prettyName)
 
     def __str__(self):
         """ Print many of the elements of the object. """
@@ -736,7 +1427,17 @@ class histogramContainer(persistent.Persistent):
         return "{}: histName = {histName}, histList = {histList}, prettyName = {prettyName}," \
                " information: {information}, hist: {hist}, histType: {histType}, drawOptions: {drawOptions}," \
                " canvas: {canvas}, projectionFunctionsToApply: {projectionFunctionsToApply}," \
-               " functionsToApply: {functionsToApply}".format(self.__class__.__name__, **self.__dict__)
+               " functionsToApply: {functionsToApply}".format(self.__class__.__name__,
+                                                              histName = self.histName,
+                                                              histList = self.histList,
+                                                              prettyName = self.prettyName,
+                                                              information = self.information,
+                                                              hist = self.hist,
+                                                              histType = self.histType,
+                                                              drawOptions = self.drawOptions,
+                                                              canvas = self.canvas,
+                                                              projectionFunctionsToApply = self.projectionFunctionsToApply,
+                                                              functionsToApply = self.functionsToApply)
 
     def retrieveHistogram(self, ROOT, fIn = None, trending = None):
         """ Retrieve the histogram from the given file or trending container.
@@ -763,7 +1464,9 @@ class histogramContainer(persistent.Persistent):
                     for name in self.histList:
                         logger.debug("HistName in list: {name}".format(name = name))
                         self.hist.Add(fIn.GetKey(name).ReadObj())
-                    self.drawOptions += "nostack"
+                    # Only add the option once, as the configuration is stored (and may be shared between runs).
+                    if "nostack" not in self.drawOptions:
+                        self.drawOptions += "nostack"
                     # TODO: Allow for further configuration of THStack, like TLegend and such
                 elif len(self.histList) == 1:
                     # Projective histogram
@@ -801,3 +1504,41 @@ class histogramContainer(persistent.Persistent):
             returnValue = False
 
         return returnValue
+
+def shareHistogramTemplates(subsystem, templates):
+    """ Replace the histogram templates of a subsystem with templates which are shared between runs.
+
+    The templates of all histograms in the subsystem together define a template version. If an identical
+    version has already been stored (ie. from another run of the same subsystem), the histograms use
+    those existing templates. Otherwise, the current templates are stored as a new version. Any change to
+    the subsystem plugins (or to the histograms available in the file) will lead to a new version, so
+    runs processed with different configurations never affect each other.
+
+    Note:
+        This should be called after the histograms have been fully configured (ie. after the processing
+        functions have been determined).
+
+    Args:
+        subsystem (subsystemContainer): Subsystem whose histograms should share templates.
+        templates (BTree): Shared templates for the subsystem. Keys are the template versions, while values
+            are BTrees which map the histogram name to the ``histogramTemplate``.
+    Returns:
+        str: The template version which is used by the subsystem.
+    """
+    # The same container may be stored in multiple places, so we collect them by name.
+    hists = {}
+    for histsContainer in [subsystem.histsInFile, subsystem.histsAvailable, subsystem.hists]:
+        hists.update(histsContainer)
+
+    signatures = sorted(hist.template.signature(histName) for histName, hist in iteritems(hists))
+    version = hashlib.sha1("\n".join(signatures).encode()).hexdigest()
+    if version not in templates:
+        logger.info("Storing new histogram template version {version} for subsystem {subsystem}".format(version = version, subsystem = subsystem.subsystem))
+        templates[version] = BTrees.OOBTree.BTree({histName: hist.template for histName, hist in iteritems(hists)})
+
+    sharedTemplates = templates[version]
+    for histName, hist in iteritems(hists):
+        hist.template = sharedTemplates[histName]
+    subsystem.templateVersion = version
+
+    return version
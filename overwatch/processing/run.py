@@ -50,6 +50,7 @@ sentry_sdk.init(dsn = sentryDSN, integrations = [sentry_logging])
 
 # Imports are below here so that they can be logged
 from overwatch.processing import processRuns
+from overwatch.base import databaseMaintenance
 
 def run():
     """ Main entry point for starting ``processAllRuns()``.
@@ -71,7 +72,13 @@ def run():
     logger.info("Starting processing with sleep time of {sleepTime}.".format(sleepTime = sleepTime))
     # Create connection information here so the processing doesn't attempt to access the database
     # each time that it runs during repeating processing, as such attempts will confuse the database lock.
-    (dbRoot, connection) = utilities.getDB(processingParameters["databaseLocation"])
+    (dbRoot, connection) = utilities.getDB(processingParameters["databaseLocation"],
+                                           cacheSize = processingParameters["databaseCacheSize"],
+                                           poolSize = processingParameters["databasePoolSize"])
+    # The database is packed in the background so it doesn't block the processing.
+    packScheduler = None
+    if processingParameters["databasePackDuringProcessing"]:
+        packScheduler = databaseMaintenance.createPackScheduler(db = connection.db(), parameters = processingParameters)
     while not handler.exit.is_set():
         # Note both the time that the processing started, as well as the execution time.
         logger.info("Running processing at {time}.".format(time = pendulum.now()))
@@ -80,12 +87,16 @@ def run():
         processRuns.processAllRuns(dbRoot, connection)
         end = timeit.default_timer()
         logger.info("Processing complete in {time} seconds".format(time = end - start))
+        if packScheduler:
+            packScheduler.packIfDue()
         # Only execute once if the sleep time is <= 0. Otherwise, sleep and repeat.
         if sleepTime > 0:
             handler.exit.wait(sleepTime)
         else:
             break
 
+    if packScheduler:
+        packScheduler.wait()
     connection.close()
 
 if __name__ == "__main__":
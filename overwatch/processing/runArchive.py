@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+""" Archive finished runs outside of the main database.
+
+All runs are stored in the ``runs`` BTree of the database, including their histogram and time slice
+information. Over years of data taking, the old runs bloat the database and object caches, even though
+they are rarely accessed. To avoid this, finished runs can be moved to an archive, which stores each run
+in a compact, compressed file. The run is replaced in the database by a small ``archivedRunContainer``,
+which contains enough information to list the run. The full run is loaded on demand (for example, when
+a user opens the run page), and a small number of loaded runs are cached in memory.
+
+The archived runs are loaded as standalone objects, which are not connected to the database. Consequently,
+they are effectively read-only: any changes are not stored. If a run needs to be modified (for example, if
+new files arrive for it or a time slice is requested), it must first be restored into the database via
+``restoreRun(...)``.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+from __future__ import print_function
+from __future__ import absolute_import
+from future.utils import iteritems
+
+import collections
+import gzip
+import os
+import pickle
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+import BTrees.OOBTree
+
+from . import processingClasses
+
+#: Archived runs which have been loaded into memory. Keys are ``(archiveFilename, modification time)``,
+#: while values are the loaded ``runContainer`` objects. Ordered from least to most recently used.
+_loadedRuns = collections.OrderedDict()
+_loadedRunsLock = threading.Lock()
+
+class RunDataUnavailable(Exception):
+    """ Raised when the archive of a run can't be loaded (for example, if the file was removed).
+
+    Args:
+        runDir (str): String containing the run number. For an example run 123456, it should be
+            formatted as ``Run123456``.
+        archiveFilename (str): Path to the archive of the run.
+        error (Exception): Error which was raised when loading the archive.
+
+    Attributes:
+        runDir (str): String containing the run number.
+        archiveFilename (str): Path to the archive of the run.
+    """
+    def __init__(self, runDir, archiveFilename, error):
+        self.runDir = runDir
+        self.archiveFilename = archiveFilename
+        super(RunDataUnavailable, self).__init__("Run data unavailable for {runDir}: unable to load {archiveFilename} ({error})".format(runDir = runDir, archiveFilename = archiveFilename, error = error))
+
+def isArchived(run):
+    """ Check whether a run has been moved to the archive.
+
+    Args:
+        run (runContainer or archivedRunContainer): Run to check.
+    Returns:
+        bool: True if the run has been archived.
+    """
+    return isinstance(run, processingClasses.archivedRunContainer)
+
+def archiveRun(runs, runDir, archiveDirectory):
+    """ Move a run from the database to the archive.
+
+    The full run is written to ``{archiveDirectory}/{runDir}.pickle.gz`` and then replaced in ``runs``
+    by an ``archivedRunContainer``. The file is written to a temporary file and then moved into place,
+    such that a partially written archive is never loaded. The change to the database must be committed
+    by the caller.
+
+    Args:
+        runs (BTree): Dict-like object which stores all run, subsystem, and hist information. Keys are the
+            ``runDir``, while the values are ``runContainer`` objects.
+        runDir (str): String containing the run number. For an example run 123456, it should be
+            formatted as ``Run123456``.
+        archiveDirectory (str): Directory where the archived runs are stored.
+    Returns:
+        str: Path to the archived run.
+    """
+    run = runs[runDir]
+    if not os.path.exists(archiveDirectory):
+        os.makedirs(archiveDirectory)
+    archiveFilename = os.path.join(archiveDirectory, "{runDir}.pickle.gz".format(runDir = runDir))
+
+    # Pickling the run also loads and stores all of the objects which it contains.
+    # Protocol 2 is used to retain compatibility with python 2.
+    temporaryFilename = archiveFilename + ".tmp"
+    with gzip.open(temporaryFilename, "wb") as f:
+        pickle.dump(run, f, protocol = 2)
+    os.rename(temporaryFilename, archiveFilename)
+
+    runs[runDir] = processingClasses.archivedRunContainer(run = run, archiveFilename = archiveFilename)
+    logger.info("Archived {prettyName} to {archiveFilename}".format(prettyName = run.prettyName, archiveFilename = archiveFilename))
+
+    return archiveFilename
+
+def archiveFinishedRuns(runs, archiveDirectory, archiveAfterDays):
+    """ Move runs which finished long enough ago into the archive.
+
+    The most recent run is never archived, as it used to determine whether a run is ongoing.
+
+    Args:
+        runs (BTree): Dict-like object which stores all run, subsystem, and hist information. Keys are the
+            ``runDir``, while the values are ``runContainer`` objects.
+        archiveDirectory (str): Directory where the archived runs are stored.
+        archiveAfterDays (float): Archive runs when the most recent file was received more than this
+            many days ago.
+    Returns:
+        list: runDirs of the runs that were archived.
+    """
+    archivedRuns = []
+    if len(runs) == 0:
+        return archivedRuns
+    mostRecentRunDir = runs.keys()[-1]
+    for runDir, run in iteritems(runs):
+        if runDir == mostRecentRunDir or isArchived(run):
+            continue
+        # minutesSinceLastTimestamp() will return -1 if it can't be determined, so such runs will be skipped.
+        if run.minutesSinceLastTimestamp() > archiveAfterDays * 24 * 60 and not run.isRunOngoing():
+            archivedRuns.append(runDir)
+
+    for runDir in archivedRuns:
+        archiveRun(runs = runs, runDir = runDir, archiveDirectory = archiveDirectory)
+
+    return archivedRuns
+
+def loadArchivedRun(archivedRun, cacheSize = 5):
+    """ Load the full run from the archive.
+
+    Loaded runs are cached in memory, such that repeated requests for the same run (such as navigating
+    between histograms on the run page) don't require loading it again.
+
+    Args:
+        archivedRun (archivedRunContainer): Placeholder of the archived run.
+        cacheSize (int): Maximum number of loaded runs to keep in memory. Default: 5.
+    Returns:
+        runContainer: The full run.
+    Raises:
+        RunDataUnavailable: If the archive can't be loaded.
+    """
+    archiveFilename = archivedRun.archiveFilename
+    try:
+        # The modification time is included in case the run was restored and archived again.
+        key = (archiveFilename, os.path.getmtime(archiveFilename))
+    except OSError as e:
+        raise RunDataUnavailable(runDir = archivedRun.runDir, archiveFilename = archiveFilename, error = e)
+    with _loadedRunsLock:
+        run = _loadedRuns.pop(key, None)
+        if run is None:
+            logger.debug("Loading archived run from {archiveFilename}".format(archiveFilename = archiveFilename))
+            try:
+                with gzip.open(archiveFilename, "rb") as f:
+                    run = pickle.load(f)
+            except (IOError, OSError) as e:
+                raise RunDataUnavailable(runDir = archivedRun.runDir, archiveFilename = archiveFilename, error = e)
+        # Store as the most recently used.
+        _loadedRuns[key] = run
+        while len(_loadedRuns) > cacheSize:
+            _loadedRuns.popitem(last = False)
+
+    return run
+
+def retrieveRun(runs, runDir, cacheSize = 5):
+    """ Retrieve a full run, regardless of whether it is stored in the database or the archive.
+
+    Args:
+        runs (BTree): Dict-like object which stores all run, subsystem, and hist information. Keys are the
+            ``runDir``, while the values are ``runContainer`` objects.
+        runDir (str): String containing the run number. For an example run 123456, it should be
+            formatted as ``Run123456``.
+        cacheSize (int): Maximum number of archived runs to keep in memory. Default: 5.
+    Returns:
+        runContainer: The full run.
+    Raises:
+        RunDataUnavailable: If the run is archived, but the archive can't be loaded.
+    """
+    run = runs[runDir]
+    if isArchived(run):
+        run = loadArchivedRun(archivedRun = run, cacheSize = cacheSize)
+    return run
+
+def restoreRun(runs, runDir, histogramTemplates = None):
+    """ Restore an archived run into the database so that it can be modified.
+
+    The change to the database must be committed by the caller. The archive file is left in place,
+    and will be replaced if the run is archived again. Since the archive contains copies of the histogram
+    templates, the restored histograms are switched back to the templates shared in the database.
+
+    Args:
+        runs (BTree): Dict-like object which stores all run, subsystem, and hist information. Keys are the
+            ``runDir``, while the values are ``runContainer`` objects.
+        runDir (str): String containing the run number. For an example run 123456, it should be
+            formatted as ``Run123456``.
+        histogramTemplates (BTree): Histogram templates shared between runs. Keys are subsystem names, while
+            values are the templates for that subsystem. See ``processingClasses.shareHistogramTemplates(...)``.
+            Default: ``None``, in which case the restored run keeps its own copies of the templates.
+    Returns:
+        runContainer: The restored run.
+    Raises:
+        RunDataUnavailable: If the archive can't be loaded.
+    """
+    archivedRun = runs[runDir]
+    logger.info("Restoring {prettyName} from the archive.".format(prettyName = archivedRun.prettyName))
+    # Load directly rather than through the cache, as the restored objects will be added to the database.
+    try:
+        with gzip.open(archivedRun.archiveFilename, "rb") as f:
+            run = pickle.load(f)
+    except (IOError, OSError) as e:
+        raise RunDataUnavailable(runDir = runDir, archiveFilename = archivedRun.archiveFilename, error = e)
+    if histogramTemplates is not None:
+        for subsystem in run.subsystems.values():
+            # Only subsystems which shared their templates before they were archived.
+            if subsystem.templateVersion is None:
+                continue
+            if subsystem.subsystem not in histogramTemplates:
+                histogramTemplates[subsystem.subsystem] = BTrees.OOBTree.BTree()
+            processingClasses.shareHistogramTemplates(subsystem, histogramTemplates[subsystem.subsystem])
+    runs[runDir] = run
+    return run
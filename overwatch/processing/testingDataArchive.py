@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+""" Create archives of testing data for Overwatch development.
+
+The testing data archive contains the minimum set of files which are necessary to run Overwatch for a few
+recent runs. The default archive is created in a background thread by the processing when new runs arrive, and
+is stored under a name derived from the selected files (``testingDataArchive.{hash}.zip``). Consequently, it never
+needs to be recreated while serving a request, and an archive which is being downloaded is never overwritten.
+Archives of other selections of runs and subsystems are instead streamed directly to the user, without being
+written to disk.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import zipfile
+import logging
+logger = logging.getLogger(__name__)
+
+from . import processingClasses
+from . import runArchive
+
+#: Prefix of the archive filenames.
+archivePrefix = "testingDataArchive"
+
+#: Thread which is building the default archive in the background. ``None`` if no archive has been built.
+_buildThread = None
+_buildThreadLock = threading.Lock()
+
+def recentFiles(subsystem, numberOfFiles):
+    """ Select the most recent files of a subsystem.
+
+    Args:
+        subsystem (subsystemContainer): Subsystem for which the files should be selected.
+        numberOfFiles (int): Maximum number of files to select.
+    Returns:
+        list: ``fileContainer`` objects of the selected files, ordered from newest to oldest.
+    """
+    files = []
+    maxTime = None
+    while len(files) < numberOfFiles:
+        try:
+            # ``maxKey(...)`` is a tree lookup, so we avoid iterating over all of the files of the subsystem.
+            maxTime = subsystem.files.maxKey(maxTime)
+        except ValueError:
+            # There are no more files.
+            break
+        files.append(subsystem.files[maxTime])
+        maxTime -= 1
+    return files
+
+def subsystemFiles(subsystem):
+    """ Select the files of a subsystem which are needed for testing.
+
+    The minimum files are the combined file, and the most recent file received for the subsystem (they are
+    usually the same, but it is easier to include both). If possible, an additional file is included for testing
+    the time slice and trending functionality. It may not always be available if runs are extremely short.
+
+    Args:
+        subsystem (subsystemContainer): Subsystem for which the files should be selected.
+    Returns:
+        list: Filenames of the selected files, relative to the data directory.
+    """
+    filenames = []
+    if subsystem.combinedFile:
+        filenames.append(subsystem.combinedFile.filename)
+    # We select the 5th most recent file as an arbitrary point to ensure that there is some difference between
+    # the data stored in it and the combined file.
+    files = recentFiles(subsystem, 5)
+    if files:
+        filenames.append(files[0].filename)
+    if len(files) == 5:
+        filenames.append(files[-1].filename)
+    return filenames
+
+def selectFiles(runs, runIndex, subsystemList, runDirs = None, subsystems = None, numberOfRuns = 5, cacheSize = 5):
+    """ Select the files which should be included in a testing data archive.
+
+    By default, the most recent runs which have data for all subsystems are selected. Archived runs are old,
+    so they aren't so useful for testing and are skipped. Runs where any subsystem is unavailable are also
+    skipped to ensure that the data provided is of more utility.
+
+    Args:
+        runs (BTree): Dict-like object which stores all run, subsystem, and hist information. Keys are the
+            ``runDir``, while the values are ``runContainer`` objects.
+        runIndex (runListIndex): Index of the run numbers of the available runs. If it isn't available,
+            it is created from the runs.
+        subsystemList (list): List of all subsystems.
+        runDirs (list): Runs to include. If specified, the runs are included regardless of whether they are
+            archived or have data for all subsystems. Default: ``None``, which selects the most recent runs.
+        subsystems (list): Subsystems to include. Default: ``None``, which includes all subsystems.
+        numberOfRuns (int): Maximum number of runs to select if the runs are not specified. Default: 5.
+        cacheSize (int): Maximum number of archived runs to keep in memory. Default: 5.
+    Returns:
+        list: Filenames of the selected files, relative to the data directory.
+    """
+    if subsystems is None:
+        subsystems = subsystemList
+
+    selectedRuns = []
+    if runDirs is not None:
+        for runDir in runDirs:
+            if runDir in runs:
+                try:
+                    selectedRuns.append(runArchive.retrieveRun(runs = runs, runDir = runDir, cacheSize = cacheSize))
+                except runArchive.RunDataUnavailable as e:
+                    logger.warning(e)
+    else:
+        if runIndex is None:
+            runIndex = processingClasses.runListIndex.fromRuns(runs)
+        # Starting from the most recent run, we look for runs which have the full set of subsystems.
+        runNumber = None
+        while len(selectedRuns) < numberOfRuns:
+            candidateRunDirs = runIndex.olderRuns(runNumber = runNumber, numberOfRuns = numberOfRuns, inclusive = runNumber is None)
+            if not candidateRunDirs:
+                break
+            for runDir in candidateRunDirs:
+                run = runs[runDir]
+                if runArchive.isArchived(run) or set(subsystemList) != set(run.subsystems):
+                    continue
+                selectedRuns.append(run)
+                if len(selectedRuns) == numberOfRuns:
+                    break
+            runNumber = int(candidateRunDirs[-1].replace("Run", ""))
+
+    filenames = []
+    for run in selectedRuns:
+        for subsystemName in subsystems:
+            if subsystemName in run.subsystems:
+                filenames.extend(subsystemFiles(run.subsystems[subsystemName]))
+    return filenames
+
+def archiveFilename(filenames, dirPrefix):
+    """ Determine the name of the archive containing the given files.
+
+    The name is derived from the filenames (which include the run directory), as well as the size and
+    modification time of each file, such that it changes whenever the content of the archive would change.
+    This includes files which are rewritten in place, such as the combined file of an ongoing run.
+
+    Args:
+        filenames (list): Filenames of the files in the archive, relative to the data directory.
+        dirPrefix (str): Path to the data directory.
+    Returns:
+        str: Filename of the archive, relative to the data directory.
+    """
+    archiveHash = hashlib.sha1()
+    for filename in sorted(filenames):
+        try:
+            fileStat = os.stat(os.path.join(dirPrefix, filename))
+            fileInformation = "{size} {modificationTime}".format(size = fileStat.st_size, modificationTime = fileStat.st_mtime)
+        except OSError:
+            # The file is not available, so it will be reported when the archive is written.
+            fileInformation = "missing"
+        archiveHash.update("{filename} {fileInformation}\n".format(filename = filename, fileInformation = fileInformation).encode())
+    return "{prefix}.{hash}.zip".format(prefix = archivePrefix, hash = archiveHash.hexdigest()[:16])
+
+def _archiveName(filename, dirPrefix):
+    """ Determine the name of a file within the archive.
+
+    The files are stored under the name of the data directory so that the archive can be extracted
+    directly into an Overwatch directory.
+
+    Args:
+        filename (str): Filename relative to the data directory.
+        dirPrefix (str): Path to the data directory.
+    Returns:
+        str: Name of the file within the archive.
+    """
+    return os.path.join(os.path.basename(os.path.normpath(dirPrefix)), filename)
+
+def writeArchive(filenames, dirPrefix, fileObj):
+    """ Write the testing data archive.
+
+    Args:
+        filenames (list): Filenames of the files to include, relative to the data directory.
+        dirPrefix (str): Path to the data directory.
+        fileObj (str or file): Filename or file-like object where the archive should be written.
+    Returns:
+        None.
+    """
+    # ROOT files are already compressed, so there is nothing to gain from compressing them again.
+    with zipfile.ZipFile(fileObj, "w", zipfile.ZIP_STORED) as zipFile:
+        for filename in filenames:
+            zipFile.write(os.path.join(dirPrefix, filename), _archiveName(filename, dirPrefix))
+
+def _buildArchive(filenames, dirPrefix, zipFilename):
+    """ Build the default testing data archive and remove the previous archives.
+
+    The archive is written to a temporary file and then moved into place, such that a partially written archive
+    is never served. Previous archives are removed once the new archive is available. Files which are open (for
+    example, because they are being downloaded) remain available to the reader until they are closed.
+
+    Args:
+        filenames (list): Filenames of the files to include, relative to the data directory.
+        dirPrefix (str): Path to the data directory.
+        zipFilename (str): Filename of the archive, relative to the data directory.
+    Returns:
+        None.
+    """
+    if not os.path.exists(os.path.join(dirPrefix, zipFilename)):
+        logger.info("Creating testing data archive at {zipFilename}".format(zipFilename = os.path.join(dirPrefix, zipFilename)))
+        temporaryFilename = os.path.join(dirPrefix, "{zipFilename}.{pid}.tmp".format(zipFilename = zipFilename, pid = os.getpid()))
+        try:
+            writeArchive(filenames, dirPrefix, temporaryFilename)
+            os.rename(temporaryFilename, os.path.join(dirPrefix, zipFilename))
+        finally:
+            if os.path.exists(temporaryFilename):
+                os.remove(temporaryFilename)
+
+    # Remove the previous archives.
+    for filename in os.listdir(dirPrefix):
+        if filename.startswith(archivePrefix + ".") and filename.endswith(".zip") and filename != zipFilename:
+            os.remove(os.path.join(dirPrefix, filename))
+
+def _buildArchiveInBackground(filenames, dirPrefix, zipFilename):
+    """ Build the default testing data archive, logging any errors, since they can't be raised to the caller. """
+    try:
+        _buildArchive(filenames = filenames, dirPrefix = dirPrefix, zipFilename = zipFilename)
+    except (IOError, OSError) as e:
+        logger.warning("Failed to create testing data archive {zipFilename}: {e}".format(zipFilename = zipFilename, e = e))
+
+def createArchive(runs, runIndex, dirPrefix, subsystemList, numberOfRuns = 5, background = False):
+    """ Create the default testing data archive if it doesn't already exist.
+
+    The files are selected from the database by the caller's thread, while the archive can be written in a
+    background thread, such that the caller (for example, the processing) isn't delayed by writing it. Only one
+    archive is built in the background at a time. If a build is already in progress, the archive is not
+    created, and it will be considered again by the next call.
+
+    Args:
+        runs (BTree): Dict-like object which stores all run, subsystem, and hist information. Keys are the
+            ``runDir``, while the values are ``runContainer`` objects.
+        runIndex (runListIndex): Index of the run numbers of the available runs.
+        dirPrefix (str): Path to the data directory.
+        subsystemList (list): List of all subsystems.
+        numberOfRuns (int): Maximum number of runs to include. Default: 5.
+        background (bool): If True, write the archive in a background thread. Default: False.
+    Returns:
+        str: Filename of the archive, relative to the data directory. If it is written in the background, it
+            is only available once the thread has finished. ``None`` if there are no suitable runs, or if
+            another archive is already being built in the background.
+    """
+    global _buildThread
+    filenames = selectFiles(runs = runs, runIndex = runIndex, subsystemList = subsystemList, numberOfRuns = numberOfRuns)
+    if not filenames:
+        return None
+
+    zipFilename = archiveFilename(filenames, dirPrefix)
+    if not background:
+        _buildArchive(filenames = filenames, dirPrefix = dirPrefix, zipFilename = zipFilename)
+        return zipFilename
+
+    with _buildThreadLock:
+        if _buildThread is not None and _buildThread.is_alive():
+            logger.debug("The testing data archive is already being built, so {zipFilename} will not be built now.".format(zipFilename = zipFilename))
+            return None
+        if os.path.exists(os.path.join(dirPrefix, zipFilename)):
+            return zipFilename
+        # The thread isn't a daemon so that the archive is completed if the processing finishes in the meantime.
+        _buildThread = threading.Thread(target = _buildArchiveInBackground,
+                                        kwargs = {"filenames": filenames, "dirPrefix": dirPrefix, "zipFilename": zipFilename},
+                                        name = "testingDataArchive")
+        _buildThread.start()
+
+    return zipFilename
+
+class _streamBuffer(object):
+    """ Minimal write-only file-like object which collects the data written by ``zipfile`` to be streamed.
+
+    It doesn't support seeking, so ``zipfile`` writes the archive sequentially.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def retrieveData(self):
+        """ Retrieve and remove the data which has been written so far. """
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def streamArchive(filenames, dirPrefix, chunkSize = 1048576):
+    """ Stream a testing data archive without storing it on disk.
+
+    Args:
+        filenames (list): Filenames of the files to include, relative to the data directory.
+        dirPrefix (str): Path to the data directory.
+        chunkSize (int): Size of the chunks in which the files are read. Default: 1 MB.
+    Returns:
+        generator: Generator which yields the archive in chunks of bytes.
+    """
+    if sys.version_info < (3, 6):
+        # Writing entries incrementally to an unseekable stream isn't supported by ``zipfile``, so we write the
+        # archive to an anonymous temporary file and stream it from there.
+        with tempfile.TemporaryFile() as f:
+            writeArchive(filenames, dirPrefix, f)
+            f.seek(0)
+            for chunk in iter(lambda: f.read(chunkSize), b""):
+                yield chunk
+        return
+
+    stream = _streamBuffer()
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as zipFile:
+        for filename in filenames:
+            fullPath = os.path.join(dirPrefix, filename)
+            zipInfo = zipfile.ZipInfo.from_file(fullPath, _archiveName(filename, dirPrefix))
+            with open(fullPath, "rb") as inputFile, zipFile.open(zipInfo, "w") as outputFile:
+                for chunk in iter(lambda: inputFile.read(chunkSize), b""):
+                    outputFile.write(chunk)
+                    yield stream.retrieveData()
+    # The remainder of the last entry and the central directory are written when the archive is closed.
+    yield stream.retrieveData()
@@ -17,7 +17,10 @@ logger = logging.getLogger(__name__)
 import pendulum
 
 from overwatch.base import config
+from overwatch.base import chunkedUpload
 (receiverParameters, filesRead) = config.readConfig(config.configurationType.receiver)
+from overwatch.receiver import fileIndex
+from overwatch.receiver import fileValidation
 
 from flask import Flask, request, send_from_directory, jsonify, url_for
 from werkzeug.utils import secure_filename
@@ -31,6 +34,10 @@ ROOT.std.__file__ = "ROOT.std.py"
 
 app = Flask(__name__)
 
+# ROOT is used from the background validation thread as well as from the requests.
+if hasattr(ROOT, "EnableThreadSafety"):
+    ROOT.EnableThreadSafety()
+
 # From: http://flask.pocoo.org/docs/0.12/patterns/apierrors/
 class InvalidUsage(Exception):
     """ Provide an expressive error message for invalid REST API usage.
@@ -160,10 +167,29 @@ def dqm():
     response = {}
     # Handle the "GET request"
     if request.method == "GET":
-        # We use upper on the filename so that "DQM" will always match, regardless of the case in the file.
-        # "DQM" is unique enough in English that we don't need to worry about this matching unrelated files.
-        availableFiles = [f for f in os.listdir(receiverParameters["dataFolder"]) if os.path.isfile(os.path.join(receiverParameters["dataFolder"], f)) and "DQM" in f.upper()]
+        # The files are retrieved from the index rather than listing the data folder on every request.
+        # Rudimentary validation is provided by attempting to convert to the proper types, as for the POST request.
+        try:
+            (limit, runNumber, minTime, maxTime) = (int(request.args[name]) if name in request.args else None
+                                                    for name in ["limit", "runNumber", "minTime", "maxTime"])
+        except ValueError as e:
+            response["message"] = e.args
+            response["files"] = None
+            resp = jsonify(response)
+            resp.status_code = 400
+            return resp
+        maxListingSize = receiverParameters["receiverMaxListingSize"]
+        limit = min(max(limit, 1), maxListingSize) if limit is not None else maxListingSize
+
+        (selectedFiles, nextFile) = receivedFiles.retrieveFiles(runNumber = runNumber, agent = request.args.get("amoreAgent", None),
+                                                                minTime = minTime, maxTime = maxTime,
+                                                                after = request.args.get("after", None), limit = limit)
+        availableFiles = [information["filename"] for information in selectedFiles]
         response["files"] = availableFiles
+        # Pass as ``after`` to retrieve the next page of files.
+        response["next"] = nextFile
+        # Results of the full validation of the files which were received by this process.
+        response["validation"] = validator.retrieveResults(availableFiles)
         resp = jsonify(response)
         resp.status_code = 200
         return resp
@@ -189,6 +215,8 @@ def dqm():
         dataStatus = int(request.headers.get("dataStatus", -1))  # NOQA
         # Default to "DQM" if the agent cannot be found
         agent = str(request.headers.get("amoreAgent", "DQM"))
+        # Only available if the file is sent in chunks.
+        uploadParameters = chunkedUpload.chunkParameters(request.headers)
     except ValueError as e:
         # If one of the types is wrong, pass on the error message to the user
         response["message"] = e.args
@@ -221,8 +249,34 @@ def dqm():
     # - http://flask.pocoo.org/docs/0.12/patterns/fileuploads/
     # - https://pythonhosted.org/Flask-Uploads/
     # - https://stackoverflow.com/questions/10434599/how-to-get-data-received-in-flask-request
+    #
+    # In all cases, the file is written to a partial file and moved into place once it is complete,
+    # so the processing never sees an incomplete file.
     savedFile = False
-    if "file" in request.files:
+    if uploadParameters is not None:
+        # Handle a chunk of a file which is sent in multiple requests. The chunk is the body of the request,
+        # which is streamed to the file. See ``overwatch.base.chunkedUpload``.
+        logger.info("Handling chunk at offset {offset} of {length}".format(**uploadParameters))
+        try:
+            (offset, savedFile) = chunkedUpload.writeChunk(request.stream, outputPath, **uploadParameters)
+        except (chunkedUpload.OffsetMismatch, chunkedUpload.ChecksumMismatch) as e:
+            response["message"] = str(e)
+            response["uploadOffset"] = e.offset
+            response["received"] = None
+            resp = jsonify(response)
+            resp.status_code = 409 if isinstance(e, chunkedUpload.OffsetMismatch) else 400
+            return resp
+        response["uploadOffset"] = offset
+        if not savedFile:
+            # Wait for the remaining chunks.
+            response["status"] = 200
+            response["message"] = "Received chunk. Continue from offset {offset}".format(offset = offset)
+            response["filename"] = filename
+            response["received"] = None
+            resp = jsonify(response)
+            resp.status_code = response["status"]
+            return resp
+    elif "file" in request.files:
         # Handle multi-part file request. This is the preferred method!
         # We expect the file to be sent under the key "file".
 
@@ -231,33 +285,31 @@ def dqm():
         payloadFile = request.files["file"]
 
         # Save it out
-        payloadFile.save(outputPath)
-        savedFile = True
+        savedFile = chunkedUpload.saveStream(payloadFile.stream, outputPath) > 0
     else:
         # Get the payload by hand. This is strongly disfavored, such that it isn't documented
         # in the API reference.
         logger.info("Handling payload directly")
-        # Can use request.stream to get the data in an unmodified way
-        # Can use request.data to get the data as a string
-        # Can use request.get_data() to get all non-form data as the bytes of whatever is in the body
-        payload = request.get_data()
-        logger.info("payload: {payload}".format(payload = payload[:100]))
-        if payload:
-            # Not opening as ROOT file since we are just writing the bytes to a file
-            with open(outputPath, "wb") as fOut:
-                fOut.write(payload)
-
-            savedFile = True
-        else:
+        # The payload is streamed directly to the file rather than read into memory.
+        # Not opening as ROOT file since we are just writing the bytes to a file
+        savedFile = chunkedUpload.saveStream(request.stream, outputPath) > 0
+        if not savedFile:
             logger.warning("No payload...")
 
     if savedFile:
+        # Make the file available in the listing immediately.
+        receivedFiles.add(filename)
+
         # Extract received object info
-        (infoSuccess, receivedObjects) = receivedObjectInfo(outputPath)
+        # Only the file structure is checked here. The objects are fully validated in the background, and the
+        # result is available via the GET request.
+        (infoSuccess, receivedObjects) = checkFile(outputPath)
         if infoSuccess:
             response["status"] = 200
             response["message"] = "Successfully received file and extracted information"
             response["received"] = receivedObjects
+            response["validation"] = "pending"
+            validator.submit(filename, outputPath)
         else:
             response["status"] = 400
             response["message"] = "Successfully received the file, but the file is not valid! Perhaps it was corrupted?"
@@ -280,11 +332,38 @@ def dqm():
     logger.info("Response: {response}, resp: {resp}".format(response = response, resp = resp))
     return resp
 
+def checkFile(outputPath):
+    """ Check the integrity of a received file without reading the objects which it contains.
+
+    The file header and the list of keys are checked, which is sufficient to catch most truncated or
+    corrupted transfers. The objects themselves are validated in the background via ``receivedObjectInfo(...)``.
+
+    Args:
+        outputPath (str): Name of the file.
+    Returns:
+        tuple: (bool, dict). The bool is ``True`` if the file is valid. The dict contains information on the objects
+            available in the file. The keys (str) are the object names, while the values (str) are descriptions of
+            the objects in the file, including the filename and the type of object (as stored in the key).
+    """
+    success = False
+    receivedObjects = {}
+
+    fOut = ROOT.TFile.Open(outputPath, "READ")
+    # A file which had to be recovered was not closed properly, so it is likely truncated.
+    if fOut and not fOut.IsZombie() and not fOut.TestBit(ROOT.TFile.kRecovered):
+        for key in fOut.GetListOfKeys():
+            receivedObjects[key.GetName()] = "Obj name: {}, Obj IsA() Name: {}".format(key.GetName(), key.GetClassName())
+            success = True
+    if fOut:
+        fOut.Close()
+
+    return (success, receivedObjects)
+
 def receivedObjectInfo(outputPath):
     """ Print the ROOT objects in a received file.
 
     Helper function to confirm that the file was transferred successfully by reading the objects
-    contained within.
+    contained within. It is executed in the background by the ``validator``.
 
     Args:
         outputPath (str): Name of the file.
@@ -311,9 +390,17 @@ def receivedObjectInfo(outputPath):
 
         # Print to log for convenience
         logger.info(receivedObjects)
+        fOut.Close()
 
     return (success, receivedObjects)
 
+# Index of the received files for the file listing
+receivedFiles = fileIndex.receivedFileIndex(directory = receiverParameters["dataFolder"],
+                                            refreshInterval = receiverParameters["receiverIndexRefreshInterval"])
+# Validate received files in the background
+validator = fileValidation.validationQueue(validationFunction = receivedObjectInfo,
+                                           maxResults = receiverParameters["receiverValidationResultsSize"])
+
 @app.route("/rest/api/files/<string:filename>", methods = ["GET"])
 @checkForToken
 def returnFile(filename):
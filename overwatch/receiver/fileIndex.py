@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+""" Index of the files which were received by the DQM receiver.
+
+Listing the received files by scanning the data folder on every request becomes expensive during a long run,
+when the folder contains thousands of files. Instead, the ``receivedFileIndex`` keeps the received files in memory,
+sorted by time stamp. It is updated when a file is received, and by a background thread which watches the data
+folder for changes by other receiver processes or by the processing (which moves the files out of the folder).
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+from __future__ import absolute_import
+from builtins import range
+
+import bisect
+import os
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+from overwatch.base import utilities
+
+def fileInformation(filename):
+    """ Extract the information about a received file from its filename.
+
+    The filename format is ``{amoreAgent}histos_{runNumber}_{mode}_{YYYY_MM_DD_HH_mm_ss}.root``.
+
+    Args:
+        filename (str): Name of the received file.
+    Returns:
+        dict: ``filename``, ``agent``, ``runNumber``, and ``timestamp`` (unix time) of the file. The values
+            which can't be extracted from the filename are set to ``None``.
+    """
+    information = {"filename": filename, "agent": None, "runNumber": None, "timestamp": None}
+    splitFilename = filename.split("_")
+    if len(splitFilename) > 3 and splitFilename[0].endswith("histos"):
+        information["agent"] = splitFilename[0][:-len("histos")]
+        try:
+            information["runNumber"] = int(splitFilename[1])
+            information["timestamp"] = utilities.extractTimeStampFromFilename(filename)
+        except ValueError:
+            logger.debug("Unable to extract the run number or time stamp from {filename}".format(filename = filename))
+    return information
+
+class receivedFileIndex(object):
+    """ In-memory index of the files in the receiver data folder.
+
+    Files are included if they contain "DQM" in their name (regardless of case). The folder is rescanned
+    when its modification time changes, which is checked every ``refreshInterval`` seconds in a background
+    thread. The thread is started when the index is first used, such that it is started in each receiver process
+    (for example, after uwsgi forks the workers).
+
+    Args:
+        directory (str): Path to the data folder.
+        refreshInterval (float): Time in seconds between checks of the data folder for changes.
+
+    Attributes:
+        directory (str): Path to the data folder.
+        refreshInterval (float): Time in seconds between checks of the data folder for changes.
+        files (dict): Information about the files in the index (see ``fileInformation(...)``). Keys are the filenames.
+        sortedKeys (list): ``(timestamp, filename)`` of the files in the index, sorted in ascending order. Files
+            without a time stamp are sorted first.
+        directoryModificationTime (float): Modification time of the data folder when it was last scanned.
+        thread (threading.Thread): Background thread which watches the data folder.
+    """
+    def __init__(self, directory, refreshInterval):
+        self.directory = directory
+        self.refreshInterval = refreshInterval
+        self.files = {}
+        self.sortedKeys = []
+        self.directoryModificationTime = None
+        self.thread = None
+        self._lock = threading.Lock()
+        self._startLock = threading.Lock()
+
+    @staticmethod
+    def _sortKey(information):
+        """ Determine the key by which a file is sorted in the index. """
+        timestamp = information["timestamp"]
+        return (timestamp if timestamp is not None else -1, information["filename"])
+
+    def add(self, filename):
+        """ Add a file to the index.
+
+        Args:
+            filename (str): Name of the file in the data folder.
+        Returns:
+            None.
+        """
+        if "DQM" not in filename.upper():
+            return
+        information = fileInformation(filename)
+        with self._lock:
+            if filename in self.files:
+                return
+            self.files[filename] = information
+            bisect.insort(self.sortedKeys, self._sortKey(information))
+
+    def scan(self):
+        """ Rebuild the index from the content of the data folder.
+
+        Args:
+            None.
+        Returns:
+            None.
+        """
+        modificationTime = os.stat(self.directory).st_mtime
+        # We use upper on the filename so that "DQM" will always match, regardless of the case in the file.
+        # "DQM" is unique enough in English that we don't need to worry about this matching unrelated files.
+        files = {}
+        for f in os.listdir(self.directory):
+            if "DQM" in f.upper() and os.path.isfile(os.path.join(self.directory, f)):
+                files[f] = fileInformation(f)
+        sortedKeys = sorted(self._sortKey(information) for information in files.values())
+
+        with self._lock:
+            self.files = files
+            self.sortedKeys = sortedKeys
+            self.directoryModificationTime = modificationTime
+        logger.debug("Indexed {nFiles} files in {directory}".format(nFiles = len(files), directory = self.directory))
+
+    def refresh(self):
+        """ Rescan the data folder if it has changed since it was last scanned.
+
+        Args:
+            None.
+        Returns:
+            bool: True if the data folder was rescanned.
+        """
+        if os.stat(self.directory).st_mtime == self.directoryModificationTime:
+            return False
+        self.scan()
+        return True
+
+    def _run(self):
+        """ Watch the data folder for changes until the process exits. """
+        while True:
+            time.sleep(self.refreshInterval)
+            try:
+                self.refresh()
+            except OSError as e:
+                logger.warning("Unable to refresh the index of {directory}: {e}".format(directory = self.directory, e = e))
+
+    def start(self):
+        """ Scan the data folder and start watching it for changes if it isn't already being watched.
+
+        Args:
+            None.
+        Returns:
+            None.
+        """
+        with self._startLock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.refresh()
+            self.thread = threading.Thread(target = self._run, name = "receivedFileIndex")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def retrieveFiles(self, runNumber = None, agent = None, minTime = None, maxTime = None, after = None, limit = None):
+        """ Retrieve the files in the index, sorted by time stamp.
+
+        Args:
+            runNumber (int): Only select files from this run. Default: ``None``.
+            agent (str): Only select files from this AMORE agent. Default: ``None``.
+            minTime (int): Only select files with a time stamp at or after this unix time. Default: ``None``.
+            maxTime (int): Only select files with a time stamp at or before this unix time. Default: ``None``.
+            after (str): Only select files which are sorted after this file. It is used to retrieve the next
+                page of files. Default: ``None``.
+            limit (int): Maximum number of files to return. Must be at least 1. Default: ``None``, which returns all
+                selected files.
+        Returns:
+            tuple: (files, nextFile) where files (list) contains the information about the selected files (see
+                ``fileInformation(...)``), and nextFile (str) is the value of ``after`` to use to retrieve the next
+                page, or ``None`` if there are no more files.
+        """
+        self.start()
+        with self._lock:
+            startIndex = 0
+            if after is not None:
+                startIndex = bisect.bisect_right(self.sortedKeys, self._sortKey(self.files[after]) if after in self.files
+                                                 else self._sortKey(fileInformation(after)))
+            if minTime is not None:
+                startIndex = max(startIndex, bisect.bisect_left(self.sortedKeys, (minTime, "")))
+
+            selected = []
+            nextFile = None
+            # Iterate by index to avoid copying the keys.
+            for i in range(startIndex, len(self.sortedKeys)):
+                (timestamp, filename) = self.sortedKeys[i]
+                if maxTime is not None and timestamp > maxTime:
+                    break
+                information = self.files[filename]
+                if runNumber is not None and information["runNumber"] != runNumber:
+                    continue
+                if agent is not None and information["agent"] != agent:
+                    continue
+                if limit is not None and len(selected) >= limit:
+                    nextFile = selected[-1]["filename"]
+                    break
+                selected.append(information)
+
+        return (selected, nextFile)
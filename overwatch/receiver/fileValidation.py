@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+""" Validate received files in the background.
+
+Fully validating a received file requires reading every object that it contains, which is too expensive to
+perform while responding to the upload. Instead, the receiver only performs a cheap integrity check before
+responding, and submits the file to the ``validationQueue``, which validates it in a background thread. The
+results are then available via the file listing of the receiver.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+from __future__ import absolute_import
+
+import collections
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+class validationQueue(object):
+    """ Validate received files in a background thread.
+
+    The background thread is started when the first file is submitted, rather than when the object is created,
+    such that it is started in each receiver process (for example, after uwsgi forks the workers). The results
+    are stored separately in each process.
+
+    Args:
+        validationFunction (function): Function which validates a file. It is called with the path to the file,
+            and must return a tuple of (success, receivedObjects), where success (bool) is True if the file is
+            valid, and receivedObjects (dict) describes the objects in the file.
+        maxResults (int): Maximum number of validation results to keep. The oldest results are removed first.
+
+    Attributes:
+        validationFunction (function): Function which validates a file.
+        maxResults (int): Maximum number of validation results to keep.
+        results (collections.OrderedDict): Validation results. Keys are the filenames, while values are dicts
+            containing the ``status`` (one of "pending", "valid", "invalid", or "error"), and once validated,
+            the ``received`` objects (or the error ``message``).
+        thread (threading.Thread): Background thread which validates the files.
+    """
+    def __init__(self, validationFunction, maxResults):
+        self.validationFunction = validationFunction
+        self.maxResults = maxResults
+        self.results = collections.OrderedDict()
+        self.thread = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _storeResult(self, filename, result):
+        """ Store the validation result of a file, removing the oldest results if necessary. """
+        with self._lock:
+            self.results.pop(filename, None)
+            self.results[filename] = result
+            while len(self.results) > self.maxResults:
+                self.results.popitem(last = False)
+
+    def validate(self, filename, path):
+        """ Validate a file and store the result.
+
+        Args:
+            filename (str): Name of the file, under which the result is stored.
+            path (str): Path to the file.
+        Returns:
+            dict: The validation result.
+        """
+        try:
+            (success, receivedObjects) = self.validationFunction(path)
+            result = {"status": "valid" if success else "invalid", "received": receivedObjects if success else None}
+        except Exception as e:
+            logger.warning("Error while validating {path}: {e}".format(path = path, e = e))
+            result = {"status": "error", "received": None, "message": str(e)}
+        if result["status"] != "valid":
+            logger.warning("Received file {filename} is not valid: {result}".format(filename = filename, result = result))
+        self._storeResult(filename, result)
+        return result
+
+    def _run(self):
+        """ Validate submitted files until the process exits. """
+        while True:
+            (filename, path) = self._queue.get()
+            try:
+                self.validate(filename, path)
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        """ Start validating files in the background if it isn't already running.
+
+        Args:
+            None.
+        Returns:
+            None.
+        """
+        with self._lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target = self._run, name = "validationQueue")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def submit(self, filename, path):
+        """ Submit a file to be validated in the background.
+
+        Args:
+            filename (str): Name of the file, under which the result is stored.
+            path (str): Path to the file.
+        Returns:
+            None.
+        """
+        self._storeResult(filename, {"status": "pending", "received": None})
+        self.start()
+        self._queue.put((filename, path))
+
+    def join(self):
+        """ Wait until all submitted files have been validated.
+
+        Args:
+            None.
+        Returns:
+            None.
+        """
+        self._queue.join()
+
+    def retrieveResults(self, filenames = None):
+        """ Retrieve the validation results.
+
+        Args:
+            filenames (list): Filenames for which the results should be retrieved. Default: ``None``, which
+                retrieves all available results.
+        Returns:
+            dict: Validation results for the files which have results. Keys are the filenames, while values are
+                the results (see ``results``).
+        """
+        with self._lock:
+            if filenames is None:
+                return dict(self.results)
+            return {filename: self.results[filename] for filename in filenames if filename in self.results}
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+""" Cache for rendered page fragments.
+
+Rendering the run page templates requires iterating over all of the hist groups and histograms of a subsystem,
+which is repeated for every request, including AJAX navigation between histograms of the same run. Since the
+rendered fragments only change when the subsystem is processed again, they can be cached. Fragments are stored
+in an in-process LRU cache, and optionally in a directory which is shared between web app workers (for example,
+between uwsgi processes).
+
+The cache doesn't need to be explicitly invalidated. Instead, the key of each fragment includes the
+``outputVersion`` of the subsystem, which is updated each time that the processing commits new output. Outdated
+fragments are then never requested again. They are eventually removed from the in-process cache, and are removed
+from the shared directory when a fragment for a newer version is stored.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+from __future__ import absolute_import
+
+import collections
+import hashlib
+import io
+import os
+import shutil
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+from .. import __version__
+
+class fragmentCache(object):
+    """ Cache of rendered fragments, organized by run and subsystem.
+
+    Args:
+        cacheSize (int): Maximum number of fragments to keep in memory. 0 disables the in-process cache.
+        cacheDirectory (str): Directory where fragments are stored so that they are shared between processes.
+            Default: ``None``, which disables the shared cache.
+
+    Attributes:
+        cacheSize (int): Maximum number of fragments to keep in memory.
+        cacheDirectory (str): Directory where fragments are shared between processes.
+        fragments (collections.OrderedDict): Fragments stored in memory. Keys are the full keys of the fragment,
+            while values are the rendered fragments. Ordered from least to most recently used.
+    """
+    def __init__(self, cacheSize, cacheDirectory = None):
+        self.cacheSize = cacheSize
+        self.cacheDirectory = cacheDirectory
+        self.fragments = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def createKey(runDir, subsystem, outputVersion, templateName, **kwargs):
+        """ Create the key for a fragment.
+
+        Args:
+            runDir (str): String containing the run number. For an example run 123456, it should be
+                formatted as ``Run123456``.
+            subsystem (str): Name of the subsystem.
+            outputVersion (int): Version of the processing output of the subsystem.
+            templateName (str): Name of the template used to render the fragment.
+            kwargs (dict): Additional values on which the fragment depends, such as the time slice key.
+        Returns:
+            tuple: Key for the fragment.
+        """
+        # The Overwatch version is included so that fragments stored on disk are not reused after the templates
+        # are updated.
+        return (runDir, subsystem, outputVersion, templateName, __version__) + tuple(sorted(kwargs.items()))
+
+    def _filename(self, key):
+        """ Determine the filename under which a fragment is stored in the shared cache directory.
+
+        The fragments are stored in ``{cacheDirectory}/{runDir}/{subsystem}/{outputVersion}/``, such that outdated
+        fragments can be removed easily.
+
+        Args:
+            key (tuple): Key for the fragment.
+        Returns:
+            str: Filename of the fragment.
+        """
+        runDir, subsystem, outputVersion = key[:3]
+        return os.path.join(self.cacheDirectory, runDir, subsystem, str(outputVersion),
+                            hashlib.sha1(repr(key).encode()).hexdigest() + ".html")
+
+    def get(self, key):
+        """ Retrieve a fragment from the cache.
+
+        Args:
+            key (tuple): Key for the fragment.
+        Returns:
+            str: The fragment, or ``None`` if it isn't available.
+        """
+        with self._lock:
+            fragment = self.fragments.pop(key, None)
+            if fragment is not None:
+                # Store as the most recently used.
+                self.fragments[key] = fragment
+                return fragment
+
+        if self.cacheDirectory:
+            filename = self._filename(key)
+            try:
+                with io.open(filename, "r", encoding = "utf-8") as f:
+                    fragment = f.read()
+            except IOError:
+                return None
+            self._store(key, fragment)
+        return fragment
+
+    def _store(self, key, fragment):
+        """ Store a fragment in memory.
+
+        Args:
+            key (tuple): Key for the fragment.
+            fragment (str): The rendered fragment.
+        Returns:
+            None.
+        """
+        if self.cacheSize <= 0:
+            return
+        with self._lock:
+            self.fragments.pop(key, None)
+            self.fragments[key] = fragment
+            while len(self.fragments) > self.cacheSize:
+                self.fragments.popitem(last = False)
+
+    def set(self, key, fragment):
+        """ Store a fragment in the cache.
+
+        When storing to the shared directory, the fragments of other versions of the subsystem are removed.
+
+        Args:
+            key (tuple): Key for the fragment.
+            fragment (str): The rendered fragment.
+        Returns:
+            None.
+        """
+        self._store(key, fragment)
+
+        if self.cacheDirectory:
+            filename = self._filename(key)
+            versionDirectory = os.path.dirname(filename)
+            subsystemDirectory = os.path.dirname(versionDirectory)
+            try:
+                if not os.path.exists(versionDirectory):
+                    os.makedirs(versionDirectory)
+                    # Remove outdated fragments.
+                    for version in os.listdir(subsystemDirectory):
+                        if version != os.path.basename(versionDirectory):
+                            shutil.rmtree(os.path.join(subsystemDirectory, version), ignore_errors = True)
+                # Write to a temporary file and then move it into place so that other processes never
+                # read a partially written fragment.
+                temporaryFilename = "{filename}.{pid}.tmp".format(filename = filename, pid = os.getpid())
+                with io.open(temporaryFilename, "w", encoding = "utf-8") as f:
+                    f.write(fragment)
+                os.rename(temporaryFilename, filename)
+            except OSError as e:
+                # The shared cache is only an optimization, so we can continue without it.
+                logger.warning("Unable to store fragment in {filename}. Error: {e}".format(filename = filename, e = e))
+
+    def render(self, key, renderFunction, *args, **kwargs):
+        """ Retrieve a fragment from the cache, rendering and storing it if it isn't available.
+
+        Args:
+            key (tuple): Key for the fragment.
+            renderFunction (function): Function to render the fragment if it isn't available.
+            args (list): Positional arguments to pass to the render function.
+            kwargs (dict): Keyword arguments to pass to the render function.
+        Returns:
+            str: The fragment.
+        """
+        fragment = self.get(key)
+        if fragment is None:
+            fragment = renderFunction(*args, **kwargs)
+            self.set(key, fragment)
+        return fragment
+
+    def clear(self):
+        """ Clear the in-process cache.
+
+        Args:
+            None.
+        Returns:
+            None.
+        """
+        with self._lock:
+            self.fragments.clear()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+""" Measure the latency of web app requests.
+
+The duration of each request is recorded by route, along with a breakdown into phases (such as validation,
+database access, template rendering, and file serving), the number of objects loaded from the database, and
+the size of the response. Recent requests are aggregated into percentiles for each route, which are made available
+in the web app, while requests which take longer than a threshold are logged.
+
+The phases are measured via the ``phase(...)`` context manager. The time which isn't assigned to any phase is
+reported as ``other``. The body of a streamed response (such as a file) is only sent after the request has been
+handled, so the time to send it is measured separately as the ``transfer`` phase. It depends on the client (for
+example, on the network connection), so it isn't considered when deciding whether a request is slow. The metrics
+are stored separately in each web app process (for example, in each uwsgi worker).
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+from __future__ import absolute_import
+from future.utils import iteritems
+
+import collections
+import contextlib
+import math
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+def percentile(values, fraction):
+    """ Determine a percentile of the given values using the nearest rank.
+
+    Args:
+        values (list): Values, sorted in ascending order.
+        fraction (float): Fraction (between 0 and 1) corresponding to the percentile.
+    Returns:
+        float: Value at the percentile, or ``None`` if there are no values.
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(fraction * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+#: Name of the phase where the body of a streamed response is sent to the client.
+transferPhase = "transfer"
+
+class requestTimer(object):
+    """ Timing of a single request.
+
+    Args:
+        None.
+
+    Attributes:
+        start (float): Time when the request started.
+        phases (collections.OrderedDict): Time spent in each phase in seconds. Keys are the phase names.
+        _activePhases (list): ``(name, start time)`` of the phases which are currently being measured. It is
+            used to avoid double counting nested phases.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.phases = collections.OrderedDict()
+        self._activePhases = []
+
+    def startPhase(self, name):
+        """ Start measuring a phase of the request.
+
+        If phases are nested, the time is only assigned to the outermost phase, so that the phases
+        never add up to more than the total time.
+
+        Args:
+            name (str): Name of the phase.
+        Returns:
+            None.
+        """
+        self._activePhases.append((name, time.time()))
+
+    def stopPhase(self):
+        """ Stop measuring the most recently started phase of the request.
+
+        Args:
+            None.
+        Returns:
+            None.
+        """
+        if not self._activePhases:
+            return
+        (name, start) = self._activePhases.pop()
+        if not self._activePhases:
+            self.phases[name] = self.phases.get(name, 0) + time.time() - start
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Measure the time spent in a phase of the request.
+
+        Args:
+            name (str): Name of the phase.
+        Yields:
+            None.
+        """
+        self.startPhase(name)
+        try:
+            yield
+        finally:
+            self.stopPhase()
+
+class requestMetrics(object):
+    """ Aggregated request metrics, organized by route.
+
+    Args:
+        maxSamples (int): Maximum number of recent requests to store for each route.
+        slowRequestThreshold (float): Requests which take longer than this time in seconds are logged. The
+            time to send the body of a streamed response (the ``transfer`` phase) is excluded. ``None`` disables
+            the logging.
+
+    Attributes:
+        maxSamples (int): Maximum number of recent requests to store for each route.
+        slowRequestThreshold (float): Requests which take longer than this time in seconds (excluding the
+            ``transfer`` phase) are logged.
+        samples (dict): Recent requests for each route. Keys are the routes, while values are ``collections.deque``
+            of the request measurements. Each measurement is a dict containing ``duration``, ``phases``,
+            ``databaseLoads``, and ``responseSize``.
+        counts (collections.Counter): Total number of requests for each route.
+    """
+    def __init__(self, maxSamples, slowRequestThreshold):
+        self.maxSamples = maxSamples
+        self.slowRequestThreshold = slowRequestThreshold
+        self.samples = {}
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, route, timer, databaseLoads = None, responseSize = None, status = None):
+        """ Record the measurement of a finished request.
+
+        Args:
+            route (str): Route (URL rule) of the request.
+            timer (requestTimer): Timer of the request.
+            databaseLoads (int): Number of objects loaded from the database during the request. Default: ``None``.
+            responseSize (int): Size of the response in bytes. ``None`` if it is unknown (for example, if it is
+                streamed). Default: ``None``.
+            status (int): Status code of the response. Only used for logging. Default: ``None``.
+        Returns:
+            dict: The recorded measurement.
+        """
+        duration = time.time() - timer.start
+        phases = collections.OrderedDict(timer.phases)
+        phases["other"] = max(duration - sum(phases.values()), 0)
+        measurement = {
+            "duration": duration,
+            "phases": phases,
+            "databaseLoads": databaseLoads,
+            "responseSize": responseSize,
+        }
+
+        with self._lock:
+            if route not in self.samples:
+                self.samples[route] = collections.deque(maxlen = self.maxSamples)
+            self.samples[route].append(measurement)
+            self.counts[route] += 1
+
+        if self.slowRequestThreshold is not None and duration - phases.get(transferPhase, 0) > self.slowRequestThreshold:
+            logger.info("Slow request to {route} (status {status}) took {duration:.3f} s. Phases: {phases}, database loads: {databaseLoads},"
+                        " response size: {responseSize}".format(route = route, status = status, duration = duration,
+                                                                phases = ", ".join("{}: {:.3f} s".format(k, v) for k, v in iteritems(phases)),
+                                                                databaseLoads = databaseLoads, responseSize = responseSize))
+
+        return measurement
+
+    def summary(self, percentiles = (0.5, 0.9, 0.99)):
+        """ Summarize the recent requests of each route.
+
+        Args:
+            percentiles (tuple): Fractions of the percentiles to determine. Default: (0.5, 0.9, 0.99).
+        Returns:
+            dict: Summary for each route. Keys are the routes, while values are dicts containing the total
+                number of requests (``count``), the number of recent requests which were summarized (``samples``),
+                the percentiles of the duration and of each phase in seconds (``duration`` and ``phases``,
+                keyed by ``p50``, etc), and the mean number of database loads and response size.
+        """
+        with self._lock:
+            samples = {route: list(measurements) for route, measurements in iteritems(self.samples)}
+            counts = dict(self.counts)
+
+        def summarizeValues(values):
+            values = sorted(values)
+            return collections.OrderedDict(("p{}".format(int(round(fraction * 100))), percentile(values, fraction)) for fraction in percentiles)
+
+        def mean(values):
+            values = [v for v in values if v is not None]
+            return sum(values) / float(len(values)) if values else None
+
+        summaries = {}
+        for route, measurements in iteritems(samples):
+            phaseNames = []
+            for measurement in measurements:
+                phaseNames.extend(name for name in measurement["phases"] if name not in phaseNames)
+            summaries[route] = {
+                "count": counts[route],
+                "samples": len(measurements),
+                "duration": summarizeValues([m["duration"] for m in measurements]),
+                "phases": {name: summarizeValues([m["phases"].get(name, 0) for m in measurements]) for name in phaseNames},
+                "meanDatabaseLoads": mean([m["databaseLoads"] for m in measurements]),
+                "meanResponseSize": mean([m["responseSize"] for m in measurements]),
+            }
+        return summaries
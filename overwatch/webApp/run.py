@@ -43,7 +43,8 @@ from overwatch.webApp.webApp import app
 # Get the secret key for the web app
 if not serverParameters["debug"]:
     # Connect to database ourselves and grab the secret key
-    (dbRoot, connection) = utilities.getDB(serverParameters["databaseLocation"])
+    # We only need to read the key, so we don't need write access (and can't conflict with other writers).
+    (dbRoot, connection) = utilities.getDB(serverParameters["databaseLocation"], readOnly = True)
     try:
         # Set secret_key based on sensitive param value.
         secretKey = dbRoot["config"]["secretKey"]
@@ -77,6 +77,9 @@ function initPage(jsRootState) {
         jsRootRequest();
     }
 
+    // Request updates from the processing for run pages.
+    requestRunPageUpdates(jsRootState);
+
     // Update the title in the top bar based on the title defined in the main content.
     // The title was likely updated by the new content.
     var title = Polymer.dom(this.root).querySelector("#mainContentTitle");
@@ -602,31 +605,120 @@ function jsRootRequest() {
 
     // Request each jsRoot object
     $(requestedHists).each(function() {
-        // Determine the request address.
-        // Set the base request URL.
-        var requestAddress = "/monitoring/protected/";
-        // Add the filename from the histogram container corresponding to the request.
-        requestAddress += $(this).data("filename");
-        console.log("requestAddress: " + requestAddress);
-
-        // Sets the object where the hist will be drawn.
-        var objectToDrawIn = this;
-        // Define the request and the handling of the returned object.
-        var req = JSROOT.NewHttpRequest(requestAddress, 'object', function(jsRootObj) {
-            // Plot the jsRootObj.
-            // `jsRootObj` is the object returned by jsRoot.
-            // For a grid, one would have to set one the required `div`s beforehand.
-            // Then select the corresponding one to draw in after each request.
-
-            // (re)draw `jsRootObj` at specified frame "objectToDrawIn"
-            // `redraw()` was the previous API, while the newer API requires `draw()`.
-            //JSROOT.redraw(objectToDrawIn, jsRootObj, "colz");
-            JSROOT.draw(objectToDrawIn, jsRootObj, "colz");
+        jsRootDraw(this);
+    });
+}
+
+/**
+  * Request the json for a single histogram container and draw it via jsRoot.
+  */
+function jsRootDraw(objectToDrawIn) {
+    // Determine the request address.
+    // Set the base request URL.
+    var requestAddress = "/monitoring/protected/";
+    // Add the filename from the histogram container corresponding to the request.
+    requestAddress += $(objectToDrawIn).data("filename");
+    console.log("requestAddress: " + requestAddress);
+
+    // Define the request and the handling of the returned object.
+    var req = JSROOT.NewHttpRequest(requestAddress, 'object', function(jsRootObj) {
+        // Plot the jsRootObj.
+        // `jsRootObj` is the object returned by jsRoot.
+        // For a grid, one would have to set one the required `div`s beforehand.
+        // Then select the corresponding one to draw in after each request.
+
+        // (re)draw `jsRootObj` at specified frame "objectToDrawIn"
+        // `redraw()` was the previous API, while the newer API requires `draw()`.
+        //JSROOT.redraw(objectToDrawIn, jsRootObj, "colz");
+        JSROOT.draw(objectToDrawIn, jsRootObj, "colz");
+    });
+
+    // Actually send the request
+    req.send();
+}
+
+// Outstanding request for run page updates. It is stored so that it can be aborted when the page changes.
+var runPageUpdatesRequest = null;
+// Timer for the next request for run page updates. It is stored so that it can be cleared when the page changes.
+var runPageUpdatesTimer = null;
+
+/**
+  * Request updates for the histograms on a run page.
+  *
+  * The web app responds immediately with the current output version, including which files have changed.
+  * We then only update the histograms corresponding to those files, and make the next request after the
+  * poll interval provided by the web app. Requests are only made for ongoing runs.
+  */
+function requestRunPageUpdates(jsRootState) {
+    // Abort any request from the previous page.
+    if (runPageUpdatesRequest !== null) {
+        runPageUpdatesRequest.abort();
+        runPageUpdatesRequest = null;
+    }
+    if (runPageUpdatesTimer !== null) {
+        clearTimeout(runPageUpdatesTimer);
+        runPageUpdatesTimer = null;
+    }
+
+    var updates = Polymer.dom(this.root).querySelector("#runPageUpdates");
+    if (!updates) {
+        return;
+    }
+
+    var params = {};
+    params.outputVersion = $(updates).data("outputversion");
+    var request = $.get($(updates).data("url"), params, function(data) {
+        // Ignore the response if the page has changed in the meantime.
+        if (runPageUpdatesRequest !== request) {
+            return;
+        }
+        runPageUpdatesRequest = null;
+        $(updates).data("outputversion", data.outputVersion);
+
+        // Update only the histograms whose files have changed.
+        var changedFiles = data.changedFiles;
+        $(Polymer.dom(document).querySelectorAll(".histogramContainer")).each(function() {
+            var jsonFilename = String($(this).data("filename")).split("?")[0];
+            var imgFilename = $(this).data("imgfilename");
+            if (jsRootState === true) {
+                if (changedFiles.hasOwnProperty(jsonFilename)) {
+                    $(this).data("filename", jsonFilename + "?v=" + changedFiles[jsonFilename]);
+                    // Remove the existing drawing before drawing the updated histogram.
+                    JSROOT.cleanup(this);
+                    jsRootDraw(this);
+                }
+            }
+            else if (changedFiles.hasOwnProperty(imgFilename)) {
+                $(this).find("img.histogramImage").attr("src", "/monitoring/protected/" + imgFilename + "?v=" + changedFiles[imgFilename]);
+            }
         });
 
-        // Actually send the request
-        req.send();
+        // Check again for the next update as long as the run is ongoing.
+        if (data.runOngoing === true) {
+            scheduleRunPageUpdates(jsRootState, updates, data.pollInterval * 1000);
+        }
+    }).fail(function(jqXHR, textStatus) {
+        // Aborted requests are expected when the page changes.
+        if (textStatus === "abort" || runPageUpdatesRequest !== request) {
+            return;
+        }
+        runPageUpdatesRequest = null;
+        console.log("Run page updates request failed: " + textStatus + ". Retrying shortly.");
+        scheduleRunPageUpdates(jsRootState, updates, 30000);
     });
+    runPageUpdatesRequest = request;
+}
+
+/**
+  * Schedule the next request for run page updates, as long as the same run page is still displayed.
+  */
+function scheduleRunPageUpdates(jsRootState, updates, delay) {
+    runPageUpdatesTimer = setTimeout(function() {
+        runPageUpdatesTimer = null;
+        if (Polymer.dom(document).querySelector("#runPageUpdates") === updates) {
+            requestRunPageUpdates(jsRootState);
+        }
+    }, delay);
 }
 
 /**
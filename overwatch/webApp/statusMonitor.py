@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+""" Monitor the status of other Overwatch sites.
+
+The status of each site is determined by a request to its ``/status`` route. Rather than performing the requests
+while serving the status page (which would block for the timeout of each unreachable site), the requests are
+performed concurrently in a background thread which periodically refreshes the statuses. The status page then
+just displays the last known statuses, along with when they were determined.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+from __future__ import absolute_import
+from future.utils import iteritems
+
+import collections
+import multiprocessing.pool
+import threading
+import pendulum
+import requests
+import logging
+logger = logging.getLogger(__name__)
+
+def checkSiteStatus(site, url, timeout):
+    """ Check the status of a single site.
+
+    Args:
+        site (str): Name of the site.
+        url (str): Base URL of the site.
+        timeout (float): Timeout for the request in seconds.
+    Returns:
+        str or dict: "Site is up!" if the site responded properly. Otherwise, it is an error dict, where the
+            keys are the type of errors and the values are lists of error messages.
+    """
+    serverError = {}
+    statusResult = ""
+    exceptionErrorMessage = "Request to \"{site}\" at \"{url}\" {errorType} with error message {e}!"
+    try:
+        serverRequest = requests.get(url + "/status", timeout = timeout)
+        if serverRequest.status_code != 200:
+            serverError.setdefault("Request error", []).append("Request to \"{}\" at \"{}\" returned error response {}!".format(site, url, serverRequest.status_code))
+        else:
+            statusResult = "Site is up!"
+    except requests.exceptions.Timeout as e:
+        serverError.setdefault("Timeout error", []).append(exceptionErrorMessage.format(site = site, url = url, errorType = "timed out", e = e))
+    except requests.exceptions.ConnectionError as e:
+        serverError.setdefault("Connection error", []).append(exceptionErrorMessage.format(site = site, url = url, errorType = "had a connection error", e = e))
+    except requests.exceptions.RequestException as e:
+        serverError.setdefault("General Requests error", []).append(exceptionErrorMessage.format(site = site, url = url, errorType = "had a general requests error", e = e))
+
+    # Return the error if one occurred
+    if serverError != {}:
+        statusResult = serverError
+    return statusResult
+
+class siteStatusMonitor(object):
+    """ Periodically check the status of Overwatch sites in the background.
+
+    The background thread is started when the statuses are first requested, rather than when the object is created,
+    such that it is started in each web app process (for example, after uwsgi forks the workers).
+
+    Args:
+        sites (dict): Sites to check. Keys are the site names, while values are their base URLs.
+        timeout (float): Timeout for each request in seconds.
+        refreshInterval (float): Time between checks in seconds.
+
+    Attributes:
+        sites (dict): Sites to check. Keys are the site names, while values are their base URLs.
+        timeout (float): Timeout for each request in seconds.
+        refreshInterval (float): Time between checks in seconds.
+        statuses (collections.OrderedDict): Last known status of each site. See ``checkSiteStatus(...)``.
+        lastUpdated (pendulum.DateTime): Time when the statuses were last determined. ``None`` if they
+            haven't been determined yet.
+        thread (threading.Thread): Background thread which refreshes the statuses.
+    """
+    def __init__(self, sites, timeout, refreshInterval):
+        self.sites = sites
+        self.timeout = timeout
+        self.refreshInterval = refreshInterval
+        self.statuses = collections.OrderedDict()
+        self.lastUpdated = None
+        self.thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def refresh(self):
+        """ Check the status of all sites concurrently.
+
+        Args:
+            None.
+        Returns:
+            collections.OrderedDict: Status of each site.
+        """
+        statuses = collections.OrderedDict()
+        if self.sites:
+            pool = multiprocessing.pool.ThreadPool(len(self.sites))
+            try:
+                results = pool.map(lambda siteAndURL: checkSiteStatus(site = siteAndURL[0], url = siteAndURL[1], timeout = self.timeout),
+                                   list(iteritems(self.sites)))
+            finally:
+                pool.close()
+                pool.join()
+            for site, result in zip(self.sites, results):
+                statuses[site] = result
+
+        with self._lock:
+            self.statuses = statuses
+            self.lastUpdated = pendulum.now()
+        return statuses
+
+    def _run(self):
+        """ Refresh the statuses until stopped. """
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                # We don't want the monitor to stop due to an unexpected error.
+                logger.warning("Error while checking site statuses: {e}".format(e = e))
+            self._stop.wait(self.refreshInterval)
+
+    def start(self):
+        """ Start refreshing the statuses in the background if it isn't already running.
+
+        Args:
+            None.
+        Returns:
+            None.
+        """
+        with self._lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self._stop.clear()
+            self.thread = threading.Thread(target = self._run, name = "siteStatusMonitor")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """ Stop refreshing the statuses.
+
+        Args:
+            None.
+        Returns:
+            None.
+        """
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def retrieveStatuses(self):
+        """ Retrieve the last known statuses without waiting for the sites.
+
+        Args:
+            None.
+        Returns:
+            tuple: (statuses, age) where statuses (collections.OrderedDict) is the last known status of each site,
+                and age (float) is the time in seconds since they were determined. The age is ``None`` if the
+                statuses haven't been determined yet.
+        """
+        self.start()
+        with self._lock:
+            statuses = collections.OrderedDict(self.statuses)
+            age = (pendulum.now() - self.lastUpdated).total_seconds() if self.lastUpdated is not None else None
+        return (statuses, age)
@@ -8,7 +8,9 @@ to other Overwatch packages.
 .. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
 """
 
+import gzip
 import os
+import shutil
 import subprocess
 import logging
 logger = logging.getLogger(__name__)
@@ -17,6 +19,7 @@ import webassets.filter
 
 # Configuration
 from ..base import config
+from ..base import utilities
 (serverParameters, filesRead) = config.readConfig(config.configurationType.webApp)
 
 class PolymerBundler(webassets.filter.ExternalTool):
@@ -99,3 +102,55 @@ class PolymerBundler(webassets.filter.ExternalTool):
 
 # Register filter so it can be run in the web app
 webassets.filter.register_filter(PolymerBundler)
+
+def buildAssets(assetsEnvironment, compress = True):
+    """ Build all of the bundles of the assets environment ahead of time.
+
+    The bundles are built regardless of whether they appear to be up to date. If the output filenames include
+    the version (``%(version)s``), the outputs are fingerprinted by their content, and the versions are stored
+    in the manifest of the environment (if configured). Workers can then determine the bundle URLs from the
+    manifest without building anything.
+
+    Args:
+        assetsEnvironment (webassets.Environment): Environment containing the bundles.
+        compress (bool): If True, a gzip compressed copy of each output is also written to ``{output}.gz``,
+            such that it can be served without compressing it on each request. Default: True.
+    Returns:
+        list: Filenames of the built bundles.
+    """
+    outputFilenames = []
+    for bundle in assetsEnvironment:
+        logger.info("Building bundle with output {output}".format(output = bundle.output))
+        bundle.build(force = True)
+        outputFilename = bundle.resolve_output(assetsEnvironment)
+        if compress:
+            # Set the modification time in the gzip header to 0 so that the compressed file only depends on
+            # the content.
+            with open(outputFilename, "rb") as fIn, open(outputFilename + ".gz", "wb") as fOut:
+                with gzip.GzipFile(filename = os.path.basename(outputFilename), mode = "wb", fileobj = fOut, mtime = 0) as fCompressed:
+                    shutil.copyfileobj(fIn, fCompressed)
+        outputFilenames.append(outputFilename)
+
+    return outputFilenames
+
+def runBuildAssets():
+    """ Build the web app assets for deployment.
+
+    It should be executed whenever the static files have changed, before starting the web app (for example, by
+    the deploy script). Then the web app workers don't need to build any bundles.
+
+    Args:
+        None.
+    Returns:
+        None.
+    """
+    # Setup logging so that we can see the progress.
+    utilities.setupLogging(logger = logging.getLogger(""),
+                           logLevel = serverParameters["loggingLevel"],
+                           debug = serverParameters["debug"])
+
+    # Imported here to avoid a circular import, as the web app imports this module.
+    from .webApp import app, assets
+    with app.app_context():
+        outputFilenames = buildAssets(assets, compress = serverParameters["flaskAssetsCompress"])
+    logger.info("Built assets: {outputFilenames}".format(outputFilenames = outputFilenames))
@@ -22,6 +22,9 @@ except ImportError:
 from ..base import config
 (serverParameters, filesRead) = config.readConfig(config.configurationType.webApp)
 
+# Runs may be stored in the archive
+from ..processing import runArchive
+
 # Logging
 import logging
 # Setup logger
@@ -112,7 +115,7 @@ def validateTimeSlicePostRequest(request, runs):
     try:
         # Retrieve run
         if runDir in runs.keys():
-            run = runs[runDir]
+            run = runArchive.retrieveRun(runs, runDir, cacheSize = serverParameters["runArchiveCacheSize"])
         else:
             error.setdefault("Run Dir", []).append("Run dir {runDir} is not available in runs!".format(runDir = runDir))
             # Invalidate and we cannot continue
@@ -151,6 +154,9 @@ def validateTimeSlicePostRequest(request, runs):
             error.setdefault("hotChannelThreshold", []).append("Hot channel threshold {hotChannelThreshold} is outside the possible range of 0-1000!".format(hotChannelThreshold = hotChannelThreshold))
         inputProcessingOptions["hotChannelThreshold"] = hotChannelThreshold
 
+    # The run is archived, but the archive couldn't be loaded.
+    except runArchive.RunDataUnavailable as e:
+        error.setdefault("Run Dir", []).append(str(e))
     # Handle an unexpected exception
     except Exception as e:
         error.setdefault("generalError", []).append("Unknown exception! " + str(e))
@@ -196,7 +202,7 @@ def validateRunPage(runDir, subsystemName, requestedFileType, runs):
     try:
         # Set and validate run
         if runDir in runs.keys():
-            run = runs[runDir]
+            run = runArchive.retrieveRun(runs, runDir, cacheSize = serverParameters["runArchiveCacheSize"])
         else:
             error.setdefault("Run Dir", []).append("{runDir} is not a valid run dir! Please select a different run!".format(runDir = runDir))
             # Invalidate and we cannot continue
@@ -204,7 +210,7 @@ def validateRunPage(runDir, subsystemName, requestedFileType, runs):
 
         # Set subsystem and validate
         if subsystemName in run.subsystems.keys():
-            subsystem = runs[runDir].subsystems[subsystemName]
+            subsystem = run.subsystems[subsystemName]
         else:
             error.setdefault("Subsystem", []).append("{subsystemName} is not a valid subsystem in {prettyName}!".format(subsystemName = subsystemName, prettyName = run.prettyName))
             # Invalidate and we cannot continue
@@ -227,6 +233,8 @@ def validateRunPage(runDir, subsystemName, requestedFileType, runs):
         # errors = {'hello2': ['world', 'world2'], 'hello': ['world', 'world2']}
         # See: https://stackoverflow.com/a/2052206
         error.setdefault("keyError", []).append("Key error in " + e.args[0])
+    except runArchive.RunDataUnavailable as e:
+        error.setdefault("Run Dir", []).append(str(e))
     except Exception as e:
         error.setdefault("generalError", []).append("Unknown exception! " + str(e))
 
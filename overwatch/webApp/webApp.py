@@ -12,25 +12,25 @@ into authenticated and unauthenticated views.
 
 # For python 3 support
 from __future__ import print_function
-from future.utils import iteritems
 
 # General includes
 import os
-import zipfile
+import contextlib
 import subprocess
 import signal
 import jinja2
 import json
+import mimetypes
 import collections
+import threading
 import pendulum
 import pkg_resources
-# For server status
-import requests
 import logging
 logger = logging.getLogger(__name__)
 
 # Flask
-from flask import Flask, url_for, request, render_template, redirect, flash, send_from_directory, jsonify, session
+from flask import Flask, url_for, request, render_template, redirect, flash, send_from_directory, jsonify, session, Response, g
+from flask import before_render_template, template_rendered
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
 from flask_zodb import ZODB
@@ -51,18 +51,148 @@ from ..base import utilities as baseUtilities
 from . import routing
 from . import auth
 from . import validation
+from . import fragmentCache
+from . import statusMonitor
+from . import requestMetrics
 from . import utilities  # NOQA
 
 # Processing module includes
 from ..processing import processRuns
+from ..processing import processingClasses
+from ..processing import runArchive
+from ..processing import testingDataArchive as processingTestingDataArchive
 
 # Flask setup
 app = Flask(__name__, static_url_path=serverParameters["staticURLPath"], static_folder=serverParameters["staticFolder"], template_folder=serverParameters["templateFolder"])
 
 # Setup database
-app.config["ZODB_STORAGE"] = serverParameters["databaseLocation"]
+# Requests only read from the database, so the storage is opened read-only when possible. Changes are made via
+# ``writeConnection()`` instead.
+readOnlyDatabase = serverParameters["webAppReadOnlyDatabase"]
+if readOnlyDatabase is None:
+    readOnlyDatabase = serverParameters["databaseLocation"].startswith("zeo://")
+databaseCacheSize = serverParameters["webAppDatabaseCacheSize"] or serverParameters["databaseCacheSize"]
+app.config["ZODB_STORAGE"] = baseUtilities.resolveDatabaseLocation(serverParameters["databaseLocation"],
+                                                                   readOnly = readOnlyDatabase,
+                                                                   cacheSize = databaseCacheSize,
+                                                                   poolSize = serverParameters["databasePoolSize"])
 db = ZODB(app)
 
+@contextlib.contextmanager
+def writeConnection():
+    """ Provide access to the database for making changes.
+
+    If the database is opened read-only for requests, the changes are made via a separate connection, which
+    is committed when the context is exited (see ``base.utilities.writeConnection()``). Otherwise, the request
+    connection is used, and the changes are committed at the end of the request.
+
+    Args:
+        None.
+    Yields:
+        PersistentMapping: The database root.
+    """
+    if readOnlyDatabase:
+        with baseUtilities.writeConnection(serverParameters["databaseLocation"],
+                                           cacheSize = serverParameters["databaseCacheSize"],
+                                           poolSize = serverParameters["databasePoolSize"]) as dbRoot:
+            yield dbRoot
+    else:
+        yield db
+
+# Status of other Overwatch sites
+siteMonitor = statusMonitor.siteStatusMonitor(sites = serverParameters["statusRequestSites"],
+                                              timeout = serverParameters["statusRequestTimeout"],
+                                              refreshInterval = serverParameters["statusRequestRefreshInterval"])
+
+# Cache for rendered run page fragments
+runPageFragments = fragmentCache.fragmentCache(cacheSize = serverParameters["fragmentCacheSize"],
+                                               cacheDirectory = serverParameters["fragmentCacheDirectory"])
+
+# Request latency metrics
+metrics = requestMetrics.requestMetrics(maxSamples = serverParameters["requestMetricsSamples"],
+                                        slowRequestThreshold = serverParameters["requestSlowThreshold"])
+
+@app.before_request
+def startRequestTimer():
+    """ Start timing the request.
+
+    Args:
+        None.
+    Returns:
+        None.
+    """
+    g.requestTimer = requestMetrics.requestTimer()
+
+@app.after_request
+def recordRequestMetrics(response):
+    """ Record the duration, phases, database loads, and response size of the request.
+
+    The body of a streamed response (for example, a served file or the streamed testing data archive) is only
+    sent after this function is called. For such responses, the request is recorded when the response is closed,
+    and the time to send the body is recorded as the ``transfer`` phase.
+
+    Args:
+        response (Response): Response to the request.
+    Returns:
+        Response: The unchanged response.
+    """
+    timer = g.get("requestTimer")
+    if timer is None:
+        return response
+    # The number of objects loaded from the database (ie. not found in the connection cache).
+    # The counts are cleared so that they are only for the next request which uses this connection.
+    databaseLoads = None
+    if db.is_connected:
+        (databaseLoads, _) = db.connection.getTransferCounts(clear = True)
+    # Use the rule rather than the path so that requests for different runs are aggregated together.
+    route = request.url_rule.rule if request.url_rule else request.path
+    responseSize = response.content_length
+    status = response.status_code
+
+    if response.is_streamed:
+        timer.startPhase(requestMetrics.transferPhase)
+
+        def recordStreamedRequest():
+            timer.stopPhase()
+            metrics.record(route = route, timer = timer, databaseLoads = databaseLoads,
+                           responseSize = responseSize, status = status)
+        response.call_on_close(recordStreamedRequest)
+    else:
+        metrics.record(route = route, timer = timer, databaseLoads = databaseLoads,
+                       responseSize = responseSize, status = status)
+    return response
+
+@contextlib.contextmanager
+def requestPhase(name):
+    """ Measure the time spent in a phase of the current request.
+
+    Args:
+        name (str): Name of the phase.
+    Yields:
+        None.
+    """
+    timer = g.get("requestTimer")
+    if timer is None:
+        yield
+        return
+    with timer.phase(name):
+        yield
+
+def startRenderingPhase(sender, template, context, **extra):
+    """ Start measuring the template rendering phase of the current request. """
+    timer = g.get("requestTimer")
+    if timer is not None:
+        timer.startPhase("rendering")
+
+def stopRenderingPhase(sender, template, context, **extra):
+    """ Stop measuring the template rendering phase of the current request. """
+    timer = g.get("requestTimer")
+    if timer is not None:
+        timer.stopPhase()
+
+before_render_template.connect(startRenderingPhase, app)
+template_rendered.connect(stopRenderingPhase, app)
+
 from .trending import trendingPage
 app.register_blueprint(trendingPage)
 
@@ -91,9 +221,45 @@ assets = Environment(app)
 # For more information, particularly on debugging, see the web app `README.md`. Further details
 # are included in the web app utilities module where the filter is defined.
 app.config["ASSETS_DEBUG"] = serverParameters["flaskAssetsDebug"] if not serverParameters["flaskAssetsDebug"] is None else serverParameters["debug"]
+# Fingerprint the bundles by their content. The versions are stored in the manifest when the bundles are built
+# ahead of time (via ``overwatchBuildAssets``), which allows the workers to determine the bundle URLs without
+# building them. If they weren't built ahead of time, we fall back to building them when they are requested.
+app.config["ASSETS_VERSIONS"] = "hash"
+app.config["ASSETS_URL_EXPIRE"] = False
+app.config["ASSETS_MANIFEST"] = "json:{manifest}".format(manifest = serverParameters["flaskAssetsManifest"])
+app.config["ASSETS_AUTO_BUILD"] = serverParameters["flaskAssetsAutoBuild"] if serverParameters["flaskAssetsAutoBuild"] is not None \
+    else not os.path.exists(os.path.join(app.static_folder, serverParameters["flaskAssetsManifest"]))
 # Load bundles from configuration file
 assets.from_yaml(pkg_resources.resource_filename("overwatch.webApp", "flaskAssets.yaml"))
 
+def staticFile(filename):
+    """ Serve static files, using the pre-compressed version of built bundles if available.
+
+    Built bundles are fingerprinted by their content, so they can be cached indefinitely.
+
+    Args:
+        filename (str): Path to the static file, relative to the static folder.
+    Returns:
+        Response: The static file.
+    """
+    bundleDirectory = os.path.dirname(serverParameters["flaskAssetsManifest"])
+    if not filename.startswith(bundleDirectory + "/"):
+        return app.send_static_file(filename)
+
+    compressedFilename = filename + ".gz"
+    if "gzip" in request.accept_encodings and os.path.exists(os.path.join(app.static_folder, compressedFilename)):
+        response = send_from_directory(app.static_folder, compressedFilename,
+                                       mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = app.send_static_file(filename)
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+# Serve the static files via the function above.
+app.view_functions["static"] = staticFile
+
 # Setup CSRF protection via flask-wtf
 csrf = CSRFProtect(app)
 # Setup custom error handling to use the error template.
@@ -196,8 +362,9 @@ def login():
         if serverParameters["debug"]:
             # It should be extremely unlikely for this condition to be met!
             logger.warning("Since we are debugging, adding users to the database automatically!")
-            # Transactions saved in the function
-            baseUtilities.updateDBSensitiveParameters(db)
+            # The changes are committed when the write connection is closed.
+            with writeConnection() as dbRoot:
+                baseUtilities.updateDBSensitiveParameters(dbRoot)
 
     # A post request Attempt to login the user in
     if request.method == "POST":
@@ -348,12 +515,18 @@ def index():
     which seems to be a reasonable balance between showing too much or too little information. This
     can be tuned further if necessary.
 
+    The pages are selected relative to the first (most recent) run on the page via the ``runListIndex``,
+    so only the runs which are displayed are loaded, regardless of the total number of runs.
+
     Note:
         Function args are provided through the flask request object.
 
     Args:
         ajaxRequest (bool): True if the response should be via AJAX.
-        runOffset (int): Number of runs to offset into the run list. Default: 0.
+        runOffset (int): Number of runs to offset into the run list. It is used for display, and to select
+            the runs if ``firstRun`` is not provided. Default: 0.
+        firstRun (int): Run number of the first (most recent) run to display. Default: 0, which corresponds
+            to selecting the runs via ``runOffset``.
     Returns:
         Response: The main index page populated via template.
     """
@@ -361,15 +534,22 @@ def index():
     ajaxRequest = validation.convertRequestToPythonBool("ajaxRequest", request.args)
     # We only use this once and there isn't much complicated, so we just perform the validation here.
     runOffset = validation.convertRequestToPositiveInteger(paramName = "runOffset", source = request.args)
+    firstRun = validation.convertRequestToPositiveInteger(paramName = "firstRun", source = request.args)
 
     runs = db["runs"]
+    runIndex = db.get("runIndex")
+    if runIndex is None:
+        # The index is created by the processing. If the database hasn't been updated yet, we create it
+        # on the fly (which is slow, but only necessary until the next processing).
+        runIndex = processingClasses.runListIndex.fromRuns(runs)
 
     # Determine if a run is ongoing
     # To do so, we need the most recent run (regardless of which runs we selected to display)
-    mostRecentRun = runs[runs.keys()[-1]]
-    runOngoing = mostRecentRun.isRunOngoing()
+    # NOTE: The run list is displayed via the run summaries stored in the index, so the full runs are not loaded.
+    mostRecentRun = runIndex.retrieveSummaries(runIndex.olderRuns(numberOfRuns = 1), runs)
+    runOngoing = mostRecentRun[0].isRunOngoing() if mostRecentRun else False
     if runOngoing:
-        runOngoingNumber = mostRecentRun.runNumber
+        runOngoingNumber = mostRecentRun[0].runNumber
     else:
         runOngoingNumber = ""
 
@@ -377,13 +557,27 @@ def index():
     # We select a default of 50 runs per page. Too many might be unreasonable.
     numberOfRunsToDisplay = 50
     # Restrict the runs that we are going to display to those that are included in our requested range.
-    # It is reversed because we process the earliest runs first. However, the reversed object isn't scriptable,
-    # so it must be converted to a list to slice it.
+    # The runs are selected from the most recent to the oldest.
     # +1 on the upper limit so that the 50 is inclusive
-    runsToUse = list(reversed(runs.values()))[runOffset:runOffset + numberOfRunsToDisplay + 1]
-    logger.debug("runOffset: {}, numberOfRunsToDisplay: {}".format(runOffset, numberOfRunsToDisplay))
+    if firstRun:
+        runDirs = runIndex.olderRuns(runNumber = firstRun, numberOfRuns = numberOfRunsToDisplay + 1)
+    else:
+        # Without a reference run, we need to step through the offset.
+        runDirs = runIndex.olderRuns(numberOfRuns = runOffset + numberOfRunsToDisplay + 1)[runOffset:]
+    with requestPhase("database"):
+        runsToUse = runIndex.retrieveSummaries(runDirs, runs)
+    logger.debug("runOffset: {}, firstRun: {}, numberOfRunsToDisplay: {}".format(runOffset, firstRun, numberOfRunsToDisplay))
     # Total number of runs, which should be displayed at the bottom.
-    numberOfRuns = len(runs.keys())
+    numberOfRuns = len(runIndex)
+
+    # Determine the first runs of the previous and next pages.
+    previousFirstRun = 0
+    nextFirstRun = 0
+    if runsToUse:
+        newerRuns = runIndex.newerRuns(runNumber = runsToUse[0].runNumber, numberOfRuns = numberOfRunsToDisplay)
+        if newerRuns:
+            previousFirstRun = int(newerRuns[0].replace("Run", ""))
+        nextFirstRun = runsToUse[-1].runNumber
 
     # We want 10 anchors
     # NOTE: We need to convert it to an int to ensure that the mod call in the template works.
@@ -397,6 +591,7 @@ def index():
                                subsystemsWithRootFilesToShow = serverParameters["subsystemsWithRootFilesToShow"],
                                anchorFrequency = anchorFrequency,
                                runOffset = runOffset, numberOfRunsToDisplay = numberOfRunsToDisplay,
+                               previousFirstRun = previousFirstRun, nextFirstRun = nextFirstRun,
                                totalNumberOfRuns = numberOfRuns)
     else:
         drawerContent = render_template("runListDrawer.html", runs = runsToUse, runOngoing = runOngoing,
@@ -406,6 +601,7 @@ def index():
                                       subsystemsWithRootFilesToShow = serverParameters["subsystemsWithRootFilesToShow"],
                                       anchorFrequency = anchorFrequency,
                                       runOffset = runOffset, numberOfRunsToDisplay = numberOfRunsToDisplay,
+                                      previousFirstRun = previousFirstRun, nextFirstRun = nextFirstRun,
                                       totalNumberOfRuns = numberOfRuns)
 
         return jsonify(drawerContent = drawerContent, mainContent = mainContent)
@@ -449,7 +645,8 @@ def runPage(runNumber, subsystemName, requestedFileType):
     runs = db["runs"]
 
     # Validation for all passed values
-    (error, run, subsystem, requestedFileType, jsRoot, ajaxRequest, requestedHistGroup, requestedHist, timeSliceKey, timeSlice) = validation.validateRunPage(runDir, subsystemName, requestedFileType, runs)
+    with requestPhase("validation"):
+        (error, run, subsystem, requestedFileType, jsRoot, ajaxRequest, requestedHistGroup, requestedHist, timeSliceKey, timeSlice) = validation.validateRunPage(runDir, subsystemName, requestedFileType, runs)
 
     # This will only work if all of the values are properly defined.
     # Otherwise, we just skip to the end to return the error to the user.
@@ -472,29 +669,54 @@ def runPage(runNumber, subsystemName, requestedFileType):
     else:
         logger.warning("Error on run page: {error}".format(error = error))
 
+    def renderRunPageFragment(templateName):
+        """ Render a run page template, using the cached result if it is available. """
+        key = runPageFragments.createKey(runDir, subsystemName, subsystem.outputVersion, templateName,
+                                         templateVersion = subsystem.templateVersion, timeSliceKey = timeSliceKey,
+                                         jsRoot = jsRoot, selectedHistGroup = requestedHistGroup, selectedHist = requestedHist)
+        return runPageFragments.render(key, render_template, templateName, run = run, subsystem = subsystem,
+                                       selectedHistGroup = requestedHistGroup, selectedHist = requestedHist,
+                                       jsonFilenameTemplate = jsonFilenameTemplate,
+                                       imgFilenameTemplate = imgFilenameTemplate,
+                                       jsRoot = jsRoot, timeSlice = timeSlice)
+
+    def retrieveRootFiles():
+        """ Retrieve the ROOT files for the root files page, optionally restricted to a range of unix times. """
+        return subsystem.filesInTimeRange(minTime = request.args.get("minTime", default = None, type = int),
+                                          maxTime = request.args.get("maxTime", default = None, type = int))
+
+    if error == {} and requestedFileType == "runPage":
+        # Attempt to use a subsystem specific run page if available
+        runPageNames = {}
+        for templateType in ["runPage", "runPageDrawer", "runPageMainContent"]:
+            templateName = subsystemName + templateType + ".html"
+            if templateName not in serverParameters["availableRunPageTemplates"]:
+                templateName = templateName.replace(subsystemName, "")
+            runPageNames[templateType] = templateName
+
     if ajaxRequest is not True:
         if error == {}:
             if requestedFileType == "runPage":
-                # Attempt to use a subsystem specific run page if available
-                runPageName = subsystemName + "runPage.html"
-                if runPageName not in serverParameters["availableRunPageTemplates"]:
-                    runPageName = runPageName.replace(subsystemName, "")
-
                 # We use try here because it's possible for this page not to exist if ``availableRunPageTemplates``
                 # is not determined properly due to other files interfering..
+                # The drawer and main content don't depend on the user, so they are rendered via the cache, while
+                # the rest of the page is always rendered.
                 try:
-                    returnValue = render_template(runPageName, run = run, subsystem = subsystem,
+                    drawerContent = renderRunPageFragment(runPageNames["runPageDrawer"])
+                    mainContent = renderRunPageFragment(runPageNames["runPageMainContent"])
+                    returnValue = render_template(runPageNames["runPage"], run = run, subsystem = subsystem,
                                                   selectedHistGroup = requestedHistGroup, selectedHist = requestedHist,
                                                   jsonFilenameTemplate = jsonFilenameTemplate,
                                                   imgFilenameTemplate = imgFilenameTemplate,
-                                                  jsRoot = jsRoot, timeSlice = timeSlice)
+                                                  jsRoot = jsRoot, timeSlice = timeSlice,
+                                                  drawerContent = drawerContent, mainContent = mainContent)
                 except jinja2.exceptions.TemplateNotFound as e:
                     error.setdefault("Template Error", []).append("Request template: \"{}\", but it was not found!".format(e.name))
             elif requestedFileType == "rootFiles":
                 try:
                     # Subsystem specific run pages are not available since they don't seem to be necessary
                     # Note that even though this file should always be found, we check for exceptions just in case.
-                    returnValue = render_template("rootFiles.html", run = run, subsystem = subsystemName)
+                    returnValue = render_template("rootFiles.html", run = run, subsystem = subsystemName, rootFiles = retrieveRootFiles())
                 except jinja2.exceptions.TemplateNotFound as e:
                     error.setdefault("Template Error", []).append("Request template: \"{}\", but it was not found!".format(e.name))
             else:
@@ -509,29 +731,12 @@ def runPage(runNumber, subsystemName, requestedFileType):
     else:
         if error == {}:
             if requestedFileType == "runPage":
-                # Drawer
-                runPageDrawerName = subsystemName + "runPageDrawer.html"
-                if runPageDrawerName not in serverParameters["availableRunPageTemplates"]:
-                    runPageDrawerName = runPageDrawerName.replace(subsystemName, "")
-                # Main content
-                runPageMainContentName = subsystemName + "runPageMainContent.html"
-                if runPageMainContentName not in serverParameters["availableRunPageTemplates"]:
-                    runPageMainContentName = runPageMainContentName.replace(subsystemName, "")
-
                 # We use try here because it's possible for this page not to exist if ``availableRunPageTemplates``
                 # is not determined properly due to other files interfering..
                 # If either one fails, we want to jump right to the template error.
                 try:
-                    drawerContent = render_template(runPageDrawerName, run = run, subsystem = subsystem,
-                                                    selectedHistGroup = requestedHistGroup, selectedHist = requestedHist,
-                                                    jsonFilenameTemplate = jsonFilenameTemplate,
-                                                    imgFilenameTemplate = imgFilenameTemplate,
-                                                    jsRoot = jsRoot, timeSlice = timeSlice)
-                    mainContent = render_template(runPageMainContentName, run = run, subsystem = subsystem,
-                                                  selectedHistGroup = requestedHistGroup, selectedHist = requestedHist,
-                                                  jsonFilenameTemplate = jsonFilenameTemplate,
-                                                  imgFilenameTemplate = imgFilenameTemplate,
-                                                  jsRoot = jsRoot, timeSlice = timeSlice)
+                    drawerContent = renderRunPageFragment(runPageNames["runPageDrawer"])
+                    mainContent = renderRunPageFragment(runPageNames["runPageMainContent"])
                 except jinja2.exceptions.TemplateNotFound as e:
                     error.setdefault("Template Error", []).append("Request template: \"{}\", but it was not found!".format(e.name))
             elif requestedFileType == "rootFiles":
@@ -539,7 +744,7 @@ def runPage(runNumber, subsystemName, requestedFileType):
                     # Subsystem specific run pages are not available since they don't seem to be necessary
                     # Note that even though this file should always be found, we check for exceptions just in case.
                     drawerContent = ""
-                    mainContent = render_template("rootFilesMainContent.html", run = run, subsystem = subsystemName)
+                    mainContent = render_template("rootFilesMainContent.html", run = run, subsystem = subsystemName, rootFiles = retrieveRootFiles())
                 except jinja2.exceptions.TemplateNotFound as e:
                     error.setdefault("Template Error", []).append("Request template: \"{}\", but it was not found!".format(e.name))
             else:
@@ -558,6 +763,48 @@ def runPage(runNumber, subsystemName, requestedFileType):
                        histName = requestedHist,
                        histGroup = requestedHistGroup)
 
+@app.route("/monitoring/updates/Run<int:runNumber>/<string:subsystemName>", methods=["GET"])
+@login_required
+def runPageUpdates(runNumber, subsystemName):
+    """ Notify an open run page about new processing output (polling).
+
+    The request returns immediately with the current output version of the subsystem and the output files which
+    have changed relative to the version that the client already has. The client can then request just those
+    files instead of reloading the page. The client should issue a new request after ``pollInterval`` seconds,
+    as long as the run is ongoing. The request doesn't wait for new output, so it never holds a web app worker.
+
+    Note:
+        Function args (after the first 2) are provided through the flask request object.
+
+    Args:
+        runNumber (int): Run number of interest.
+        subsystemName (str): Name of the subsystem of interest.
+        outputVersion (int): Output version of the subsystem which is displayed by the client.
+    Returns:
+        Response: json containing the current ``outputVersion``, whether the run is ongoing (``runOngoing``),
+            the changed files (``changedFiles``), which maps the filenames to their content hashes, and the
+            time in seconds until the client should check again (``pollInterval``).
+    """
+    runDir = "Run{runNumber}".format(runNumber = runNumber)
+    outputVersion = validation.convertRequestToPositiveInteger(paramName = "outputVersion", source = request.args)
+
+    runs = db["runs"]
+    if runDir not in runs:
+        return jsonify(error = "Run {runNumber} is not available!".format(runNumber = runNumber)), 404
+    try:
+        with requestPhase("database"):
+            run = runArchive.retrieveRun(runs, runDir, cacheSize = serverParameters["runArchiveCacheSize"])
+    except runArchive.RunDataUnavailable as e:
+        return jsonify(error = str(e)), 404
+    if subsystemName not in run.subsystems:
+        return jsonify(error = "Subsystem {subsystemName} is not available!".format(subsystemName = subsystemName)), 404
+    subsystem = run.subsystems[subsystemName]
+
+    return jsonify(outputVersion = subsystem.outputVersion,
+                   runOngoing = run.isRunOngoing(),
+                   changedFiles = subsystem.outputChangesSince(outputVersion),
+                   pollInterval = serverParameters["runPageUpdatesPollInterval"])
+
 @app.route("/monitoring/protected/<path:filename>")
 @login_required
 def protected(filename):
@@ -568,8 +815,14 @@ def protected(filename):
     to provide access via this function. To provide this function, we utilized the approach
     `described here <https://stackoverflow.com/a/27611882>`_.
 
+    Files are served with a strong ``ETag`` based on a hash of their content, such that a client can cheaply
+    revalidate a file which it has already received (receiving a 304 if it hasn't changed). For processing
+    outputs, the hash recorded by the processing is used. Other files (such as time slice outputs or archives)
+    are hashed when they are served. If the content hash is passed as the ``v`` GET parameter and matches the
+    file, the URL uniquely identifies the content, so the client may cache it indefinitely.
+
     Note:
-        This function ignores GET parameters. This is done intentionally to allow for avoiding problematic
+        Other GET parameters are ignored. This is done intentionally to allow for avoiding problematic
         caching by a browser. To avoid this caching, simply pass an additional get parameter after the
         filename which varies when we need to avoid the cache. This is particularly useful for time slices,
         where the name could be the same, but the information has changed since last being served.
@@ -580,10 +833,71 @@ def protected(filename):
         Response: File with the proper headers.
     """
     logger.debug("filename: {filename}".format(filename = filename))
-    # Ignore the time GET parameter that is sometimes passed- just to avoid the cache when required
-    #if request.args.get("time"):
-    #    print "timeParameter:", request.args.get("time")
-    return send_from_directory(os.path.realpath(serverParameters["protectedFolder"]), filename)
+    # We handle the conditional request ourselves, using the content hash instead of the modification time.
+    with requestPhase("fileServing"):
+        response = send_from_directory(os.path.realpath(serverParameters["protectedFolder"]), filename, conditional = False)
+        fileHash = recordedOutputHash(filename)
+        if fileHash is None:
+            fileHash = retrieveFileHash(os.path.join(os.path.realpath(serverParameters["protectedFolder"]), filename))
+    response.set_etag(fileHash)
+    if request.args.get("v") == fileHash:
+        response.headers["Cache-Control"] = "public, max-age={maxAge}, immutable".format(maxAge = 365 * 24 * 60 * 60)
+    else:
+        # The client must check whether the file has changed, but it can reuse the content if it hasn't.
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def recordedOutputHash(filename):
+    """ Retrieve the hash of the content of a processing output file, as recorded by the processing.
+
+    Args:
+        filename (str): Path to the file, relative to the protected folder.
+    Returns:
+        str: Hash of the content of the file, or ``None`` if it isn't recorded (for example, for time slice
+            outputs, or for archived runs, which aren't loaded just to retrieve the hash).
+    """
+    filename = os.path.normpath(filename)
+    # Output files are stored in ``Run123456/SYS/{img,json}/``.
+    pathComponents = filename.split(os.sep)
+    if len(pathComponents) < 3:
+        return None
+    run = db["runs"].get(pathComponents[0])
+    if run is None or runArchive.isArchived(run):
+        return None
+    baseDir = os.path.join(pathComponents[0], pathComponents[1])
+    # Multiple subsystems may store their output in the same directory, so we check each of them.
+    for subsystem in run.subsystems.values():
+        if subsystem.baseDir == baseDir:
+            fileHash = subsystem.outputHash(filename)
+            if fileHash is not None:
+                return fileHash
+    return None
+
+#: Content hashes of served files which are not recorded by the processing. Keys are the filenames, while
+#: values are tuples of ``(modification time, size, hash)``. Ordered from least to most recently used.
+#: See ``retrieveFileHash(...)``.
+_fileHashes = collections.OrderedDict()
+_fileHashesLock = threading.Lock()
+
+def retrieveFileHash(filename):
+    """ Retrieve the hash of the content of a file, calculating it only if the file has changed.
+
+    Args:
+        filename (str): Path to the file.
+    Returns:
+        str: Hash of the content of the file.
+    """
+    fileStat = os.stat(filename)
+    with _fileHashesLock:
+        (modificationTime, size, fileHash) = _fileHashes.pop(filename, (None, None, None))
+    if modificationTime != fileStat.st_mtime or size != fileStat.st_size:
+        fileHash = baseUtilities.hashFile(filename)
+    with _fileHashesLock:
+        # Store as the most recently used.
+        _fileHashes[filename] = (fileStat.st_mtime, fileStat.st_size, fileHash)
+        while len(_fileHashes) > serverParameters["fileHashCacheSize"]:
+            _fileHashes.popitem(last = False)
+    return fileHash
 
 @app.route("/timeSlice", methods=["GET", "POST"])
 @login_required
@@ -622,46 +936,50 @@ def timeSlice():
     jsRoot = validation.convertRequestToPythonBool("jsRoot", request.form)
 
     if request.method == "POST":
-        # Get the runs
-        runs = db["runs"]
-
-        # Validates the request.
-        (error, minTime, maxTime, runDir, subsystem, histGroup, histName, inputProcessingOptions) = validation.validateTimeSlicePostRequest(request, runs)
-
-        if error == {}:
-            # Print input values for help in debugging.
-            logger.debug("minTime: {minTime}".format(minTime = minTime))
-            logger.debug("maxTime: {maxTime}".format(maxTime = maxTime))
-            logger.debug("runDir: {runDir}".format(runDir = runDir))
-            logger.debug("subsystem: {subsystem}".format(subsystem = subsystem))
-            logger.debug("histGroup: {histGroup}".format(histGroup = histGroup))
-            logger.debug("histName: {histName}".format(histName = histName))
-
-            # Process the time slice
-            returnValue = processRuns.processTimeSlices(runs, runDir, minTime, maxTime, subsystem, inputProcessingOptions)
-            logger.info("returnValue: {}".format(returnValue))
-            logger.debug("runs[runDir].subsystems[subsystem].timeSlices: {}".format(runs[runDir].subsystems[subsystem].timeSlices))
-
-            # A normal return value should be a time slice key as a string. We can continue as expected.
-            # However, if we received an error, we expect some sort of dictionary (mapping). We handle that below.
-            if not isinstance(returnValue, collections.Mapping):
-                timeSliceKey = returnValue
-
-                # Passed off the result to render via the run page since we a time slice just modifies
-                # the content which is displayed there.
-                # We always want to use AJAX here
-                return redirect(url_for("runPage",
-                                        runNumber = runs[runDir].runNumber,
-                                        subsystemName = subsystem,
-                                        requestedFileType = "runPage",
-                                        ajaxRequest = json.dumps(True),
-                                        jsRoot = json.dumps(jsRoot),
-                                        histGroup = histGroup,
-                                        histName = histName,
-                                        timeSliceKey = json.dumps(timeSliceKey)))
-            else:
-                # Fall through to return an error
-                error = returnValue
+        # Time slices are stored in the database, so we need to be able to write to it.
+        with writeConnection() as dbRoot:
+            # Get the runs
+            runs = dbRoot["runs"]
+
+            # Validates the request.
+            (error, minTime, maxTime, runDir, subsystem, histGroup, histName, inputProcessingOptions) = validation.validateTimeSlicePostRequest(request, runs)
+
+            if error == {}:
+                # Print input values for help in debugging.
+                logger.debug("minTime: {minTime}".format(minTime = minTime))
+                logger.debug("maxTime: {maxTime}".format(maxTime = maxTime))
+                logger.debug("runDir: {runDir}".format(runDir = runDir))
+                logger.debug("subsystem: {subsystem}".format(subsystem = subsystem))
+                logger.debug("histGroup: {histGroup}".format(histGroup = histGroup))
+                logger.debug("histName: {histName}".format(histName = histName))
+
+                # Process the time slice
+                returnValue = processRuns.processTimeSlices(runs, runDir, minTime, maxTime, subsystem, inputProcessingOptions,
+                                                            runIndex = dbRoot.get("runIndex"), histogramTemplates = dbRoot.get("histogramTemplates"))
+                logger.info("returnValue: {}".format(returnValue))
+
+                # A normal return value should be a time slice key as a string. We can continue as expected.
+                # However, if we received an error, we expect some sort of dictionary (mapping). We handle that below.
+                if not isinstance(returnValue, collections.Mapping):
+                    timeSliceKey = returnValue
+                    # Archived runs are restored into the database to store the time slice.
+                    logger.debug("runs[runDir].subsystems[subsystem].timeSlices: {}".format(runs[runDir].subsystems[subsystem].timeSlices))
+
+                    # Passed off the result to render via the run page since we a time slice just modifies
+                    # the content which is displayed there.
+                    # We always want to use AJAX here
+                    return redirect(url_for("runPage",
+                                            runNumber = runs[runDir].runNumber,
+                                            subsystemName = subsystem,
+                                            requestedFileType = "runPage",
+                                            ajaxRequest = json.dumps(True),
+                                            jsRoot = json.dumps(jsRoot),
+                                            histGroup = histGroup,
+                                            histName = histName,
+                                            timeSliceKey = json.dumps(timeSliceKey)))
+                else:
+                    # Fall through to return an error
+                    error = returnValue
 
         logger.info("Time slices error: {error}".format(error = error))
         drawerContent = ""
@@ -677,13 +995,14 @@ def timeSlice():
 def testingDataArchive():
     """ Provides a zip archive of test data for Overwatch development.
 
-    This function will look through at most the 5 most recent runs, looking for the minimum number of files
-    necessary for running Overwatch successfully. These files will be zipped up and provided to the user.
-    The minimum files are the combined file, and the most recent file received for the subsystem (they are
-    usually the same, but it is easier to include both). If possible, an additional file is included for testing
-    the time slice and trending functionality. It may not always be available if runs are extremely short. The
-    zip archive will include all subsystems which are available. It will skip runs where any subsystem is unavailable
-    to ensure that the data provided is of more utility.
+    By default, the archive contains the minimum number of files necessary for running Overwatch successfully
+    for at most the 5 most recent runs which have data for all subsystems. See ``processing.testingDataArchive``
+    for further information on the selected files. This archive is created by the processing when new runs arrive,
+    so we just redirect to it. If it isn't available yet, it is streamed directly to the user instead.
+
+    Other selections of runs and subsystems can be requested via the ``runs`` and ``subsystems`` request
+    arguments, which are comma separated lists of run numbers and subsystem names, respectively. These archives
+    are always streamed directly to the user, without being stored on disk.
 
     Warning:
         Careful in changing the routing for this function, as the name of it is hard coded in
@@ -693,53 +1012,65 @@ def testingDataArchive():
     Args:
         None
     Returns:
-        redirect: Redirect to the newly created file.
+        Response: Redirect to the stored archive, or the streamed archive.
     """
     # Get db
     runs = db["runs"]
-    runList = runs.keys()
-
-    # Retrieve at most 5 files
-    numberOfFilesToDownload = 5
-    if len(runList) < 5:
-        numberOfFilesToDownload = len(runList)
-
-    # Create zip file. It will be stored in the root of the data directory.
-    # It is fine to be overwritten because it can always be recreated.
-    zipFilename = "testingDataArchive.zip"
-    with zipfile.ZipFile(os.path.join(serverParameters["protectedFolder"], zipFilename), "w") as zipFile:
-        logger.info("Creating zipFile at %s" % os.path.join(serverParameters["protectedFolder"], zipFilename))
-
-        # Starting from the end, we look for runs which have the full set of subsystems. For each one, we write
-        # each subsystem of that run to the zip file. Note that the files are written in reverse order. However,
-        # this is fine because the order doesn't make a difference in the final archive.
-        numberOfFilesWritten = 0
-        # We need to explicitly call keys here because ``BTree`` doesn't support being reversed directly.
-        for runDir in reversed(runs.keys()):
-            if numberOfFilesWritten == numberOfFilesToDownload:
-                break
-            # It's easier to operate with the runContainer object.
-            run = runs[runDir]
-            # Ensure that we get a full set of subsystems. If the run doesn't have data for all subsystems, we skip
-            # it because otherwise the test data is much less useful.
-            if set(serverParameters["subsystemList"]) != set(run.subsystems):
-                continue
-            else:
-                for subsystem in run.subsystems.values():
-                    # Write files to the zip file
-                    # Combined file
-                    zipFile.write(os.path.join(serverParameters["protectedFolder"], subsystem.combinedFile.filename))
-                    # Uncombined file. This is the last file that was received from the subsystem.
-                    zipFile.write(os.path.join(serverParameters["protectedFolder"], subsystem.files[subsystem.files.keys()[-1]].filename))
-                    # We select 4 as an arbitrary point to ensure that there is some different between the data stored
-                    # in it and the combined file.
-                    if len(subsystem.files) > 4:
-                        # Write an additional file for testing time slices.
-                        zipFile.write(os.path.join(serverParameters["protectedFolder"], subsystem.files[subsystem.files.keys()[-5]].filename))
-                numberOfFilesWritten += 1
-
-    # Return with a download link
-    return redirect(url_for("protected", filename=zipFilename))
+
+    # Determine the requested selection.
+    runDirs = request.args.get("runs", None)
+    subsystems = request.args.get("subsystems", None)
+    try:
+        if runDirs is not None:
+            runDirs = ["Run{runNumber}".format(runNumber = int(runNumber)) for runNumber in runDirs.split(",")]
+    except ValueError:
+        return render_template("error.html", errors = {"error": ["Run numbers {runDirs} are invalid!".format(runDirs = runDirs)]})
+    if subsystems is not None:
+        subsystems = subsystems.split(",")
+        invalidSubsystems = [subsystem for subsystem in subsystems if subsystem not in serverParameters["subsystemList"]]
+        if invalidSubsystems:
+            return render_template("error.html", errors = {"error": ["Subsystems {invalidSubsystems} are invalid!".format(invalidSubsystems = invalidSubsystems)]})
+
+    filenames = processingTestingDataArchive.selectFiles(runs = runs,
+                                                         runIndex = db.get("runIndex"),
+                                                         subsystemList = serverParameters["subsystemList"],
+                                                         runDirs = runDirs,
+                                                         subsystems = subsystems,
+                                                         numberOfRuns = serverParameters["testingDataArchiveNumberOfRuns"],
+                                                         cacheSize = serverParameters["runArchiveCacheSize"])
+    if not filenames:
+        return render_template("error.html", errors = {"error": ["No files are available for the testing data archive!"]})
+    zipFilename = processingTestingDataArchive.archiveFilename(filenames, serverParameters["protectedFolder"])
+
+    # Redirect to the default archive if it has already been created.
+    if runDirs is None and subsystems is None and os.path.exists(os.path.join(serverParameters["protectedFolder"], zipFilename)):
+        return redirect(url_for("protected", filename = zipFilename))
+
+    logger.info("Streaming testing data archive {zipFilename}".format(zipFilename = zipFilename))
+    return Response(processingTestingDataArchive.streamArchive(filenames, serverParameters["protectedFolder"]),
+                    mimetype = "application/zip",
+                    headers = {"Content-Disposition": "attachment; filename={zipFilename}".format(zipFilename = zipFilename)})
+
+@app.route("/metrics")
+@login_required
+def requestMetricsSummary():
+    """ Provide the request latency metrics of this web app process.
+
+    For each route, the total number of requests, the percentiles (p50, p90, and p99) of the request duration
+    and of each phase of the request (in seconds), as well as the mean number of objects loaded from the
+    database and the mean response size (in bytes) are provided. The percentiles are determined from the
+    most recent requests (as set by ``requestMetricsSamples``).
+
+    Note:
+        The metrics are stored separately in each web app process (for example, in each uwsgi worker), so
+        only the requests which were handled by the process which serves this request are included.
+
+    Args:
+        None.
+    Returns:
+        Response: JSON containing the summary of the request metrics for each route.
+    """
+    return jsonify(pid = os.getpid(), routes = metrics.summary())
 
 @app.route("/overwatchStatus")
 @login_required
@@ -748,17 +1079,15 @@ def overwatchStatus():
 
     This function takes advantage of the status functionality of the web app to determine the state of any
     deployed web apps that are specified in the web app config. This is achieved by sending requests to all
-    other sites and then aggregating the results. Each request is allowed a 0.5 second timeout.
+    other sites and then aggregating the results. The requests are performed concurrently in the background
+    by the ``siteStatusMonitor``, so the last known statuses (and when they were determined) are returned
+    immediately.
 
     It will also provide information on when the last files were received from other sites.
 
     This functionality will only work if the web app is accessible from the site where this is run. This may
     not always be the case.
 
-    Note:
-        Since the GET requests are blocking, it can appear that the web app is hanging. However, this is
-        just due to the time that the requests take.
-
     Warning:
         This can behave somewhat strangely using the flask development server, especially if there is reloading.
         If possible, it is best to run with ``uwsgi`` for testing of this function.
@@ -780,7 +1109,7 @@ def overwatchStatus():
 
     # Determine if a run is ongoing
     # To do so, we need the most recent run
-    mostRecentRun = runs[runs.keys()[-1]]
+    mostRecentRun = runs[runs.maxKey()]
     runOngoing = mostRecentRun.isRunOngoing()
     if runOngoing:
         runOngoingNumber = "- " + mostRecentRun.prettyName
@@ -794,29 +1123,13 @@ def overwatchStatus():
     statuses["Time since last timestamp file"] = "{minutes} minutes".format(minutes = int(mostRecentRun.minutesSinceLastTimestamp()))
 
     # Determine server statuses
-    exceptionErrorMessage = "Request to \"{site}\" at \"{url}\" {errorType} with error message {e}!"
-    sites = serverParameters["statusRequestSites"]
-    for site, url in iteritems(sites):
-        serverError = {}
-        statusResult = ""
-        try:
-            serverRequest = requests.get(url + "/status", timeout = 0.5)
-            if serverRequest.status_code != 200:
-                serverError.setdefault("Request error", []).append("Request to \"{}\" at \"{}\" returned error response {}!".format(site, url, serverRequest.status_code))
-            else:
-                statusResult = "Site is up!"
-        except requests.exceptions.Timeout as e:
-            serverError.setdefault("Timeout error", []).append(exceptionErrorMessage.format(site = site, url = url, errorType = "timed out", e = e))
-        except requests.exceptions.ConnectionError as e:
-            serverError.setdefault("Connection error", []).append(exceptionErrorMessage.format(site = site, url = url, errorType = "had a connection error", e = e))
-        except requests.exceptions.RequestException as e:
-            serverError.setdefault("General Requests error", []).append(exceptionErrorMessage.format(site = site, url = url, errorType = "had a general requests error", e = e))
-
-        # Store the error if one occurred
-        if serverError != {}:
-            statusResult = serverError
-        # Add to status
-        statuses[site] = statusResult
+    if serverParameters["statusRequestSites"]:
+        (siteStatuses, age) = siteMonitor.retrieveStatuses()
+        if age is None:
+            statuses["Site status last checked"] = "Checking now. Please reload in a few seconds."
+        else:
+            statuses["Site status last checked"] = "{age} seconds ago".format(age = int(age))
+        statuses.update(siteStatuses)
 
     if ajaxRequest is False:
         return render_template("status.html", statuses = statuses)
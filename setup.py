@@ -70,6 +70,8 @@ setup(
             # because they will be launched directly via ``uwsgi`` (ie not through these scripts)
             "overwatchDQMReceiver = overwatch.receiver.run:runDevelopment",
             "overwatchWebApp = overwatch.webApp.run:runDevelopment",
+            # Build the web app static assets ahead of time
+            "overwatchBuildAssets = overwatch.webApp.utilities:runBuildAssets",
             # The processing will be launched this way in both production and development, so it
             # points to a different type of function. This function will on an interval if the
             # sleep time is set to a positive value. Otherwise, it will run once.
@@ -85,6 +87,8 @@ setup(
             "overwatchReplay = overwatch.base.run:runReplayData",
             # For moving larger quantities of data for later data transfer
             "overwatchReplayDataTransfer = overwatch.base.run:runReplayDataTransfer",
+            # Database maintenance (such as packing)
+            "overwatchDatabaseMaintenance = overwatch.base.run:runDatabaseMaintenance",
             # Simple script to monitor ZMQ receivers
             "overwatchReceiverMonitor = overwatch.receiver.monitor:run",
         ],
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+""" Tests for receiving uploads in chunks.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest
+
+import hashlib
+import io
+import logging
+import os
+import threading
+logger = logging.getLogger(__name__)
+
+from overwatch.base import chunkedUpload
+
+@pytest.fixture
+def uploadData(loggingMixin, tmpdir):
+    """ Provide the data to upload and the destination.
+
+    Args:
+        None.
+    Returns:
+        tuple: (data, outputPath) where data (bytes) is the content of the file, and outputPath (str) is where
+            the file should be stored.
+    """
+    data = os.urandom(1000)
+    yield data, str(tmpdir.join("EMChistos_123456_DQM_1970_01_02_16_07_24.root"))
+
+def testChunkParameters(loggingMixin):
+    """ Test extracting the chunked upload parameters from the headers. """
+    assert chunkedUpload.chunkParameters({"runNumber": "123"}) is None
+    assert chunkedUpload.chunkParameters({"uploadOffset": "10", "uploadLength": "100", "chunkChecksum": "abcd"}) == {
+        "offset": 10, "length": 100, "chunkChecksum": "abcd", "fileChecksum": None,
+    }
+    with pytest.raises(ValueError):
+        chunkedUpload.chunkParameters({"uploadOffset": "10"})
+
+def testWriteChunks(uploadData):
+    """ Test uploading a file in chunks, including resuming after an interrupted chunk. """
+    data, outputPath = uploadData
+    fileChecksum = hashlib.sha256(data).hexdigest()
+
+    (offset, complete) = chunkedUpload.writeChunk(io.BytesIO(data[:400]), outputPath, offset = 0, length = len(data),
+                                                  chunkChecksum = hashlib.sha256(data[:400]).hexdigest(), fileChecksum = fileChecksum)
+    assert (offset, complete) == (400, False)
+    # The file is only available once it is complete.
+    assert not os.path.exists(outputPath)
+    assert chunkedUpload.receivedOffset(outputPath) == 400
+
+    # A corrupted chunk is discarded, so it can be sent again.
+    with pytest.raises(chunkedUpload.ChecksumMismatch) as exceptionInfo:
+        chunkedUpload.writeChunk(io.BytesIO(b"corrupted"), outputPath, offset = 400, length = len(data),
+                                 chunkChecksum = hashlib.sha256(data[400:409]).hexdigest())
+    assert exceptionInfo.value.offset == 400
+    assert chunkedUpload.receivedOffset(outputPath) == 400
+
+    # A chunk which doesn't continue from the received data is rejected with the offset to continue from.
+    with pytest.raises(chunkedUpload.OffsetMismatch) as exceptionInfo:
+        chunkedUpload.writeChunk(io.BytesIO(data[800:]), outputPath, offset = 800, length = len(data))
+    assert exceptionInfo.value.offset == 400
+
+    (offset, complete) = chunkedUpload.writeChunk(io.BytesIO(data[400:]), outputPath, offset = 400, length = len(data),
+                                                  fileChecksum = fileChecksum)
+    assert (offset, complete) == (len(data), True)
+    with open(outputPath, "rb") as f:
+        assert f.read() == data
+    assert chunkedUpload.receivedOffset(outputPath) == 0
+    # The lock file is removed once the upload is complete.
+    assert os.listdir(os.path.dirname(chunkedUpload.partialFilename(outputPath))) == []
+
+def testWriteChunksLock(uploadData):
+    """ Test that chunks of the same file wait for each other. """
+    data, outputPath = uploadData
+    chunkedUpload.writeChunk(io.BytesIO(data[:400]), outputPath, offset = 0, length = len(data))
+
+    results = []
+    with chunkedUpload._uploadLock(chunkedUpload.partialFilename(outputPath)):
+        writer = threading.Thread(target = lambda: results.append(chunkedUpload.writeChunk(io.BytesIO(data[400:]), outputPath,
+                                                                                           offset = 400, length = len(data))))
+        writer.start()
+        writer.join(0.2)
+        # It must wait until the lock is released.
+        assert writer.is_alive()
+        assert results == []
+    writer.join()
+
+    assert results == [(len(data), True)]
+    with open(outputPath, "rb") as f:
+        assert f.read() == data
+
+@pytest.mark.parametrize("fileChecksum, expectedComplete", [
+    (None, True),
+    ("matching", True),
+    (hashlib.sha256(b"other data").hexdigest(), False),
+], ids = ["No checksum", "Matching checksum", "Different checksum"])
+def testWriteFinalChunkAgain(uploadData, fileChecksum, expectedComplete):
+    """ Test that resending the final chunk of a completed upload doesn't restart the upload. """
+    data, outputPath = uploadData
+    if fileChecksum == "matching":
+        fileChecksum = hashlib.sha256(data).hexdigest()
+    chunkedUpload.writeChunk(io.BytesIO(data[:400]), outputPath, offset = 0, length = len(data))
+    chunkedUpload.writeChunk(io.BytesIO(data[400:]), outputPath, offset = 400, length = len(data))
+
+    if expectedComplete:
+        (offset, complete) = chunkedUpload.writeChunk(io.BytesIO(data[400:]), outputPath, offset = 400,
+                                                      length = len(data), fileChecksum = fileChecksum)
+        assert (offset, complete) == (len(data), True)
+    else:
+        with pytest.raises(chunkedUpload.OffsetMismatch) as exceptionInfo:
+            chunkedUpload.writeChunk(io.BytesIO(data[400:]), outputPath, offset = 400,
+                                     length = len(data), fileChecksum = fileChecksum)
+        assert exceptionInfo.value.offset == 0
+    # The completed file is left untouched.
+    with open(outputPath, "rb") as f:
+        assert f.read() == data
+    assert os.listdir(os.path.dirname(chunkedUpload.partialFilename(outputPath))) == []
+
+def testWriteChunksFileChecksum(uploadData):
+    """ Test that a file which doesn't match the checksum is discarded. """
+    data, outputPath = uploadData
+
+    with pytest.raises(chunkedUpload.ChecksumMismatch) as exceptionInfo:
+        chunkedUpload.writeChunk(io.BytesIO(data), outputPath, offset = 0, length = len(data),
+                                 fileChecksum = hashlib.sha256(b"other data").hexdigest())
+    assert exceptionInfo.value.offset == 0
+    assert not os.path.exists(outputPath)
+    assert chunkedUpload.receivedOffset(outputPath) == 0
+
+@pytest.mark.parametrize("sendData", [
+    True,
+    False,
+], ids = ["Data", "Empty"])
+def testSaveStream(uploadData, sendData):
+    """ Test saving an upload which is sent in a single request. """
+    data, outputPath = uploadData
+    data = data if sendData else b""
+
+    assert chunkedUpload.saveStream(io.BytesIO(data), outputPath, bufferSize = 64) == len(data)
+    assert os.path.exists(outputPath) is sendData
+    if sendData:
+        with open(outputPath, "rb") as f:
+            assert f.read() == data
+    assert os.listdir(os.path.dirname(chunkedUpload.partialFilename(outputPath))) == []
@@ -19,9 +19,10 @@ import logging
 logger = logging.getLogger(__name__)
 
 import overwatch.base.dataTransfer as dataTransfer
+from overwatch.base import transferLedger
 
 @pytest.fixture
-def dataTransferSetup():
+def dataTransferSetup(tmpdir, mocker):
     """ Basic variables for testing the data transfer module.
 
     Note:
@@ -56,6 +57,9 @@ def dataTransferSetup():
         "rsync": destination,
         "EOS": destination,
     }
+    # Store the ledger separately for each test.
+    mocker.patch.object(dataTransfer, "ledger", transferLedger.transferLedger(filename = str(tmpdir.join("transferLedger.sqlite")),
+                                                                              retryDelay = 10, maxRetryDelay = 30))
 
     yield (directory, destination, filenames)
 
@@ -214,3 +218,99 @@ def testProcessReceivedFilesFailure(loggingMixin, dataTransferSetup, mocker):
                               destination = os.path.join(dataTransfer.parameters["receiverDataTempStorage"], siteName),
                               filenames = filenames)
 
+
+def testTransferProgress(loggingMixin, mocker):
+    """ Test that files are removed once they have been handled by every site. """
+    mRemove = mocker.MagicMock()
+    progress = dataTransfer.transferProgress(filenames = ["a.root", "b.root"], siteNames = ["site1", "EOS"], removeFile = mRemove)
+
+    assert progress.complete("site1", ["a.root", "b.root"]) == []
+    assert progress.complete("EOS", ["b.root"]) == ["b.root"]
+    mRemove.assert_called_once_with("b.root")
+    # Handling a file twice shouldn't remove it twice.
+    assert progress.complete("EOS", ["b.root"]) == []
+    assert progress.complete("EOS", ["a.root"]) == ["a.root"]
+    assert mRemove.call_count == 2
+    assert progress.remainingSites == {}
+
+def testProcessReceivedFilesPartialFailure(loggingMixin, dataTransferSetup, mocker):
+    """ Test that files are removed once every site has either received them or they were stored after failing. """
+    directory, destination, filenames = dataTransferSetup
+    dataTransfer.parameters["debug"] = False
+    mRemove = mocker.patch("overwatch.base.dataTransfer.os.remove")
+    mStore = mocker.patch("overwatch.base.dataTransfer.storeFailedFiles")
+    mocker.patch("overwatch.base.dataTransfer.copyFilesToEOS", return_value = filenames)
+
+    (successfullyTransferred, failedFilenames) = dataTransfer.processReceivedFiles()
+
+    assert successfullyTransferred == []
+    assert failedFilenames == {"rsync": [], "EOS": filenames}
+    mStore.assert_called_once_with(siteName = "EOS", filenames = filenames)
+    for f in filenames:
+        mRemove.assert_any_call(os.path.join(directory, f))
+    checkTransferredFiles(source = directory,
+                          destination = destination,
+                          filenames = filenames)
+
+def testRetryFailedFiles(loggingMixin, dataTransferSetup, tmpdir, mocker):
+    """ Test retrying files stored in the temporary storage, including those which aren't yet in the ledger. """
+    directory, destination, filenames = dataTransferSetup
+    dataTransfer.parameters["receiverDataTempStorage"] = str(tmpdir.join("tempStorage"))
+    # Store the files for one site as if they failed before the ledger existed.
+    dataTransfer.parameters["dataTransferLocations"] = {"rsync": destination}
+    dataTransfer.storeFailedFiles(siteName = "rsync", filenames = filenames)
+    storagePath = os.path.join(dataTransfer.parameters["receiverDataTempStorage"], "rsync")
+
+    # They are added to the ledger, but aren't retried until they are due.
+    mCopy = mocker.patch("overwatch.base.dataTransfer.copyFilesToOverwatchSites", return_value = filenames)
+    assert dataTransfer.retryFailedFiles(now = 100) == ({}, {})
+    assert dataTransfer.transferBacklog(now = 105)["rsync"]["files"] == len(filenames)
+
+    # Fail again.
+    assert dataTransfer.retryFailedFiles(now = 110) == ({"rsync": []}, {"rsync": filenames})
+    mCopy.assert_called_once_with(directory = storagePath, destination = destination, filenames = filenames)
+    assert dataTransfer.ledger.backlogSummary(now = 110)["rsync"]["maxAttempts"] == 2
+
+    # Succeed once the (longer) delay has passed.
+    mCopy.return_value = []
+    assert dataTransfer.retryFailedFiles(now = 125) == ({}, {})
+    assert dataTransfer.retryFailedFiles(now = 130) == ({"rsync": filenames}, {"rsync": []})
+    assert dataTransfer.transferBacklog(now = 130) == {}
+    for f in filenames:
+        assert not os.path.exists(os.path.join(storagePath, f))
+
+@pytest.mark.parametrize("maxSize, maxTime, throughput, expectedBatches", [
+    (100, None, None, [["a.root", "b.root", "c.root"]]),
+    (25, None, None, [["a.root", "b.root"], ["c.root"]]),
+    (5, None, None, [["a.root"], ["b.root"], ["c.root"]]),
+    (100, 2, 10, [["a.root", "b.root"], ["c.root"]]),
+], ids = ["Single batch", "Size limit", "Files larger than the limit", "Time limit"])
+def testCreateBatches(loggingMixin, tmpdir, maxSize, maxTime, throughput, expectedBatches):
+    """ Test splitting files into batches by size and expected transfer time. """
+    for filename, size in [("a.root", 10), ("b.root", 10), ("c.root", 10)]:
+        tmpdir.join(filename).write("a" * size)
+
+    batches = dataTransfer.createBatches(directory = str(tmpdir), filenames = ["a.root", "b.root", "c.root"],
+                                         maxSize = maxSize, maxTime = maxTime, throughput = throughput)
+
+    assert batches == expectedBatches
+
+@pytest.mark.parametrize("settings, expectedOptions", [
+    ({}, []),
+    ({"dataTransferRsyncCompressLevel": 3, "dataTransferRsyncPartialDir": ".rsyncPartial"},
+     ["--compress", "--compress-level=3", "--partial-dir=.rsyncPartial"]),
+    ({"dataTransferSSHControlPath": "/tmp/ssh-%r@%h:%p"},
+     ["--rsh=ssh -o ControlMaster=auto -o ControlPath=/tmp/ssh-%r@%h:%p -o ControlPersist=600"]),
+], ids = ["Disabled", "Compression and partial transfers", "Persistent ssh connection"])
+def testRsyncTuningOptions(loggingMixin, mocker, settings, expectedOptions):
+    """ Test the rsync options for compression, partial transfers, and the ssh connection. """
+    parameters = {
+        "dataTransferRsyncCompressLevel": None,
+        "dataTransferRsyncPartialDir": None,
+        "dataTransferSSHControlPath": None,
+        "dataTransferSSHControlPersist": 600,
+    }
+    parameters.update(settings)
+    mocker.patch.dict(dataTransfer.parameters, parameters)
+
+    assert dataTransfer.rsyncTuningOptions() == expectedOptions
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+""" Tests for the database maintenance module.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest
+
+import logging
+import os
+import ZODB
+import ZODB.FileStorage
+import transaction
+import persistent.mapping
+logger = logging.getLogger(__name__)
+
+from overwatch.base import databaseMaintenance
+
+@pytest.fixture
+def fileStorageDB(loggingMixin, tmpdir):
+    """ Create a file storage database with many old revisions of an object.
+
+    Args:
+        None.
+    Returns:
+        ZODB.DB: The database.
+    """
+    db = ZODB.DB(ZODB.FileStorage.FileStorage(str(tmpdir.join("overwatch.fs"))))
+    connection = db.open()
+    dbRoot = connection.root()
+    dbRoot["values"] = persistent.mapping.PersistentMapping()
+    for i in range(20):
+        dbRoot["values"]["value"] = "a" * 10000 + str(i)
+        transaction.commit()
+    connection.close()
+
+    yield db
+
+    db.close()
+
+@pytest.mark.parametrize("archive", [
+    False,
+    True,
+], ids = ["Don't archive", "Archive"])
+def testPackDatabase(fileStorageDB, archive, tmpdir):
+    """ Test packing the database, including the reclaimed space and archiving old transactions. """
+    archiveDirectory = str(tmpdir.join("archive")) if archive else None
+    sizeBefore, sizeAfter, archivedFilename = databaseMaintenance.packDatabase(db = fileStorageDB, archiveDirectory = archiveDirectory)
+
+    assert sizeAfter < sizeBefore
+    assert sizeAfter == os.path.getsize(str(tmpdir.join("overwatch.fs")))
+    if archive:
+        assert os.path.dirname(archivedFilename) == archiveDirectory
+        assert os.path.getsize(archivedFilename) == sizeBefore
+        assert not os.path.exists(str(tmpdir.join("overwatch.fs.old")))
+    else:
+        assert os.path.getsize(str(tmpdir.join("overwatch.fs.old"))) == sizeBefore
+        assert archivedFilename is None
+
+    # The data must still be available.
+    connection = fileStorageDB.open()
+    assert connection.root()["values"]["value"] == "a" * 10000 + "19"
+    connection.close()
+
+@pytest.mark.parametrize("packInterval, sizeThreshold, expected", [
+    (None, None, False),
+    (1, None, True),
+    (3600, None, False),
+    (None, 0.1, True),
+    (None, 1000, False),
+], ids = ["Disabled", "Time elapsed", "Time not elapsed", "Size exceeded", "Size not exceeded"])
+def testPackScheduler(fileStorageDB, packInterval, sizeThreshold, expected, mocker):
+    """ Test the conditions for when a pack is due. """
+    scheduler = databaseMaintenance.packScheduler(db = fileStorageDB, packInterval = packInterval, sizeThreshold = sizeThreshold)
+    scheduler.lastPackTime = scheduler.lastPackTime.subtract(seconds = 10)
+
+    assert scheduler.isPackDue() is expected
+    assert scheduler.packIfDue() is expected
+    scheduler.wait()
+    assert (scheduler.lastResult is not None) is expected
+    assert scheduler.isPacking is False
+
+    if expected:
+        # The pack was just performed, so it shouldn't be due again.
+        scheduler.lastPackTime = scheduler.lastPackTime.add(seconds = 10)
+        assert scheduler.isPackDue() is False
+
+def testPackSchedulerRestoresState(fileStorageDB):
+    """ Test that the time and size of the last pack are restored by a new scheduler (for example, after a restart). """
+    scheduler = databaseMaintenance.packScheduler(db = fileStorageDB, packInterval = 1)
+    scheduler.lastPackTime = scheduler.lastPackTime.subtract(seconds = 10)
+    assert scheduler.packIfDue() is True
+    scheduler.wait()
+
+    restoredScheduler = databaseMaintenance.packScheduler(db = fileStorageDB, packInterval = 3600)
+    assert restoredScheduler.lastPackTime.timestamp() == pytest.approx(scheduler.lastPackTime.timestamp())
+    assert restoredScheduler.sizeAfterLastPack == scheduler.sizeAfterLastPack > 0
+    assert restoredScheduler.isPackDue() is False
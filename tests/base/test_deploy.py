@@ -788,13 +788,18 @@ def testZMQReceiver(loggingMixin, mocker):
     expectedArgs.append(config["additionalOptions"])
     assert executable.args == expectedArgs
 
-def testZODB(loggingMixin, mocker):
+@pytest.mark.parametrize("additionalConfig, expectedZEOOptions", [
+    ({}, ""),
+    ({"invalidationQueueSize": 1000}, "\n        invalidation-queue-size 1000"),
+], ids = ["Default options", "Invalidation queue size"])
+def testZODB(loggingMixin, additionalConfig, expectedZEOOptions, mocker):
     """ Test for the ZODB executable. """
     config = {
         "address": "127.0.0.1",
         "port": 12345,
         "databasePath": "data/overwatch.fs",
     }
+    config.update(additionalConfig)
     executable = deploy.retrieveExecutable("zodb", config = config)
 
     # Mock folder creation. We want to make it a noop so we don't make a bunch of random empty folders.
@@ -808,7 +813,7 @@ def testZODB(loggingMixin, mocker):
     # Determine expected values
     expected = """
     <zeo>
-        address {address}:{port}
+        address {address}:{port}{expectedZEOOptions}
     </zeo>
 
     <filestorage>
@@ -816,7 +821,7 @@ def testZODB(loggingMixin, mocker):
     </filestorage>
     """
     # Fill in the values.
-    expected = expected.format(**config)
+    expected = expected.format(expectedZEOOptions = expectedZEOOptions, **config)
     expected = inspect.cleandoc(expected)
 
     mFile.assert_called_once_with(executable.configFilename, "w")
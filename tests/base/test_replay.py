@@ -9,6 +9,7 @@ import pytest
 
 import copy
 import os
+import threading
 import logging
 logger = logging.getLogger(__name__)
 
@@ -198,3 +199,69 @@ def testMoveFiles(loggingMixin, mocker, nMaxFiles):
     # For each call, we expand each tuple of args.
     assert mMove.mock_calls == [mocker.call(*args) for args in availableFiles[:nMaxFiles]]
 
+
+def testIndexFiles(loggingMixin, mocker):
+    """ Test indexing the files to replay, which are sorted by time stamp across all subsystems. """
+    setupRetrieveHLTModeMock(hltMode = "C", mocker = mocker)
+    baseDir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "replayData")
+
+    files = replay.indexFiles(baseDir = baseDir)
+
+    times = ["2015_11_24_18_05_10", "2015_11_24_18_06_10", "2015_11_24_18_07_10", "2015_11_24_18_08_11", "2015_11_24_18_09_12"]
+    assert [name for _, _, name in files] == ["{subsystem}histos_123_C_{time}.root".format(subsystem = subsystem, time = t)
+                                              for t in times for subsystem in ["EMC", "HLT"]]
+    timestamps = [timestamp for timestamp, _, _ in files]
+    assert timestamps == sorted(timestamps)
+    assert timestamps[2] - timestamps[0] == 60
+
+@pytest.mark.parametrize("rate, speedup, expectedMoved", [
+    (1, None, [1, 1, 10, 10]),
+    (None, 60, [2, 2, 10, 10]),
+    (None, 1, [2, 2, 4, 10]),
+], ids = ["Fixed rate", "Faster than real time", "Real time"])
+def testReplayEngine(loggingMixin, mocker, rate, speedup, expectedMoved):
+    """ Test replaying files at a target rate.
+
+    Replaying at a fixed rate replays a file each second, while replaying at a multiple of the original rate
+    replays the files of each time stamp together.
+    """
+    mMove = mocker.patch("overwatch.base.replay.shutil.move")
+    setupRetrieveHLTModeMock(hltMode = "C", mocker = mocker)
+    baseDir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "replayData")
+    destinationDir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "destinationDir")
+
+    engine = replay.replayEngine(baseDir = baseDir, destinationDir = destinationDir, rate = rate, speedup = speedup)
+    nMoved = []
+    for now in [100, 100.5, 160, 400]:
+        engine.replayDue(now = now)
+        nMoved.append(mMove.call_count)
+
+    assert nMoved == expectedMoved
+    assert engine.finished is True
+    assert engine.nextTime() is None
+    assert mMove.mock_calls == [mocker.call(source, os.path.join(destinationDir, name)) for _, source, name in engine.files]
+
+@pytest.mark.parametrize("rate, speedup", [
+    (None, None),
+    (1, 2),
+    (0, None),
+], ids = ["Neither", "Both", "Zero rate"])
+def testReplayEngineInvalidSettings(loggingMixin, rate, speedup):
+    """ Test that exactly one valid rate must be specified. """
+    with pytest.raises(ValueError):
+        replay.replayEngine(baseDir = "", destinationDir = "", rate = rate, speedup = speedup)
+
+def testRunReplayEngines(loggingMixin, mocker):
+    """ Test replaying several runs concurrently. """
+    mMove = mocker.patch("overwatch.base.replay.shutil.move")
+    setupRetrieveHLTModeMock(hltMode = "C", mocker = mocker)
+    fileLocation = os.path.dirname(os.path.realpath(__file__))
+    engines = [replay.replayEngine(baseDir = os.path.join(fileLocation, baseDir),
+                                   destinationDir = os.path.join(fileLocation, "destinationDir"),
+                                   rate = 1000) for baseDir in ["replayData", "replayUnprocessedData"]]
+
+    nMoved = replay.runReplayEngines(engines = engines, exitEvent = threading.Event())
+
+    assert nMoved == 20
+    assert mMove.call_count == 20
+    assert all(engine.finished for engine in engines)
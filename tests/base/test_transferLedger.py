@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+""" Tests for the transfer ledger.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest
+
+import logging
+logger = logging.getLogger(__name__)
+
+from overwatch.base import transferLedger
+
+@pytest.fixture
+def ledger(tmpdir):
+    """ Create a ledger in a temporary directory. """
+    return transferLedger.transferLedger(filename = str(tmpdir.join("ledger", "transferLedger.sqlite")),
+                                         retryDelay = 10, maxRetryDelay = 30)
+
+@pytest.mark.parametrize("attempts, expectedDelay", [
+    (1, 10),
+    (2, 20),
+    (3, 30),
+    (10, 30),
+], ids = ["First attempt", "Second attempt", "Maximum delay", "Many attempts"])
+def testRetryDelay(ledger, attempts, expectedDelay):
+    """ Test the exponential backoff of the retries. """
+    assert ledger.retryDelayAfter(attempts) == expectedDelay
+
+def testRecordFailures(loggingMixin, ledger):
+    """ Test recording failures and determining which files to retry. """
+    ledger.recordFailed("EOS", ["a.root", "b.root"], now = 100)
+    ledger.recordFailed("site1", ["a.root"], now = 105)
+
+    assert ledger.failedFiles("EOS") == ["a.root", "b.root"]
+    assert ledger.filesToRetry(now = 105) == {}
+    assert ledger.filesToRetry(now = 110) == {"EOS": ["a.root", "b.root"]}
+    assert ledger.filesToRetry(now = 115) == {"EOS": ["a.root", "b.root"], "site1": ["a.root"]}
+
+    # Fail again, so the delay increases.
+    ledger.recordFailed("EOS", ["a.root"], now = 110)
+    assert ledger.filesToRetry(now = 125) == {"EOS": ["b.root"], "site1": ["a.root"]}
+    assert ledger.filesToRetry(now = 130) == {"EOS": ["a.root", "b.root"], "site1": ["a.root"]}
+
+    assert ledger.backlogSummary(now = 200) == {
+        "EOS": {"files": 2, "oldestAge": 100, "maxAttempts": 2},
+        "site1": {"files": 1, "oldestAge": 95, "maxAttempts": 1},
+    }
+
+def testRecordTransferred(loggingMixin, ledger):
+    """ Test that transferred files leave the backlog and are eventually pruned. """
+    ledger.recordFailed("EOS", ["a.root", "b.root"], now = 100)
+    ledger.recordTransferred("EOS", ["a.root"], now = 120)
+    ledger.recordTransferred("site1", ["a.root"], now = 130)
+
+    assert ledger.failedFiles("EOS") == ["b.root"]
+    assert ledger.backlogSummary(now = 200) == {"EOS": {"files": 1, "oldestAge": 100, "maxAttempts": 1}}
+    # A later failure starts a new backoff.
+    ledger.recordFailed("EOS", ["a.root"], now = 140)
+    assert ledger.filesToRetry(now = 150) == {"EOS": ["a.root", "b.root"]}
+
+    assert ledger.prune(olderThan = 135) == 1
+    ledger.remove("EOS", ["b.root"])
+    assert ledger.failedFiles("EOS") == ["a.root"]
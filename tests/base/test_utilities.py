@@ -9,6 +9,7 @@ As of Oct 2018, It is not comprehensive, but should be continually improved as t
 
 import pytest
 
+import hashlib
 import logging
 import os
 logger = logging.getLogger(__name__)
@@ -86,3 +87,106 @@ def testWriteRunInfoToFile(loggingMixin, fileExists, hltMode, mocker):
         mOpen.assert_not_called()
         mConfig.assert_not_called()
 
+@pytest.mark.parametrize("databaseLocation, supportsReadOnly", [
+    ("file://data/overwatch.fs", True),
+    ("zeo://127.0.0.1:2345", True),
+    ("memory://", False),
+], ids = ["File storage", "ZEO storage", "Memory storage"])
+@pytest.mark.parametrize("readOnly", [
+    False,
+    True,
+], ids = ["Read-write", "Read-only"])
+def testResolveDatabaseLocation(loggingMixin, databaseLocation, supportsReadOnly, readOnly, mocker):
+    """ Tests for resolving the database location, including read-only access and pool settings. """
+    mResolve = mocker.MagicMock(return_value = ("factory", {"cache_size": 10000, "pool_size": 7}))
+    mocker.patch("overwatch.base.utilities.zodburi.resolve_uri", mResolve)
+
+    if readOnly and not supportsReadOnly:
+        with pytest.raises(ValueError) as exceptionInfo:
+            utilities.resolveDatabaseLocation(databaseLocation, readOnly = readOnly)
+        assert databaseLocation in exceptionInfo.value.args[0]
+        return
+
+    storageFactory, dbArgs = utilities.resolveDatabaseLocation(databaseLocation, readOnly = readOnly,
+                                                               cacheSize = 500, poolSize = 3)
+
+    expectedLocation = databaseLocation + "?read_only=1" if readOnly else databaseLocation
+    mResolve.assert_called_once_with(expectedLocation)
+    assert storageFactory == "factory"
+    assert dbArgs == {"cache_size": 500, "pool_size": 3}
+
+@pytest.fixture
+def sharedDatabases(loggingMixin):
+    """ Ensure that each test starts and finishes without any shared databases. """
+    utilities.closeDatabases()
+    yield
+    utilities.closeDatabases()
+
+def testGetDBConnectionPool(sharedDatabases):
+    """ Test that connections are drawn from a single shared database. """
+    (dbRoot, connection) = utilities.getDB("memory://", cacheSize = 100, poolSize = 2)
+    db = connection.db()
+    assert db.getCacheSize() == 100
+    assert db.getPoolSize() == 2
+    connection.close()
+
+    # Retrieving the database again should reuse the same database (and it's pool), while
+    # updating the settings.
+    (dbRoot, connection) = utilities.getDB("memory://", cacheSize = 200)
+    assert connection.db() is db
+    assert db.getCacheSize() == 200
+    assert db.getPoolSize() == 2
+    connection.close()
+
+def testWriteConnection(sharedDatabases):
+    """ Test that changes via the write connection are committed independently of other connections. """
+    (dbRoot, connection) = utilities.getDB("memory://")
+
+    with utilities.writeConnection("memory://") as writeRoot:
+        writeRoot["value"] = 1
+        # The changes aren't visible until they are committed.
+        assert "value" not in dbRoot
+    # The thread transaction doesn't include the write connection, so aborting it doesn't discard the changes.
+    utilities.transaction.abort()
+    assert dbRoot["value"] == 1
+
+    # Changes are discarded if there is an error.
+    with pytest.raises(ValueError):
+        with utilities.writeConnection("memory://") as writeRoot:
+            writeRoot["value"] = 2
+            raise ValueError("Test error")
+    utilities.transaction.abort()
+    assert dbRoot["value"] == 1
+    connection.close()
+
+@pytest.mark.parametrize("nConflicts, retries", [
+    (0, 2),
+    (2, 2),
+    (3, 2),
+], ids = ["No conflicts", "Conflicts resolved by retries", "Too many conflicts"])
+def testRetryOnConflict(loggingMixin, nConflicts, retries, mocker):
+    """ Test retrying a commit when there are database conflicts. """
+    mCommit = mocker.MagicMock(side_effect = [utilities.ZODB.POSException.ConflictError()] * nConflicts + [None])
+    mocker.patch("overwatch.base.utilities.transaction.commit", mCommit)
+    mAbort = mocker.MagicMock()
+    mocker.patch("overwatch.base.utilities.transaction.abort", mAbort)
+    func = mocker.MagicMock(return_value = "returnValue")
+
+    if nConflicts > retries:
+        with pytest.raises(utilities.ZODB.POSException.ConflictError):
+            utilities.retryOnConflict(func, retries, "arg", kwarg = "kwarg")
+        expectedCalls = retries + 1
+    else:
+        assert utilities.retryOnConflict(func, retries, "arg", kwarg = "kwarg") == "returnValue"
+        expectedCalls = nConflicts + 1
+
+    assert func.call_count == expectedCalls
+    func.assert_called_with("arg", kwarg = "kwarg")
+    assert mAbort.call_count == min(nConflicts, retries + 1)
+
+def testHashFile(loggingMixin, tmpdir):
+    """ Test hashing the content of a file. """
+    filename = tmpdir.join("test.json")
+    filename.write("a" * 100)
+    # Use a small block size to ensure that the file is read in multiple blocks.
+    assert utilities.hashFile(str(filename), blockSize = 16) == hashlib.sha1(b"a" * 100).hexdigest()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+""" Tests for extracting histograms from ROOT files.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest
+
+import logging
+import numpy as np
+logger = logging.getLogger(__name__)
+
+import ROOT
+
+from overwatch.processing import histogramExtraction
+
+@pytest.fixture
+def rootFile(loggingMixin, tmpdir):
+    """ Create a ROOT file containing a few histograms.
+
+    Args:
+        None.
+    Returns:
+        str: Path to the ROOT file.
+    """
+    filename = str(tmpdir.join("EMChists.2015_11_24_18_05_10.root"))
+    fOut = ROOT.TFile(filename, "RECREATE")
+    hist1D = ROOT.TH1F("EMCTRQA_histFastORL0", "EMCTRQA_histFastORL0", 4, 0, 4)
+    hist1D.Fill(1.5, 3)
+    hist2D = ROOT.TH2F("EMCTRQA_histFastORL0Amp", "EMCTRQA_histFastORL0Amp", 2, 0, 2, 3, 0, 3)
+    hist2D.Fill(0.5, 2.5)
+    other = ROOT.TH1F("otherHist", "otherHist", 2, 0, 1)
+    for hist in [hist1D, hist2D, other]:
+        hist.Write()
+    fOut.Close()
+
+    yield filename
+
+@pytest.mark.parametrize("names, pattern, expected", [
+    (None, None, ["EMCTRQA_histFastORL0", "EMCTRQA_histFastORL0Amp", "otherHist"]),
+    (["otherHist", "missingHist"], None, ["otherHist"]),
+    (None, "^EMCTRQA", ["EMCTRQA_histFastORL0", "EMCTRQA_histFastORL0Amp"]),
+    (["otherHist"], "Amp$", ["EMCTRQA_histFastORL0Amp", "otherHist"]),
+], ids = ["All", "Names", "Pattern", "Names and pattern"])
+def testSelectHistogramNames(loggingMixin, names, pattern, expected):
+    """ Test selecting histograms by name and pattern. """
+    availableNames = ["EMCTRQA_histFastORL0", "EMCTRQA_histFastORL0Amp", "otherHist"]
+    assert histogramExtraction.selectHistogramNames(availableNames, names = names, pattern = pattern) == expected
+
+def testExtractHistograms(rootFile, mocker):
+    """ Test extracting histograms as arrays, as well as caching the extracted histograms. """
+    cache = histogramExtraction.histogramCache(cacheSize = 10)
+    histograms = histogramExtraction.extractHistograms(rootFile, pattern = "^EMCTRQA", cache = cache)
+
+    assert list(histograms) == ["EMCTRQA_histFastORL0", "EMCTRQA_histFastORL0Amp"]
+    hist1D = histograms["EMCTRQA_histFastORL0"]
+    # Including underflow and overflow
+    assert hist1D["contents"].tolist() == [0, 0, 3, 0, 0, 0]
+    assert hist1D["edgesX"].tolist() == [0, 1, 2, 3, 4]
+    hist2D = histograms["EMCTRQA_histFastORL0Amp"]
+    assert hist2D["contents"].shape == (4, 5)
+    # Indexed by the ROOT bin numbers.
+    assert hist2D["contents"][1, 3] == 1
+    assert hist2D["edgesY"].tolist() == [0, 1, 2, 3]
+
+    # Requesting cached histograms by name doesn't open the file.
+    mOpen = mocker.patch("overwatch.processing.histogramExtraction.ROOT.TFile.Open")
+    cached = histogramExtraction.extractHistograms(rootFile, names = ["EMCTRQA_histFastORL0"], cache = cache)
+    assert cached["EMCTRQA_histFastORL0"] is hist1D
+    mOpen.assert_not_called()
+
+def testExtractHistogramsLimits(rootFile):
+    """ Test limiting the number of extracted histograms, as well as requesting a file which doesn't exist. """
+    with pytest.raises(ValueError):
+        histogramExtraction.extractHistograms(rootFile, pattern = "^EMCTRQA", maxHistograms = 1)
+    assert len(histogramExtraction.extractHistograms(rootFile, pattern = "^EMCTRQA", maxHistograms = 2)) == 2
+
+    with pytest.raises(IOError):
+        histogramExtraction.extractHistograms(rootFile.replace(".root", ".missing.root"))
+
+def testHistogramToArraysErrors(rootFile):
+    """ Test that the errors are determined from the sum of the squares of the weights when it is available. """
+    hist = ROOT.TH1D("weighted", "weighted", 2, 0, 2)
+    hist.Sumw2()
+    hist.Fill(0.5, 3)
+    hist.Fill(0.5, 4)
+    unweighted = ROOT.TH1F("unweighted", "unweighted", 2, 0, 2)
+    unweighted.SetBinContent(1, 4)
+
+    assert histogramExtraction.histogramToArrays(hist)["errors"].tolist() == [0, 5, 0, 0]
+    assert histogramExtraction.histogramToArrays(unweighted)["errors"].tolist() == [0, 2, 0, 0]
+
+def testWriteNpz(rootFile):
+    """ Test writing the extracted histograms of multiple runs to a ``numpy`` archive. """
+    histograms = histogramExtraction.extractHistograms(rootFile, names = ["otherHist"])
+    npzFile = histogramExtraction.writeNpz({"Run123": histograms, "Run124": histograms})
+
+    arrays = np.load(npzFile)
+    assert sorted(arrays.files) == sorted("{run}/otherHist/{name}".format(run = run, name = name)
+                                          for run in ["Run123", "Run124"] for name in ["contents", "errors", "edgesX"])
+    assert arrays["Run124/otherHist/edgesX"].tolist() == [0, 0.5, 1]
+
+def testHistogramCache(loggingMixin):
+    """ Test that the least recently used histograms are removed from the cache. """
+    cache = histogramExtraction.histogramCache(cacheSize = 2)
+    cache.store("a", 1)
+    cache.store("b", 2)
+    assert cache.get("a") == 1
+    cache.store("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
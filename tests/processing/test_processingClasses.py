@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+""" Tests for the processing classes.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest
+
+from BTrees.OOBTree import OOBTree
+import logging
+logger = logging.getLogger(__name__)
+
+from overwatch.processing import processingClasses
+
+def exampleFunction(subsystem, hist, processingOptions):
+    """ Processing function which is only used for testing. """
+    pass
+
+@pytest.fixture
+def createSubsystem(loggingMixin, mocker):
+    """ Create subsystems with configured histograms.
+
+    Args:
+        None.
+    Returns:
+        function: Creates a subsystem for the given run.
+    """
+    # Ensure that processing classes doesn't actually create any files or folders...
+    mocker.patch("overwatch.processing.processingClasses.os.makedirs")
+    mocker.patch("overwatch.processing.processingClasses.os.path.exists")
+
+    def create(runDir, drawOptions = "colz"):
+        subsystem = processingClasses.subsystemContainer(subsystem = "EMC", runDir = runDir,
+                                                         startOfRun = 1448384710, endOfRun = 1448388552,
+                                                         showRootFiles = True, fileLocationSubsystem = "EMC")
+        for histName in ["hist1", "hist2"]:
+            hist = processingClasses.histogramContainer(histName = histName, histList = [histName])
+            hist.drawOptions = drawOptions
+            hist.functionsToApply.append(exampleFunction)
+            subsystem.histsInFile[histName] = hist
+            subsystem.hists[histName] = hist
+        return subsystem
+
+    return create
+
+def testHistogramTemplateAttributes(loggingMixin):
+    """ Test that the histogram configuration is stored in and retrieved from the template. """
+    hist = processingClasses.histogramContainer(histName = "hist1", histList = ["hist1", "hist2"])
+
+    assert hist.prettyName == "hist1"
+    assert hist.template.histList == ["hist1", "hist2"]
+    hist.prettyName = "Hist 1"
+    hist.drawOptions += "colz"
+    assert hist.template.prettyName == "Hist 1"
+    assert hist.template.drawOptions == "colz"
+    assert "prettyName" not in hist.__dict__
+
+def testHistogramContainerMigration(loggingMixin):
+    """ Test that histogram containers stored before templates were introduced are migrated. """
+    oldState = {
+        "histName": "hist1", "prettyName": "Hist 1", "histList": None, "information": {},
+        "hist": None, "histType": None, "canvas": None, "drawOptions": "colz",
+        "projectionFunctionsToApply": [], "functionsToApply": [exampleFunction], "trendingObjects": [],
+    }
+    hist = processingClasses.histogramContainer.__new__(processingClasses.histogramContainer)
+    hist.__setstate__(oldState)
+
+    assert hist.histName == "hist1"
+    assert hist.prettyName == "Hist 1"
+    assert hist.drawOptions == "colz"
+    assert list(hist.functionsToApply) == [exampleFunction]
+    assert isinstance(hist.template, processingClasses.histogramTemplate)
+
+def testShareHistogramTemplates(createSubsystem):
+    """ Test that identically configured subsystems share templates, while others receive a new version. """
+    templates = OOBTree()
+    first = createSubsystem("Run123")
+    second = createSubsystem("Run124")
+    modified = createSubsystem("Run125", drawOptions = "surf")
+
+    firstVersion = processingClasses.shareHistogramTemplates(first, templates)
+    secondVersion = processingClasses.shareHistogramTemplates(second, templates)
+    modifiedVersion = processingClasses.shareHistogramTemplates(modified, templates)
+
+    assert firstVersion == secondVersion
+    assert first.templateVersion == firstVersion
+    for histName in ["hist1", "hist2"]:
+        assert second.hists[histName].template is first.hists[histName].template
+        assert second.histsInFile[histName].template is second.hists[histName].template
+    assert modifiedVersion != firstVersion
+    assert modified.hists["hist1"].template is not first.hists["hist1"].template
+    assert modified.hists["hist1"].drawOptions == "surf"
+    assert len(templates) == 2
+
+@pytest.fixture
+def subsystemWithFiles(createSubsystem):
+    """ Create a subsystem which contains files at one minute intervals.
+
+    Args:
+        None.
+    Returns:
+        subsystemContainer: Subsystem which contains the files.
+    """
+    subsystem = createSubsystem("Run123")
+    for minute in range(5):
+        filename = "Run123/EMC/EMChists.2015_11_24_18_{minute:02d}_10.root".format(minute = 5 + minute)
+        fileCont = processingClasses.fileContainer(filename, startOfRun = subsystem.startOfRun)
+        subsystem.files[fileCont.fileTime] = fileCont
+    return subsystem
+
+@pytest.mark.parametrize("minTime, maxTime, expectedMinutes", [
+    (None, None, [5, 6, 7, 8, 9]),
+    (1448384710 + 60, 1448384710 + 180, [6, 7, 8]),
+    (1448384710 + 61, None, [7, 8, 9]),
+    (1448384710 + 1000, None, []),
+], ids = ["Full range", "Inclusive range", "Min only", "Empty"])
+def testFilesInTimeRange(subsystemWithFiles, minTime, maxTime, expectedMinutes):
+    """ Test retrieving the files within a time range. """
+    files = subsystemWithFiles.filesInTimeRange(minTime = minTime, maxTime = maxTime)
+    assert [fileCont.filename for fileCont in files] == ["Run123/EMC/EMChists.2015_11_24_18_{:02d}_10.root".format(minute) for minute in expectedMinutes]
+
+def testFilesInTimeRangeLimit(subsystemWithFiles):
+    """ Test limiting the number of files retrieved from a time range. """
+    files = subsystemWithFiles.filesInTimeRange(minTime = 1448384710 + 61, maxFiles = 2)
+    assert [fileCont.filename for fileCont in files] == ["Run123/EMC/EMChists.2015_11_24_18_{:02d}_10.root".format(minute) for minute in [7, 8]]
+
+@pytest.mark.parametrize("filename, expected", [
+    ("EMChists.2015_11_24_18_06_10.root", True),
+    ("Run123/EMC/EMChists.2015_11_24_18_06_10.root", True),
+    ("HLThists.2015_11_24_18_06_10.root", False),
+    ("EMChists.2015_11_24_19_06_10.root", False),
+    ("combined", False),
+], ids = ["Filename", "Filename with path", "Different name, same time", "Not available", "Invalid"])
+def testFileByFilename(subsystemWithFiles, filename, expected):
+    """ Test looking up a file by its filename. """
+    fileCont = subsystemWithFiles.fileByFilename(filename)
+    if expected:
+        assert fileCont.filename == "Run123/EMC/EMChists.2015_11_24_18_06_10.root"
+    else:
+        assert fileCont is None
+
+@pytest.fixture
+def createRuns(createSubsystem, mocker):
+    """ Create runs containing an EMC subsystem.
+
+    Args:
+        None.
+    Returns:
+        function: Creates runs with the given run numbers.
+    """
+    mocker.patch("overwatch.processing.processingClasses.utilities.writeRunInfoToFile")
+
+    def create(runNumbers):
+        runs = OOBTree()
+        for runNumber in runNumbers:
+            runDir = "Run{}".format(runNumber)
+            run = processingClasses.runContainer(runDir = runDir, fileMode = True, hltMode = "C")
+            run.subsystems["EMC"] = createSubsystem(runDir)
+            runs[runDir] = run
+        return runs
+
+    return create
+
+@pytest.fixture
+def runIndex(createRuns):
+    """ Create a run list index containing runs 100-109.
+
+    Args:
+        None.
+    Returns:
+        runListIndex: The index.
+    """
+    return processingClasses.runListIndex.fromRuns(createRuns(range(100, 110)))
+
+def testRunListIndexAddRun(runIndex):
+    """ Test maintaining the number of runs in the run list index. """
+    assert len(runIndex) == 10
+    runIndex.addRun("Run95")
+    runIndex.addRun("Run95")
+    assert len(runIndex) == 11
+    assert runIndex.olderRuns(runNumber = 99) == ["Run95"]
+
+def testRunListIndexRemoveRun(runIndex):
+    """ Test removing runs from the run list index. """
+    assert runIndex.removeRun("Run105") is True
+    assert runIndex.removeRun("Run105") is False
+    assert len(runIndex) == 9
+    assert 105 not in runIndex.summaries
+    assert runIndex.olderRuns(runNumber = 106, numberOfRuns = 2) == ["Run106", "Run104"]
+
+@pytest.mark.parametrize("runNumber, inclusive, expectedRunNumbers", [
+    (None, True, [109, 108, 107]),
+    (105, True, [105, 104, 103]),
+    (105, False, [104, 103, 102]),
+    (101, True, [101, 100]),
+    (200, True, [109, 108, 107]),
+    (100, False, []),
+], ids = ["Most recent", "Inclusive", "Exclusive", "Oldest runs", "After the most recent", "No older runs"])
+def testRunListIndexOlderRuns(runIndex, runNumber, inclusive, expectedRunNumbers):
+    """ Test selecting pages of older runs. """
+    runDirs = runIndex.olderRuns(runNumber = runNumber, numberOfRuns = 3, inclusive = inclusive)
+    assert runDirs == ["Run{}".format(runNumber) for runNumber in expectedRunNumbers]
+
+@pytest.mark.parametrize("runNumber, expectedRunNumbers", [
+    (100, [103, 102, 101]),
+    (107, [109, 108]),
+    (109, []),
+], ids = ["Full page", "Partial page", "Most recent"])
+def testRunListIndexNewerRuns(runIndex, runNumber, expectedRunNumbers):
+    """ Test selecting pages of newer runs. """
+    runDirs = runIndex.newerRuns(runNumber = runNumber, numberOfRuns = 3)
+    assert runDirs == ["Run{}".format(runNumber) for runNumber in expectedRunNumbers]
+
+def testRunSummary(createRuns):
+    """ Test summarizing runs for the run list. """
+    runs = createRuns([123])
+    run = runs["Run123"]
+    fileCont = processingClasses.fileContainer("Run123/EMC/EMChists.2015_11_24_18_05_10.root", startOfRun = 1448384710)
+    run.subsystems["EMC"].files[fileCont.fileTime] = fileCont
+
+    summary = processingClasses.runSummary.fromRun(run)
+    assert summary.runDir == "Run123"
+    assert summary.runNumber == 123
+    assert summary.prettyName == "Run 123"
+    assert summary.subsystems == ("EMC",)
+    assert summary.mostRecentFileTime == fileCont.fileTime
+    assert summary.startOfRunTimeStamp() == run.startOfRunTimeStamp()
+    # The subsystem is new, so it is flagged as having a new file.
+    assert summary.isRunOngoing() is True
+
+    run.subsystems["EMC"].newFile = False
+    summary = processingClasses.runSummary.fromRun(run)
+    assert summary.isRunOngoing() is False
+    assert summary.isRunOngoing() == run.isRunOngoing()
+
+def testRunListIndexSummaries(createRuns):
+    """ Test storing and retrieving run summaries in the run list index. """
+    runs = createRuns([123, 124])
+    runIndex = processingClasses.runListIndex.fromRuns(runs)
+    summaries = runIndex.retrieveSummaries(["Run124", "Run123"], runs)
+    assert [summary.runDir for summary in summaries] == ["Run124", "Run123"]
+    assert summaries[0].newFile is True
+
+    # The summary is only updated when it changes.
+    storedSummary = runIndex.summaries[123]
+    runIndex.updateSummary(runs["Run123"])
+    assert runIndex.summaries[123] is storedSummary
+    runs["Run123"].subsystems["EMC"].newFile = False
+    runIndex.updateSummary(runs["Run123"])
+    assert runIndex.retrieveSummaries(["Run123"], runs)[0].newFile is False
+
+    # Summaries which are not available are created from the run.
+    del runIndex.summaries[124]
+    assert runIndex.retrieveSummaries(["Run124"], runs) == [processingClasses.runSummary.fromRun(runs["Run124"])]
+
+@pytest.mark.parametrize("kwargs, expectedRunNumbers, expectedNextRun", [
+    ({"numberOfRuns": 3}, [109, 108, 107], 106),
+    ({"numberOfRuns": 2, "hltMode": "B"}, [108, 106], 105),
+    ({"minTime": 1107}, [109, 108, 107], None),
+    ({"maxTime": 1102}, [102, 101, 100], None),
+    ({"hasCombinedFile": True}, [105], None),
+    ({"hasCombinedFile": True, "subsystem": "EMC", "maxRunsToCheck": 4}, [], 105),
+    ({"runNumber": 105, "hasCombinedFile": True, "maxRunsToCheck": 4}, [105], 101),
+    ({"subsystem": "TPC"}, [], None),
+], ids = ["Page", "HLT mode", "Min time", "Max time", "Combined file", "Check limit", "Continue from run", "Subsystem"])
+def testRunListIndexSelectRuns(createRuns, kwargs, expectedRunNumbers, expectedNextRun):
+    """ Test selecting runs via the summaries stored in the run list index. """
+    runs = createRuns(range(100, 110))
+    for runDir, run in runs.items():
+        run.hltMode = "B" if run.runNumber % 2 == 0 else "C"
+        run.subsystems["EMC"].startOfRun = 1000 + run.runNumber
+    runs["Run105"].subsystems["EMC"].combinedFile = processingClasses.fileContainer("Run105/EMC/hists.combined.1.1448388552.root", startOfRun = 1105)
+    runIndex = processingClasses.runListIndex.fromRuns(runs)
+
+    (summaries, nextRun) = runIndex.selectRuns(runs, **kwargs)
+    assert [summary.runNumber for summary in summaries] == expectedRunNumbers
+    assert nextRun == expectedNextRun
+
+def testRunSummaryMigration(createRuns):
+    """ Test that summaries stored before the HLT mode and combined files were recorded can be retrieved. """
+    runs = createRuns([123])
+    runIndex = processingClasses.runListIndex.fromRuns(runs)
+    runIndex.summaries[123] = runIndex.summaries[123][:6]
+
+    summary = runIndex.retrieveSummaries(["Run123"], runs)[0]
+    assert summary.hltMode is None
+    assert summary.combinedFileSubsystems == ()
+    assert runIndex.outdatedSummaries() == ["Run123"]
+    runIndex.updateSummary(runs["Run123"])
+    assert runIndex.retrieveSummaries(["Run123"], runs)[0].hltMode == "C"
+    assert runIndex.outdatedSummaries() == []
+
+def testRecordOutputHash(createSubsystem):
+    """ Test recording the hashes of the output files. """
+    subsystem = createSubsystem("Run123")
+    filename = "Run123/EMC/img/hist1.png"
+    assert subsystem.outputHash(filename) is None
+
+    subsystem.recordOutputHash(filename = filename, fileHash = "abcd")
+    assert subsystem.outputHash(filename) == "abcd"
+    subsystem.recordOutputHash(filename = filename, fileHash = "efgh")
+    assert subsystem.outputHash(filename) == "efgh"
+
+    # The hashes are cleared when the subsystem is reset for reprocessing.
+    subsystem.resetContainer()
+    assert subsystem.outputHash(filename) is None
+
+def testOutputChangesSince(createSubsystem):
+    """ Test determining which output files have changed since a given output version. """
+    subsystem = createSubsystem("Run123")
+    subsystem.newOutputVersion()
+    subsystem.recordOutputHash(filename = "hist1.json", fileHash = "a")
+    subsystem.recordOutputHash(filename = "hist2.json", fileHash = "b")
+    assert subsystem.outputVersion == 1
+
+    subsystem.newOutputVersion()
+    subsystem.recordOutputHash(filename = "hist1.json", fileHash = "a")
+    subsystem.recordOutputHash(filename = "hist2.json", fileHash = "c")
+
+    # Up to date.
+    assert subsystem.outputChangesSince(2) == {}
+    # Previous version, so only the changed file.
+    assert subsystem.outputChangesSince(1) == {"hist2.json": "c"}
+    # Older versions require all of the files.
+    assert subsystem.outputChangesSince(0) == {"hist1.json": "a", "hist2.json": "c"}
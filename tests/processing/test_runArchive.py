@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+""" Tests for archiving runs outside of the database.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest
+
+from BTrees.OOBTree import OOBTree
+import logging
+import os
+import ZODB
+import transaction
+logger = logging.getLogger(__name__)
+
+from overwatch.processing import processingClasses
+from overwatch.processing import runArchive
+
+@pytest.fixture
+def setupRuns(loggingMixin, mocker):
+    """ Setup runs stored in a database for testing the archive.
+
+    Args:
+        None.
+    Returns:
+        tuple: (runs, runDirs) where runs (BTree) is stored in the database, and runDirs (list) are the
+            names of the runs, ordered from oldest to newest.
+    """
+    # Ensure that processing classes doesn't actually create any files or folders...
+    mocker.patch("overwatch.processing.processingClasses.os.makedirs")
+    mocker.patch("overwatch.processing.processingClasses.os.path.exists")
+    mocker.patch("overwatch.processing.processingClasses.utilities.writeRunInfoToFile")
+
+    db = ZODB.DB(None)
+    connection = db.open()
+    dbRoot = connection.root()
+    dbRoot["runs"] = OOBTree()
+    runs = dbRoot["runs"]
+
+    runDirs = ["Run123", "Run124"]
+    for runDir in runDirs:
+        run = processingClasses.runContainer(runDir = runDir, fileMode = True, hltMode = "C")
+        run.subsystems["EMC"] = processingClasses.subsystemContainer(subsystem = "EMC", runDir = runDir,
+                                                                     startOfRun = 1448384710, endOfRun = 1448388552,
+                                                                     showRootFiles = True, fileLocationSubsystem = "EMC")
+        # As if the run has already been processed.
+        run.subsystems["EMC"].newFile = False
+        for filename in ["EMChists.2015_11_24_18_05_10.root", "EMChists.2015_11_24_19_09_12.root"]:
+            fileCont = processingClasses.fileContainer(os.path.join(runDir, "EMC", filename), startOfRun = 1448384710)
+            run.subsystems["EMC"].files[fileCont.fileTime] = fileCont
+        runs[runDir] = run
+    transaction.commit()
+
+    yield runs, runDirs
+
+    transaction.abort()
+    connection.close()
+    db.close()
+
+def testArchiveAndRetrieveRun(setupRuns, tmpdir):
+    """ Test archiving a run and then retrieving it from the archive. """
+    runs, runDirs = setupRuns
+    runDir = runDirs[0]
+    archiveFilename = runArchive.archiveRun(runs = runs, runDir = runDir, archiveDirectory = str(tmpdir))
+    transaction.commit()
+
+    # Check the placeholder
+    archivedRun = runs[runDir]
+    assert runArchive.isArchived(archivedRun)
+    assert archivedRun.archiveFilename == archiveFilename
+    assert os.path.exists(archiveFilename)
+    assert archivedRun.prettyName == "Run 123"
+    assert list(archivedRun.subsystems) == ["EMC"]
+    assert archivedRun.subsystems["EMC"].subsystem == "EMC"
+    assert archivedRun.isRunOngoing() is False
+    assert archivedRun.startOfRunTimeStamp() == processingClasses.subsystemContainer.prettyPrintUnixTime(1448384710)
+
+    # Retrieve the full run.
+    run = runArchive.retrieveRun(runs, runDir)
+    assert isinstance(run, processingClasses.runContainer)
+    assert run.runDir == runDir
+    assert len(run.subsystems["EMC"].files) == 2
+    assert run.subsystems["EMC"].files.keys()[-1] == archivedRun.mostRecentFileTime
+    # It should be cached.
+    assert runArchive.retrieveRun(runs, runDir) is run
+
+    # Runs which are not archived are returned directly.
+    assert runArchive.retrieveRun(runs, runDirs[1]) is runs[runDirs[1]]
+
+    # Restore the run into the database.
+    restoredRun = runArchive.restoreRun(runs, runDir)
+    transaction.commit()
+    assert runArchive.isArchived(runs[runDir]) is False
+    assert restoredRun._p_jar is not None
+    assert len(runs[runDir].subsystems["EMC"].files) == 2
+
+def testRestoreRunSharesTemplates(setupRuns, tmpdir):
+    """ Test that a restored run uses the shared histogram templates rather than the copies in the archive. """
+    runs, runDirs = setupRuns
+    runDir = runDirs[0]
+    templates = OOBTree()
+    templates["EMC"] = OOBTree()
+    subsystem = runs[runDir].subsystems["EMC"]
+    hist = processingClasses.histogramContainer(histName = "hist1", histList = ["hist1"])
+    subsystem.histsInFile["hist1"] = hist
+    subsystem.hists["hist1"] = hist
+    version = processingClasses.shareHistogramTemplates(subsystem, templates["EMC"])
+    transaction.commit()
+
+    runArchive.archiveRun(runs = runs, runDir = runDir, archiveDirectory = str(tmpdir))
+    transaction.commit()
+    restoredRun = runArchive.restoreRun(runs, runDir, histogramTemplates = templates)
+
+    restoredSubsystem = restoredRun.subsystems["EMC"]
+    assert restoredSubsystem.templateVersion == version
+    assert restoredSubsystem.hists["hist1"].template is templates["EMC"][version]["hist1"]
+    assert restoredSubsystem.histsInFile["hist1"].template is templates["EMC"][version]["hist1"]
+    assert len(templates["EMC"]) == 1
+
+def testRetrieveUnavailableArchivedRun(setupRuns, tmpdir):
+    """ Test retrieving an archived run when the archive is no longer available. """
+    runs, runDirs = setupRuns
+    runDir = runDirs[0]
+    archiveFilename = runArchive.archiveRun(runs = runs, runDir = runDir, archiveDirectory = str(tmpdir))
+    transaction.commit()
+    os.remove(archiveFilename)
+
+    with pytest.raises(runArchive.RunDataUnavailable) as exceptionInfo:
+        runArchive.retrieveRun(runs, runDir)
+    assert exceptionInfo.value.runDir == runDir
+    assert exceptionInfo.value.archiveFilename == archiveFilename
+    assert "Run data unavailable" in str(exceptionInfo.value)
+
+@pytest.mark.parametrize("archiveAfterDays, expectedArchivedRuns", [
+    (1, ["Run123"]),
+    (1e6, []),
+], ids = ["Old runs", "Recent runs"])
+def testArchiveFinishedRuns(setupRuns, archiveAfterDays, expectedArchivedRuns, tmpdir):
+    """ Test selecting which runs to archive. The most recent run should never be archived. """
+    runs, runDirs = setupRuns
+    archivedRuns = runArchive.archiveFinishedRuns(runs = runs, archiveDirectory = str(tmpdir), archiveAfterDays = archiveAfterDays)
+
+    assert archivedRuns == expectedArchivedRuns
+    for runDir in runDirs:
+        assert runArchive.isArchived(runs[runDir]) is (runDir in expectedArchivedRuns)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+""" Tests for creating archives of testing data.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest
+
+from BTrees.OOBTree import OOBTree
+import io
+import logging
+import os
+import zipfile
+logger = logging.getLogger(__name__)
+
+from overwatch.processing import processingClasses
+from overwatch.processing import testingDataArchive
+
+@pytest.fixture
+def setupRuns(loggingMixin, mocker, tmpdir):
+    """ Setup runs with files stored on disk for testing the archive.
+
+    Args:
+        None.
+    Returns:
+        tuple: (runs, runIndex, dirPrefix) where runs (BTree) contains the runs, runIndex (runListIndex) is the index
+            of the runs, and dirPrefix (str) is the data directory where the files are stored.
+    """
+    # Ensure that processing classes doesn't actually create any folders...
+    mocker.patch("overwatch.processing.processingClasses.os.makedirs")
+    mocker.patch("overwatch.processing.processingClasses.utilities.writeRunInfoToFile")
+
+    dirPrefix = str(tmpdir.mkdir("data"))
+    runs = OOBTree()
+    # Run125 only has data for one of the subsystems, so it should be skipped by default.
+    for runDir, subsystems in [("Run123", ["EMC", "TPC"]), ("Run124", ["EMC", "TPC"]), ("Run125", ["EMC"])]:
+        run = processingClasses.runContainer(runDir = runDir, fileMode = True, hltMode = "C")
+        for subsystemName in subsystems:
+            subsystem = processingClasses.subsystemContainer(subsystem = subsystemName, runDir = runDir,
+                                                             startOfRun = 1448384710, endOfRun = 1448388552,
+                                                             showRootFiles = True, fileLocationSubsystem = subsystemName)
+            for minute in range(6):
+                filename = os.path.join(runDir, subsystemName, "{subsystem}hists.2015_11_24_18_{minute:02}_10.root".format(subsystem = subsystemName, minute = minute))
+                fileCont = processingClasses.fileContainer(filename, startOfRun = 1448384710)
+                subsystem.files[fileCont.fileTime] = fileCont
+            subsystem.combinedFile = processingClasses.fileContainer(os.path.join(runDir, subsystemName, "hists.combined.6.1448388552.root"), startOfRun = 1448384710)
+            run.subsystems[subsystemName] = subsystem
+            # Create the files on disk. ``os.makedirs`` is mocked, so we create the directories via ``tmpdir``.
+            tmpdir.join("data", runDir, subsystemName).ensure(dir = True)
+            for fileCont in list(subsystem.files.values()) + [subsystem.combinedFile]:
+                with open(os.path.join(dirPrefix, fileCont.filename), "w") as f:
+                    f.write(fileCont.filename)
+        runs[runDir] = run
+
+    yield runs, processingClasses.runListIndex.fromRuns(runs), dirPrefix
+
+def addNewFile(runs, dirPrefix):
+    """ Add a new file to the most recent EMC subsystem, which changes the files selected for the archive. """
+    subsystem = runs["Run124"].subsystems["EMC"]
+    fileCont = processingClasses.fileContainer("Run124/EMC/EMChists.2015_11_24_18_06_10.root", startOfRun = 1448384710)
+    subsystem.files[fileCont.fileTime] = fileCont
+    with open(os.path.join(dirPrefix, fileCont.filename), "w") as f:
+        f.write(fileCont.filename)
+
+def testSelectFiles(setupRuns):
+    """ Test selecting the files for the default and requested archives. """
+    runs, runIndex, dirPrefix = setupRuns
+
+    filenames = testingDataArchive.selectFiles(runs = runs, runIndex = runIndex, subsystemList = ["EMC", "TPC"])
+    # Combined, most recent, and 5th most recent file for each subsystem of the two complete runs.
+    assert len(filenames) == 12
+    assert not any(filename.startswith("Run125") for filename in filenames)
+    assert filenames[:3] == ["Run124/EMC/hists.combined.6.1448388552.root",
+                             "Run124/EMC/EMChists.2015_11_24_18_05_10.root",
+                             "Run124/EMC/EMChists.2015_11_24_18_01_10.root"]
+
+    # Limit the number of runs
+    filenames = testingDataArchive.selectFiles(runs = runs, runIndex = runIndex, subsystemList = ["EMC", "TPC"], numberOfRuns = 1)
+    assert len(filenames) == 6
+
+    # Requested runs and subsystems
+    filenames = testingDataArchive.selectFiles(runs = runs, runIndex = runIndex, subsystemList = ["EMC", "TPC"],
+                                               runDirs = ["Run125", "Run999"], subsystems = ["EMC"])
+    assert len(filenames) == 3
+    assert all(filename.startswith("Run125/EMC") for filename in filenames)
+
+def testCreateArchive(setupRuns):
+    """ Test that the archive is only recreated when the contents change. """
+    runs, runIndex, dirPrefix = setupRuns
+
+    zipFilename = testingDataArchive.createArchive(runs = runs, runIndex = runIndex, dirPrefix = dirPrefix, subsystemList = ["EMC", "TPC"])
+    assert zipFilename.startswith("testingDataArchive.")
+    with zipfile.ZipFile(os.path.join(dirPrefix, zipFilename)) as zipFile:
+        assert len(zipFile.namelist()) == 12
+        assert zipFile.read("data/Run124/EMC/hists.combined.6.1448388552.root") == b"Run124/EMC/hists.combined.6.1448388552.root"
+
+    # Nothing has changed, so the archive is reused.
+    assert testingDataArchive.createArchive(runs = runs, runIndex = runIndex, dirPrefix = dirPrefix, subsystemList = ["EMC", "TPC"]) == zipFilename
+
+    # Rewriting a file in place (as for the combined file of an ongoing run) means a new archive.
+    with open(os.path.join(dirPrefix, "Run124/EMC/hists.combined.6.1448388552.root"), "w") as f:
+        f.write("Updated combined file")
+    updatedZipFilename = testingDataArchive.createArchive(runs = runs, runIndex = runIndex, dirPrefix = dirPrefix, subsystemList = ["EMC", "TPC"])
+    assert updatedZipFilename != zipFilename
+    with zipfile.ZipFile(os.path.join(dirPrefix, updatedZipFilename)) as zipFile:
+        assert zipFile.read("data/Run124/EMC/hists.combined.6.1448388552.root") == b"Updated combined file"
+
+    # New data means a new archive, and the previous one is removed.
+    addNewFile(runs, dirPrefix)
+    newZipFilename = testingDataArchive.createArchive(runs = runs, runIndex = runIndex, dirPrefix = dirPrefix, subsystemList = ["EMC", "TPC"])
+    assert newZipFilename not in [zipFilename, updatedZipFilename]
+    assert os.path.exists(os.path.join(dirPrefix, newZipFilename))
+    assert not os.path.exists(os.path.join(dirPrefix, updatedZipFilename))
+
+def testCreateArchiveInBackground(setupRuns, mocker):
+    """ Test building the archive in a background thread. """
+    runs, runIndex, dirPrefix = setupRuns
+
+    zipFilename = testingDataArchive.createArchive(runs = runs, runIndex = runIndex, dirPrefix = dirPrefix,
+                                                   subsystemList = ["EMC", "TPC"], background = True)
+    testingDataArchive._buildThread.join()
+    with zipfile.ZipFile(os.path.join(dirPrefix, zipFilename)) as zipFile:
+        assert len(zipFile.namelist()) == 12
+
+    # Only one archive is built at a time.
+    addNewFile(runs, dirPrefix)
+    buildThread = mocker.MagicMock()
+    buildThread.is_alive.return_value = True
+    mocker.patch.object(testingDataArchive, "_buildThread", buildThread)
+    assert testingDataArchive.createArchive(runs = runs, runIndex = runIndex, dirPrefix = dirPrefix,
+                                            subsystemList = ["EMC", "TPC"], background = True) is None
+    assert testingDataArchive._buildThread is buildThread
+
+def testStreamArchive(setupRuns):
+    """ Test that the streamed archive contains the requested files. """
+    runs, runIndex, dirPrefix = setupRuns
+    filenames = testingDataArchive.selectFiles(runs = runs, runIndex = runIndex, subsystemList = ["EMC", "TPC"])
+
+    data = b"".join(testingDataArchive.streamArchive(filenames, dirPrefix, chunkSize = 8))
+    with zipfile.ZipFile(io.BytesIO(data)) as zipFile:
+        assert zipFile.testzip() is None
+        assert sorted(zipFile.namelist()) == sorted(os.path.join("data", filename) for filename in filenames)
+        for filename in filenames:
+            assert zipFile.read(os.path.join("data", filename)) == filename.encode()
@@ -14,11 +14,14 @@ from future.utils import iteritems
 import pytest
 import os
 import io
+import shutil
 import logging
 logger = logging.getLogger(__name__)
 
 from overwatch.receiver.dqmReceiver import app
 import overwatch.receiver.dqmReceiver as receiver
+from overwatch.receiver import fileIndex
+from overwatch.base import chunkedUpload
 
 @pytest.fixture
 def client(loggingMixin, mocker):
@@ -34,6 +37,8 @@ def client(loggingMixin, mocker):
 
     # Use local files in the receiver test directory.
     receiver.receiverParameters["dataFolder"] = os.path.join(os.path.dirname(os.path.realpath(__file__)), "testFiles")
+    receivedFiles = fileIndex.receivedFileIndex(directory = receiver.receiverParameters["dataFolder"], refreshInterval = 60)
+    mocker.patch.object(receiver, "receivedFiles", receivedFiles)
     # Grab the valid token dynamically
     validToken = receiver.receiverParameters["apiToken"]
 
@@ -73,6 +78,22 @@ def testGetFileListing(client):
 
     # This explicitly ignores the other file in the directory, as expected.
     assert rvDict["files"] == ["EMChistos_123456_DQM_1970_01_02_16_07_24.root"]
+    assert rvDict["next"] is None
+
+@pytest.mark.parametrize("queryString, expectedFiles, expectedStatusCode", [
+    ("runNumber=123456&amoreAgent=EMC", ["EMChistos_123456_DQM_1970_01_02_16_07_24.root"], 200),
+    ("runNumber=123457", [], 200),
+    ("minTime=140845", [], 200),
+    ("runNumber=abc", None, 400),
+], ids = ["Matching selection", "Other run", "Later time", "Invalid run number"])
+def testGetFileListingSelections(client, queryString, expectedFiles, expectedStatusCode):
+    """ Test selecting files in the file listing. """
+    client, validToken = client
+
+    rv = client.get("/rest/api/files?{queryString}".format(queryString = queryString), headers = {"token": validToken})
+
+    assert rv.status_code == expectedStatusCode
+    assert rv.get_json()["files"] == expectedFiles
 
 def testGetFile(client):
     """ Test retrieving a file. """
@@ -129,6 +150,8 @@ def sendPostRequest(client):
     # that the original file is intact!
     with open(os.path.join(basePath, filename), "wb") as f:
         f.write(fileText)
+    # Remove the directory where the uploads were received, as it isn't part of the test files.
+    shutil.rmtree(os.path.join(basePath, chunkedUpload.partialUploadsDirectory), ignore_errors = True)
 
 def testPostFile(sendPostRequest):
     """ Test sending a file via post. """
@@ -157,6 +180,12 @@ def testPostFile(sendPostRequest):
         comparisonText = f.read()
     assert comparisonText == fileText
 
+    # The objects are fully validated in the background, and the result is available via the file listing.
+    assert rvDict["validation"] == "pending"
+    receiver.validator.join()
+    rv = client.get("/rest/api/files", headers = {"token": validToken})
+    assert rv.get_json()["validation"][filename] == {"status": "valid", "received": {"test": "Obj name: test, Obj IsA() Name: TH1F"}}
+
 @pytest.mark.parametrize("data, expectedMessage, addToHeaders", [
     ({}, "No file uploaded and the payload was empty", {}),
     ({"file": (io.BytesIO(b"Hello world"), "file")}, "Successfully received the file, but the file is not valid! Perhaps it was corrupted?", {}),
@@ -185,3 +214,34 @@ def testPostFileErrors(sendPostRequest, data, expectedMessage, addToHeaders):
     assert rv.status_code == 400
     assert rvDict["message"] == expectedMessage
 
+
+def testPostFileInChunks(sendPostRequest):
+    """ Test sending a file in chunks, including resuming from the offset returned by the receiver. """
+    # Setup.
+    client, validToken, basePath, filename, fileText, _, headers = sendPostRequest
+    headers["uploadLength"] = len(fileText)
+    middle = len(fileText) // 2
+
+    # First chunk
+    headers["uploadOffset"] = 0
+    rv = client.post("/rest/api/files", data = fileText[:middle], headers = headers)
+    rvDict = rv.get_json()
+    assert rv.status_code == 200
+    assert rvDict["uploadOffset"] == middle
+    assert rvDict["received"] is None
+
+    # A chunk which skips data is rejected with the offset from where to continue.
+    headers["uploadOffset"] = middle + 10
+    rv = client.post("/rest/api/files", data = fileText[middle + 10:], headers = headers)
+    assert rv.status_code == 409
+    assert rv.get_json()["uploadOffset"] == middle
+
+    # Final chunk
+    headers["uploadOffset"] = middle
+    rv = client.post("/rest/api/files", data = fileText[middle:], headers = headers)
+    rvDict = rv.get_json()
+    assert rv.status_code == 200
+    assert rvDict["message"] == "Successfully received file and extracted information"
+    assert rvDict["filename"] == filename
+    with open(os.path.join(basePath, filename), "rb") as f:
+        assert f.read() == fileText
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+""" Tests for the index of the files received by the DQM receiver.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest
+
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+from overwatch.receiver import fileIndex
+
+@pytest.mark.parametrize("filename, expected", [
+    ("EMChistos_123456_DQM_1970_01_02_16_07_24.root", {"agent": "EMC", "runNumber": 123456, "timestamp": 140844}),
+    ("EMChistos_abc_DQM_1970_01_02_16_07_24.root", {"agent": "EMC", "runNumber": None, "timestamp": None}),
+    ("otherDQMFile.root", {"agent": None, "runNumber": None, "timestamp": None}),
+], ids = ["Received file", "Invalid run number", "Unknown format"])
+def testFileInformation(loggingMixin, filename, expected):
+    """ Test extracting the file information from the filename. """
+    expected["filename"] = filename
+    assert fileIndex.fileInformation(filename) == expected
+
+@pytest.fixture
+def receivedFiles(loggingMixin, tmpdir):
+    """ Create an index of a data folder containing received files from two agents and runs. """
+    filenames = ["EMChistos_123456_DQM_1970_01_02_16_07_24.root",
+                 "EMChistos_123457_DQM_1970_01_02_16_08_24.root",
+                 "TPChistos_123456_DQM_1970_01_02_16_07_34.root",
+                 "EMChistos_123457_DQM_1970_01_02_16_09_24.root"]
+    for filename in filenames:
+        tmpdir.join(filename).write("")
+    # Neither of these should be indexed.
+    tmpdir.join("notReceived.root").write("")
+    tmpdir.mkdir("EMCDQMDirectory")
+
+    index = fileIndex.receivedFileIndex(directory = str(tmpdir), refreshInterval = 60)
+    return (index, tmpdir, filenames)
+
+@pytest.mark.parametrize("selections, expectedIndices", [
+    ({}, [0, 2, 1, 3]),
+    ({"runNumber": 123457}, [1, 3]),
+    ({"agent": "TPC"}, [2]),
+    ({"minTime": 140854, "maxTime": 140904}, [2, 1]),
+], ids = ["All files", "Run number", "Agent", "Time range"])
+def testRetrieveFiles(receivedFiles, selections, expectedIndices):
+    """ Test selecting files from the index. """
+    index, tmpdir, filenames = receivedFiles
+
+    (files, nextFile) = index.retrieveFiles(**selections)
+
+    assert [f["filename"] for f in files] == [filenames[i] for i in expectedIndices]
+    assert nextFile is None
+
+def testRetrieveFilesPagination(receivedFiles):
+    """ Test retrieving the files page by page. """
+    index, tmpdir, filenames = receivedFiles
+
+    (files, nextFile) = index.retrieveFiles(limit = 3)
+    assert [f["filename"] for f in files] == [filenames[i] for i in [0, 2, 1]]
+    assert nextFile == filenames[1]
+
+    (files, nextFile) = index.retrieveFiles(limit = 3, after = nextFile)
+    assert [f["filename"] for f in files] == [filenames[3]]
+    assert nextFile is None
+
+def testIndexUpdates(receivedFiles):
+    """ Test updating the index when files are received, and when the data folder changes. """
+    index, tmpdir, filenames = receivedFiles
+    assert len(index.retrieveFiles()[0]) == 4
+    # Only the initial scan is performed until the data folder changes.
+    assert index.refresh() is False
+
+    # Received by this process
+    newFilename = "EMChistos_123457_DQM_1970_01_02_16_10_24.root"
+    tmpdir.join(newFilename).write("")
+    index.add(newFilename)
+    assert index.retrieveFiles()[0][-1]["filename"] == newFilename
+
+    # Moved out of the data folder (for example, by the processing)
+    os.remove(str(tmpdir.join(filenames[0])))
+    # Ensure that the change is visible even if the modification time resolution is coarse.
+    os.utime(str(tmpdir), (0, 0))
+    assert index.refresh() is True
+    assert filenames[0] not in [f["filename"] for f in index.retrieveFiles()[0]]
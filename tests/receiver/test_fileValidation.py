@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+""" Tests for validating received files in the background.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest  # NOQA
+
+import logging
+logger = logging.getLogger(__name__)
+
+from overwatch.receiver import fileValidation
+
+def validateFile(path):
+    """ Validation function which accepts files based on their names. """
+    if "error" in path:
+        raise IOError("Unable to open {}".format(path))
+    if "invalid" in path:
+        return (False, {})
+    return (True, {"test": "Obj name: test, Obj IsA() Name: TH1F"})
+
+def testValidationQueue(loggingMixin):
+    """ Test validating files in the background and retrieving the results. """
+    validator = fileValidation.validationQueue(validationFunction = validateFile, maxResults = 3)
+    assert validator.retrieveResults() == {}
+
+    for filename in ["valid.root", "invalid.root", "error.root"]:
+        validator.submit(filename, "data/{}".format(filename))
+    validator.join()
+
+    results = validator.retrieveResults(["valid.root", "invalid.root", "error.root", "unknown.root"])
+    assert results["valid.root"] == {"status": "valid", "received": {"test": "Obj name: test, Obj IsA() Name: TH1F"}}
+    assert results["invalid.root"] == {"status": "invalid", "received": None}
+    assert results["error.root"]["status"] == "error"
+    assert "unknown.root" not in results
+
+    # Only the most recent results are kept.
+    validator.submit("another.root", "data/another.root")
+    validator.join()
+    assert set(validator.retrieveResults()) == set(["invalid.root", "error.root", "another.root"])
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+""" Tests for the rendered fragment cache.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest
+
+import logging
+import os
+logger = logging.getLogger(__name__)
+
+from overwatch.webApp import fragmentCache
+
+@pytest.mark.parametrize("shared", [
+    False,
+    True,
+], ids = ["In-process", "Shared directory"])
+def testFragmentCache(loggingMixin, shared, tmpdir, mocker):
+    """ Test rendering, caching, and invalidating fragments. """
+    cacheDirectory = str(tmpdir) if shared else None
+    cache = fragmentCache.fragmentCache(cacheSize = 2, cacheDirectory = cacheDirectory)
+    renderFunction = mocker.MagicMock(side_effect = lambda name: "Rendered {}".format(name))
+
+    key = cache.createKey("Run123", "EMC", 1, "runPageDrawer.html", jsRoot = True, timeSliceKey = None)
+    assert cache.render(key, renderFunction, "drawer") == "Rendered drawer"
+    assert cache.render(key, renderFunction, "drawer") == "Rendered drawer"
+    assert renderFunction.call_count == 1
+
+    # Fragments for other pages or versions are independent.
+    otherKey = cache.createKey("Run123", "EMC", 1, "runPageDrawer.html", jsRoot = False, timeSliceKey = None)
+    newKey = cache.createKey("Run123", "EMC", 2, "runPageDrawer.html", jsRoot = True, timeSliceKey = None)
+    assert cache.get(otherKey) is None
+    assert cache.render(newKey, renderFunction, "new drawer") == "Rendered new drawer"
+    assert renderFunction.call_count == 2
+
+    # Emulate another process, which only has access to the shared directory.
+    anotherProcess = fragmentCache.fragmentCache(cacheSize = 2, cacheDirectory = cacheDirectory)
+    assert (anotherProcess.get(newKey) == "Rendered new drawer") is shared
+    if shared:
+        # Outdated versions are removed from the shared directory.
+        assert os.listdir(os.path.join(cacheDirectory, "Run123", "EMC")) == ["2"]
+
+def testFragmentCacheSize(loggingMixin):
+    """ Test that the least recently used fragments are removed from the in-process cache. """
+    cache = fragmentCache.fragmentCache(cacheSize = 2)
+    keys = [cache.createKey("Run123", "EMC", 1, name) for name in ["a", "b", "c"]]
+    cache.set(keys[0], "a")
+    cache.set(keys[1], "b")
+    # Use "a" so that "b" is the least recently used.
+    cache.get(keys[0])
+    cache.set(keys[2], "c")
+
+    assert list(cache.fragments) == [keys[0], keys[2]]
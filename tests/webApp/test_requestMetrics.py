@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+""" Tests for the web app request metrics.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest
+
+import logging
+logger = logging.getLogger(__name__)
+
+from overwatch.webApp import requestMetrics
+
+@pytest.mark.parametrize("values, expected", [
+    ([], (None, None, None)),
+    ([1], (1, 1, 1)),
+    (list(range(1, 101)), (50, 90, 99)),
+], ids = ["No values", "One value", "Hundred values"])
+def testPercentile(loggingMixin, values, expected):
+    """ Test determining percentiles via the nearest rank. """
+    assert tuple(requestMetrics.percentile(values, fraction) for fraction in (0.5, 0.9, 0.99)) == expected
+
+def testRequestTimer(loggingMixin, mocker):
+    """ Test measuring the phases of a request, including nested phases. """
+    mocker.patch("overwatch.webApp.requestMetrics.time.time", side_effect = [0, 1, 2, 3, 5, 6, 7, 10])
+    timer = requestMetrics.requestTimer()
+    with timer.phase("validation"):
+        # The nested phase is assigned to the outer phase.
+        with timer.phase("database"):
+            pass
+    timer.startPhase("rendering")
+    timer.stopPhase()
+    timer.startPhase("rendering")
+    timer.stopPhase()
+
+    assert list(timer.phases) == ["validation", "rendering"]
+    assert timer.phases["validation"] == 2
+    assert timer.phases["rendering"] == 4
+
+def testRequestMetrics(loggingMixin, mocker):
+    """ Test recording and summarizing requests, as well as logging slow requests. """
+    metrics = requestMetrics.requestMetrics(maxSamples = 10, slowRequestThreshold = 5)
+    mInfo = mocker.patch("overwatch.webApp.requestMetrics.logger.info")
+
+    route = "/Run<int:runNumber>/<string:subsystemName>/<string:requestedFileType>"
+    for duration in range(1, 21):
+        timer = requestMetrics.requestTimer()
+        timer.start -= duration
+        timer.phases["validation"] = duration / 2.0
+        metrics.record(route = route, timer = timer, databaseLoads = 10, responseSize = None, status = 200)
+    timer = requestMetrics.requestTimer()
+    metrics.record(route = "/monitoring", timer = timer, databaseLoads = None, responseSize = 1000, status = 200)
+
+    # Only requests which are slower than the threshold are logged.
+    assert mInfo.call_count == 16
+
+    summary = metrics.summary()
+    assert set(summary) == set([route, "/monitoring"])
+    runPage = summary[route]
+    assert runPage["count"] == 20
+    # Only the most recent samples are stored.
+    assert runPage["samples"] == 10
+    assert runPage["duration"]["p50"] == pytest.approx(15, abs = 0.1)
+    assert runPage["duration"]["p99"] == pytest.approx(20, abs = 0.1)
+    assert runPage["phases"]["validation"]["p50"] == pytest.approx(7.5)
+    assert runPage["phases"]["other"]["p50"] == pytest.approx(7.5, abs = 0.1)
+    assert runPage["meanDatabaseLoads"] == 10
+    assert runPage["meanResponseSize"] is None
+    assert summary["/monitoring"]["meanResponseSize"] == 1000
+
+def testRequestMetricsTransfer(loggingMixin, mocker):
+    """ Test that the time to send a streamed response is recorded, but isn't considered for slow requests. """
+    metrics = requestMetrics.requestMetrics(maxSamples = 10, slowRequestThreshold = 5)
+    mInfo = mocker.patch("overwatch.webApp.requestMetrics.logger.info")
+
+    for (transfer, handling) in [(20, 1), (1, 10)]:
+        timer = requestMetrics.requestTimer()
+        timer.start -= transfer + handling
+        timer.phases[requestMetrics.transferPhase] = transfer
+        measurement = metrics.record(route = "/monitoring/protected/<path:filename>", timer = timer)
+        assert measurement["duration"] == pytest.approx(transfer + handling, abs = 0.1)
+
+    # Only the request which was slow to handle is logged.
+    assert mInfo.call_count == 1
+    summary = metrics.summary()["/monitoring/protected/<path:filename>"]
+    assert summary["phases"][requestMetrics.transferPhase]["p99"] == 20
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+""" Tests for monitoring the status of other Overwatch sites.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest
+
+import logging
+import requests
+import time
+logger = logging.getLogger(__name__)
+
+from overwatch.webApp import statusMonitor
+
+@pytest.fixture
+def mockRequests(mocker):
+    """ Mock the requests to the sites, which each take some time.
+
+    Args:
+        None.
+    Returns:
+        MagicMock: The mocked ``requests.get``.
+    """
+    def get(url, timeout):
+        time.sleep(0.2)
+        if "down" in url:
+            raise requests.exceptions.ConnectionError("Connection refused")
+        response = mocker.MagicMock()
+        response.status_code = 500 if "error" in url else 200
+        return response
+
+    mGet = mocker.MagicMock(side_effect = get)
+    mocker.patch("overwatch.webApp.statusMonitor.requests.get", mGet)
+    return mGet
+
+def testRefreshSiteStatuses(loggingMixin, mockRequests):
+    """ Test checking the status of the sites concurrently. """
+    sites = {"site1": "http://up1", "site2": "http://up2", "site3": "http://down", "site4": "http://error"}
+    monitor = statusMonitor.siteStatusMonitor(sites = sites, timeout = 0.5, refreshInterval = 60)
+
+    start = time.time()
+    statuses = monitor.refresh()
+    # The requests are performed concurrently, so it should take approximately as long as one request.
+    assert time.time() - start < 0.2 * len(sites)
+
+    assert list(statuses) == list(sites)
+    assert statuses["site1"] == "Site is up!"
+    assert statuses["site2"] == "Site is up!"
+    assert list(statuses["site3"]) == ["Connection error"]
+    assert list(statuses["site4"]) == ["Request error"]
+    mockRequests.assert_any_call("http://up1/status", timeout = 0.5)
+
+def testRetrieveSiteStatuses(loggingMixin, mockRequests):
+    """ Test that the statuses are determined in the background and returned without waiting. """
+    monitor = statusMonitor.siteStatusMonitor(sites = {"site1": "http://up1"}, timeout = 0.5, refreshInterval = 60)
+
+    statuses, age = monitor.retrieveStatuses()
+    # The first check hasn't finished yet.
+    assert age is None
+    assert statuses == {}
+
+    monitor.stop()
+    statuses, age = monitor.retrieveStatuses()
+    assert statuses == {"site1": "Site is up!"}
+    assert age >= 0
+    monitor.stop()
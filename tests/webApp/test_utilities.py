@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+""" Tests for the web app utilities.
+
+.. codeauthor:: Raymond Ehlers <raymond.ehlers@cern.ch>, Yale University
+"""
+
+import pytest  # NOQA
+
+import gzip
+import json
+import logging
+import os
+import webassets
+logger = logging.getLogger(__name__)
+
+from overwatch.webApp import utilities
+
+def createAssetsEnvironment(staticFolder, autoBuild):
+    """ Create an assets environment with a single fingerprinted bundle.
+
+    Args:
+        staticFolder (str): Path to the static folder.
+        autoBuild (bool): Whether the bundles should be built when they are requested.
+    Returns:
+        webassets.Environment: The assets environment.
+    """
+    environment = webassets.Environment(staticFolder, "/static")
+    environment.versions = "hash"
+    environment.url_expire = False
+    environment.manifest = "json:gen/assetsManifest.json"
+    environment.auto_build = autoBuild
+    environment.cache = False
+    environment.register("sharedJS", webassets.Bundle("a.js", "b.js", output = "gen/shared.%(version)s.js"))
+    return environment
+
+def testBuildAssets(loggingMixin, tmpdir):
+    """ Test building fingerprinted and compressed bundles ahead of time. """
+    staticFolder = tmpdir.mkdir("static")
+    staticFolder.join("a.js").write("var a = 1;")
+    staticFolder.join("b.js").write("var b = 2;")
+
+    outputFilenames = utilities.buildAssets(createAssetsEnvironment(str(staticFolder), autoBuild = True))
+
+    assert len(outputFilenames) == 1
+    outputFilename = outputFilenames[0]
+    with open(outputFilename, "r") as f:
+        content = f.read()
+    assert "var a = 1;" in content and "var b = 2;" in content
+    # The version is stored in the manifest, and is part of the filename.
+    with open(str(staticFolder.join("gen", "assetsManifest.json")), "r") as f:
+        manifest = json.load(f)
+    version = manifest["gen/shared.%(version)s.js"]
+    assert os.path.basename(outputFilename) == "shared.{version}.js".format(version = version)
+    # Compressed copy
+    with gzip.open(outputFilename + ".gz", "rb") as f:
+        assert f.read().decode() == content
+
+    # Without automatically building, the URL is determined from the manifest.
+    environment = createAssetsEnvironment(str(staticFolder), autoBuild = False)
+    assert environment["sharedJS"].urls() == ["/static/gen/shared.{version}.js".format(version = version)]